@@ -0,0 +1,160 @@
+import psutil
+from collections import deque
+from pathlib import Path
+import gzip
+import json
+import signal
+import threading
+import time
+import urllib.error
+import urllib.request
+from .common import settings
+from .common.logger import logger
+from .job import collector
+from .job.rollup import SystemStatsRollup
+
+'''
+    エージェント(settings.MODE='agent'): システム状態を測定して集約サーバ(AGGREGATOR_URL)に送るだけの軽いモード。
+
+    APIサーバ・ストレージ・プロセスの走査を動かさず、METRICS_INTERVALごとにcpu_percent・mem_available・disk_usedを測定し、
+    ロールアップ(settings.ROLLUPS)もここで計算して、AGENT_SEND_INTERVALごとに1回のPOST(gzipで圧縮したJSON)で送る。
+    送れなかった分はAGENT_QUEUE_MAX件まで残して次の送信で再送し、超えたら古いものから捨てる。
+
+    usage: MODE=agent AGGREGATOR_URL=http://central:8000 HOST_NAME=web-1 python main.py
+'''
+
+# NOTE: ホストの/procを参照する(job.metricsと同じ)
+psutil.PROCFS_PATH = str(Path(settings.ROOTFS_PATH) / 'proc')
+
+# MARK: Agent
+class Agent:
+    def __init__(self, url: str, host: str, token: str = '', queue_max: int = settings.AGENT_QUEUE_MAX):
+        self.url = url.rstrip('/') + '/api/v1/ingest'
+        self.host = host
+        self.token = token
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._samples: deque[tuple[int, int, tuple[float, ...]]] = deque()        # (番号, 時刻, recent.FIELDSの値)
+        self._rollups: deque[tuple[int, str, int, dict[str, float]]] = deque()    # (番号, every, 開始時刻, fields)
+        self.queue_max = queue_max
+        self.rollups = [SystemStatsRollup(rollup, write=self._put_rollup) for rollup in settings.ROLLUPS]
+        self.sent_samples = 0
+        self.dropped_samples = 0
+        self.send_errors = 0
+
+    # MARK: collect
+    def collect(self):
+        '''システム状態を測定して送信キューに積む。'''
+        t = time.time_ns()
+        self.add(t, (
+            psutil.cpu_percent(),
+            float(psutil.virtual_memory().available),
+            float(psutil.disk_usage(settings.ROOTFS_PATH).used),
+        ))
+
+    def add(self, t: int, row: tuple[float, ...]):
+        '''サンプル(recent.FIELDSの値)をロールアップに加えて送信キューに積む。'''
+        for rollup in self.rollups:
+            rollup.add(t, row)
+        with self._lock:
+            self._seq += 1
+            self._samples.append((self._seq, t, row))
+            self._drop_overflow(self._samples)
+
+    def _put_rollup(self, every: str, time: int, fields: dict[str, float]):
+        with self._lock:
+            self._seq += 1
+            self._rollups.append((self._seq, every, time, fields))
+            self._drop_overflow(self._rollups)
+
+    def _drop_overflow(self, queue: deque):
+        while len(queue) > self.queue_max:
+            queue.popleft()
+            if queue is self._samples:
+                self.dropped_samples += 1
+
+    # MARK: send
+    def batch(self, mem_total: float, disk_total: float) -> tuple[int, int, bytes]|None:
+        '''溜まっているサンプルとロールアップを1つの本文(gzipで圧縮したJSON)にする。
+
+        Returns:
+            tuple[int, int, bytes]|None: 送れた後にackに渡す番号、サンプル数、本文(何もなければNone)
+        '''
+        with self._lock:
+            samples = list(self._samples)
+            rollups = list(self._rollups)
+        if not samples and not rollups:
+            return None
+        body = gzip.compress(json.dumps(dict(
+            host=self.host,
+            mem_total=mem_total,
+            disk_total=disk_total,
+            time=[t for _, t, _ in samples],
+            values=[row for _, _, row in samples],
+            rollups=[dict(every=every, time=t, fields=fields) for _, every, t, fields in rollups],
+        ), separators=(',', ':')).encode(), compresslevel=6)
+        last = max(samples[-1][0] if samples else 0, rollups[-1][0] if rollups else 0)
+        return last, len(samples), body
+
+    def ack(self, last: int, count: int):
+        '''番号last以前を送れたのでキューから取り除く。(送っている間に積まれた分は残す)'''
+        with self._lock:
+            while self._samples and self._samples[0][0] <= last:
+                self._samples.popleft()
+            while self._rollups and self._rollups[0][0] <= last:
+                self._rollups.popleft()
+        self.sent_samples += count
+
+    def send(self) -> bool:
+        '''溜まっているサンプルとロールアップを1回のリクエストで送る。送れた分だけキューから取り除く。'''
+        batch = self.batch(float(psutil.virtual_memory().total), float(psutil.disk_usage(settings.ROOTFS_PATH).total))
+        if batch is None:
+            return True
+        last, count, body = batch
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        try:
+            # NOTE: 次の送信までに終わるようにする
+            with urllib.request.urlopen(request, timeout=min(10.0, settings.AGENT_SEND_INTERVAL)) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as e:
+            self.send_errors += 1
+            logger.warning(f'failed to send {count} samples to {self.url}: {e}')
+            return False
+        self.ack(last, count)
+        return True
+
+    def flush(self):
+        '''集計途中のロールアップを積んで、残りを送る。(終了時)'''
+        for rollup in self.rollups:
+            rollup.flush()
+        self.send()
+
+    @property
+    def queued_samples(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+# MARK: run
+def run():
+    '''SIGTERM・SIGINTを受けるまで測定と送信を続ける。'''
+    agent = Agent(settings.AGGREGATOR_URL, settings.HOST_NAME, settings.INGEST_TOKEN)
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    psutil.cpu_percent()    # 初回のcpu_percentのキャッシュ用
+    logger.info(f'agent {agent.host} started: sending to {agent.url} every {settings.AGENT_SEND_INTERVAL}s')
+    collector.start([
+        ('system_stats', settings.METRICS_INTERVAL, agent.collect),
+        ('send', settings.AGENT_SEND_INTERVAL, agent.send),
+    ])
+    stop.wait()
+    collector.stop()
+    agent.flush()
+    logger.info(f'agent stopped: sent={agent.sent_samples} dropped={agent.dropped_samples} unsent={agent.queued_samples}')
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, Query
+from pydantic import BaseModel
+from pathlib import Path
+from datetime import datetime
+from dateutil import tz
+from typing import Literal
+from ...job import alerts
+
+'''
+    アラートのルールの状態と、直近の窓の統計量(job.alerts.AlertEngineがサンプルごとに更新した値)を返す。
+
+    ストレージには問い合わせないため、ルールが多くても、頻繁に取得してもクエリの負荷は増えない。
+'''
+
+# MARK: AlertRecord
+class AlertRecord(BaseModel):
+    name: str
+    metric: str
+    stat: str
+    window_seconds: float
+    op: str
+    threshold: float
+    for_seconds: float
+    state: str
+    since: datetime|None = None     # 条件を満たし始めた時刻
+    value: float|None = None        # 最後に評価した値
+
+# MARK: AlertsResponse
+class AlertsResponse(BaseModel):
+    timestamp: datetime
+    alerts: list[AlertRecord]
+
+# MARK: RollingStatRecord
+class RollingStatRecord(BaseModel):
+    metric: str
+    stat: str
+    window_seconds: float
+    value: float
+
+# MARK: RollingStatsResponse
+class RollingStatsResponse(BaseModel):
+    timestamp: datetime
+    time: datetime|None = None      # 最新のサンプルの時刻
+    stats: list[RollingStatRecord]
+
+def create_router(base_path: Path) -> APIRouter:
+    # MARK: /api/v1/alerts
+    router = APIRouter(prefix='/alerts')
+
+    @router.get('', response_model=AlertsResponse)
+    def get_alerts(
+        state: Literal['firing', 'pending', 'all'] = Query(default='firing', description='alerts to return'),
+    ):
+        '''ルールの状態を取得する。(state=firingは発報中、pendingは継続時間を待っているものも含める、allは全て)'''
+        states = {
+            'firing': {alerts.STATE_FIRING},
+            'pending': {alerts.STATE_FIRING, alerts.STATE_PENDING},
+        }.get(state)
+        records = []
+        for alert in alerts.engine.alerts():
+            if states is not None and alert['state'] not in states:
+                continue
+            records.append(AlertRecord(
+                **alert['rule'].model_dump(),
+                state=alert['state'],
+                since=_to_datetime(alert['since']),
+                value=alert['value'],
+            ))
+        return AlertsResponse(timestamp=datetime.now(tz=tz.UTC), alerts=records)
+
+    # MARK: /api/v1/alerts/stats
+    @router.get('/stats', response_model=RollingStatsResponse)
+    def get_rolling_stats():
+        '''各metricの最新値と、窓(window_seconds)ごとのmax・min・mean、時定数ごとのewmaを取得する。'''
+        t, records = alerts.engine.stats()
+        return RollingStatsResponse(
+            timestamp=datetime.now(tz=tz.UTC),
+            time=_to_datetime(t),
+            stats=[RollingStatRecord(**record) for record in records],
+        )
+
+    return router
+
+def _to_datetime(t: int|None) -> datetime|None:
+    return None if t is None else datetime.fromtimestamp(t / 1_000_000_000, tz=tz.UTC)
@@ -0,0 +1,97 @@
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field, ValidationError
+from pathlib import Path
+import hmac
+import zlib
+from ...db import database, recent
+from ...common import settings, instrument
+from ...common.logger import logger
+
+'''
+    エージェント(settings.MODE='agent')が送ってくるサンプルとロールアップを受け取る。(settings.MODE='aggregator'のときだけ)
+
+    エージェントは測定したサンプルをAGENT_SEND_INTERVALごとにまとめ、gzipで圧縮したJSONでPOSTする。
+    ロールアップはエージェントが計算して送るため、集約サーバはホストごとの状態を持たずに書き込むだけで済む。
+'''
+
+MAX_BODY_BYTES = 16 * 1024 * 1024   # 展開後の本文の上限
+
+_ingested_samples = instrument.counter('psmon_ingest_samples_total', 'Samples received from agents', ('host',))
+_ingested_rollups = instrument.counter('psmon_ingest_rollups_total', 'Rollup buckets received from agents', ('host',))
+_ingest_seconds = instrument.histogram('psmon_ingest_seconds', 'Time spent decoding and queueing an ingest request')
+
+# MARK: IngestRollup
+class IngestRollup(BaseModel):
+    every: str
+    time: int
+    fields: dict[str, float]
+
+# MARK: IngestRequest
+class IngestRequest(BaseModel):
+    host: str = Field(pattern=r'^[A-Za-z0-9][A-Za-z0-9._-]{0,252}$')
+    mem_total: float|None = None
+    disk_total: float|None = None
+    time: list[int] = []                        # サンプルの時刻(ns)
+    values: list[list[float|None]] = []         # サンプルごとのrecent.FIELDSの値
+    rollups: list[IngestRollup] = []
+
+# MARK: IngestResponse
+class IngestResponse(BaseModel):
+    samples: int
+    rollups: int
+
+def create_router(base_path: Path) -> APIRouter:
+    # MARK: /api/v1/ingest
+    router = APIRouter(prefix='/ingest')
+    if settings.MODE != 'aggregator':
+        return router
+
+    rollup_names = {rollup.every for rollup in settings.ROLLUPS}
+    rollup_fields = {f'{field}_{stat}' for field in recent.FIELDS for stat in ('max', 'sum', 'count')}
+
+    @router.post('', response_model=IngestResponse)
+    async def ingest(request: Request):
+        '''エージェントのサンプル(time・values)とロールアップをまとめて受け取る。本文はJSON(Content-Encoding: gzipも可)。'''
+        if settings.INGEST_TOKEN and not hmac.compare_digest(
+            request.headers.get('authorization', ''), f'Bearer {settings.INGEST_TOKEN}',
+        ):
+            raise HTTPException(status_code=401, detail='Invalid ingest token.')
+        if not database.storage:
+            raise HTTPException(status_code=500, detail='database client is not initialized.')
+        body = await request.body()
+        with _ingest_seconds.time():
+            if request.headers.get('content-encoding', '') == 'gzip':
+                body = _decompress(body)
+            try:
+                data = IngestRequest.model_validate_json(body)
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+            if len(data.time) != len(data.values) or any(len(row) != len(recent.FIELDS) for row in data.values):
+                raise HTTPException(status_code=422, detail=f'values must have {len(recent.FIELDS)} fields for each time.')
+            for rollup in data.rollups:
+                if rollup.every not in rollup_names or set(rollup.fields) != rollup_fields:
+                    raise HTTPException(status_code=422, detail=f'Invalid rollup: every={rollup.every}')
+
+            if data.time:
+                database.write_host_stats(data.host, [
+                    (t, *row, data.mem_total, data.disk_total) for t, row in zip(data.time, data.values)
+                ])
+            for rollup in data.rollups:
+                database.write_host_stats_rollup(data.host, rollup.every, rollup.time, rollup.fields)
+        _ingested_samples.inc(data.host, amount=len(data.time))
+        _ingested_rollups.inc(data.host, amount=len(data.rollups))
+        return IngestResponse(samples=len(data.time), rollups=len(data.rollups))
+
+    logger.info('accepting samples from agents on /api/v1/ingest')
+    return router
+
+def _decompress(body: bytes) -> bytes:
+    '''gzipの本文を展開する。展開後がMAX_BODY_BYTESを超える場合は413にする。'''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        output = decompressor.decompress(body, MAX_BODY_BYTES + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail='Invalid gzip body.')
+    if len(output) > MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail='Request body is too large.')
+    return output
@@ -1,12 +1,26 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from pathlib import Path
 from importlib.metadata import version
+from ...db import database
+from ...job import leader
+from .monitor import response_cache
+from ...job.collector import CollectorStats, get_stats as get_collector_stats
+from ...common import instrument
 
 # MARK: VersionResponse
 class VersionResponse(BaseModel):
     version: str
 
+# MARK: StatsResponse
+class StatsResponse(BaseModel):
+    leader: bool = False
+    write: database.WriteStats|None = None
+    cache: database.cache.CacheStats|None = None
+    response_cache: database.cache.CacheStats|None = None
+    collector: dict[str, CollectorStats] = {}
+
 def create_router(base_path: Path) -> APIRouter:
     # MARK: /api/v1/misc
     router = APIRouter(prefix='/misc')
@@ -19,5 +33,23 @@ def create_router(base_path: Path) -> APIRouter:
             return VersionResponse(version=version('psmon'))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
+
+    # MARK: /api/v1/misc/stats
+    @router.get('/stats', response_model=StatsResponse)
+    def get_stats():
+        '''psmon自身の内部統計を取得する。'''
+        return StatsResponse(
+            leader=leader.is_leader(), 
+            write=database.get_write_stats(), 
+            cache=database.get_cache_stats(), 
+            response_cache=response_cache.stats(), 
+            collector=get_collector_stats(), 
+        )
+
+    # MARK: /api/v1/misc/metrics
+    @router.get('/metrics', response_class=PlainTextResponse)
+    def get_metrics():
+        '''psmon自身の計測値をPrometheusのテキスト形式で取得する。'''
+        return PlainTextResponse(instrument.render(), media_type='text/plain; version=0.0.4')
     
     return router
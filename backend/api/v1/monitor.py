@@ -1,11 +1,22 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from pathlib import Path
-from collections import defaultdict
-from datetime import datetime
-from ...db import database
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Literal
+import asyncio
+import hashlib
+import json
+import struct
+import sys
+from ...db import database, downsample
+from ...db.cache import QueryCache
+from ...db.storage import PROCESS_METRICS, CGROUP_METRICS, columns_to_records
 from ...job import metrics
-from ...common import settings
+from ...job.burst import sampler as burst_sampler, BurstStatus
+from ...job.broadcast import broadcaster
+from ...common import settings, instrument, encoding
 
 # MARK: MonitorRecord
 class MonitorRecord(BaseModel):
@@ -23,6 +34,7 @@ class MonitorResponse(BaseModel):
     timestamp: datetime
     mem_total: float
     disk_total: float
+    every_seconds: int
     records: list[MonitorRecord] = []
 
 # MARK: MonitorResponseCompact
@@ -30,7 +42,8 @@ class MonitorResponseCompact(BaseModel):
     timestamp: datetime
     mem_total: float
     disk_total: float
-    records: dict[str, list[datetime|float|None]]
+    every_seconds: int
+    records: dict[str, list[int|float|None]]
 
 # MARK: ProcessCpuRecord
 class ProcessCpuRecord(BaseModel):
@@ -45,6 +58,72 @@ class ProcessCpuResponse(BaseModel):
     timestamp: datetime
     records: list[ProcessCpuRecord]
 
+# MARK: ProcessRecord
+class ProcessRecord(BaseModel):
+    pid: int
+    name: str
+    max: float
+    min: float
+    mean: float
+
+# MARK: ProcessResponse
+class ProcessResponse(BaseModel):
+    timestamp: datetime
+    metric: str
+    records: list[ProcessRecord]
+
+# MARK: ProcessTimelineEntry
+class ProcessTimelineEntry(BaseModel):
+    pid: int
+    name: str
+
+# MARK: ProcessTimelineResponse
+class ProcessTimelineResponse(BaseModel):
+    timestamp: datetime
+    metric: str
+    every_seconds: int
+    time: list[int]
+    processes: list[ProcessTimelineEntry]
+    mean: list[list[float|None]]
+    max: list[list[float|None]]
+
+# MARK: CgroupRecord
+class CgroupRecord(BaseModel):
+    name: str
+    cpu_max: float
+    cpu_mean: float
+    memory_max: float
+    memory_mean: float
+    read_max: float
+    read_mean: float
+    write_max: float
+    write_mean: float
+
+# MARK: CgroupResponse
+class CgroupResponse(BaseModel):
+    timestamp: datetime
+    time: datetime
+    metric: str
+    every_seconds: int
+    records: list[CgroupRecord]
+
+# MARK: BurstResponse
+class BurstResponse(BurstStatus):
+    timestamp: datetime
+    records: dict[str, list[int|float|None]]
+
+# MARK: HostRecord
+class HostRecord(BaseModel):
+    host: str
+    last_seen: datetime
+    mem_total: float|None = None
+    disk_total: float|None = None
+
+# MARK: HostsResponse
+class HostsResponse(BaseModel):
+    timestamp: datetime
+    hosts: list[HostRecord]
+
 def create_router(base_path: Path) -> APIRouter:
     # MARK: /api/v1/monitor
     router = APIRouter(prefix='/monitor')
@@ -63,104 +142,544 @@ def create_router(base_path: Path) -> APIRouter:
 
     # MARK: /api/v1/monitor/json
     @router.get('/json', response_model=MonitorResponse)
-    def get_monitor_records_in_json(
+    async def get_monitor_records_in_json(
+        request: Request, 
         duration_index: int = Query(default=0, description='duration index to query'),
-        start_time: datetime|None = Query(default=None, description='start time to query')
+        start_time: datetime|None = Query(default=None, description='start time to query'),
+        start: datetime|None = Query(default=None, description='start of an arbitrary range (default: the start of the duration)'),
+        stop: datetime|None = Query(default=None, description='end of an arbitrary range (default: now)'),
+        max_points: int|None = Query(default=None, ge=3, le=MAX_POINTS_LIMIT, description='number of points to return for a range'),
+        host: str|None = Query(default=None, pattern=HOST_PATTERN, description="agent host to query ('*' for all hosts, default: this host)"),
     ):
-        '''モニタリングしていたデータをJSON形式で取得する。'''
-        if not database.client:
+        '''モニタリングしていたデータをJSON形式で取得する。(start・stop・max_points・hostは/api/v1/monitorを参照)'''
+        if not database.storage:
             raise HTTPException(status_code=500, detail='database client is not initialized.')
-        timestamp, records = database.get_system_stats_records_by_time(
-            duration_index=duration_index,
-            start_time=start_time,
-        )
-        return MonitorResponse(
-            timestamp=timestamp, 
-            mem_total=metrics.get_mem_total(), 
-            disk_total=metrics.get_disk_total(), 
-            records=records, 
+        key, every_seconds, fetch = _system_stats_source(duration_index, start_time, start, stop, max_points, host)
+
+        async def encode() -> bytes:
+            timestamp, columns, mem_total, disk_total = await fetch()
+            return MonitorResponse(
+                timestamp=timestamp, 
+                mem_total=mem_total, 
+                disk_total=disk_total, 
+                every_seconds=every_seconds, 
+                records=columns_to_records(columns), 
+            ).model_dump_json(by_alias=True).encode()
+
+        return await _conditional_response(
+            request, ('json', *key), every_seconds, 'application/json', encode, delay=_host_delay(host),
         )
 
     # MARK: /api/v1/monitor
-    @router.get('', response_model=MonitorResponseCompact)
-    def get_monitor_records_by_field(
+    @router.get('', response_model=MonitorResponseCompact, responses={200: {'content': {BINARY_MEDIA_TYPE: {}}}})
+    async def get_monitor_records_by_field(
+        request: Request, 
         duration_index: int = Query(default=0, description='duration index to query'),
-        start_time: datetime|None = Query(default=None, description='start time to query')
+        start_time: datetime|None = Query(default=None, description='start time to query'),
+        start: datetime|None = Query(default=None, description='start of an arbitrary range (default: the start of the duration)'),
+        stop: datetime|None = Query(default=None, description='end of an arbitrary range (default: now)'),
+        max_points: int|None = Query(default=None, ge=3, le=MAX_POINTS_LIMIT, description='number of points to return for a range'),
+        format: Literal['json', 'binary']|None = Query(default=None, description='response format (default: negotiated by Accept header)'),
+        host: str|None = Query(default=None, pattern=HOST_PATTERN, description="agent host to query ('*' for all hosts, default: this host)"),
     ):
-        '''モニタリングしていたデータをフィールドごとに取得する。'''
-        if not database.client:
+        '''モニタリングしていたデータをフィールドごとに取得する。timeはエポックミリ秒。
+
+        format=binary(またはAccept: application/octet-stream)の場合は列ごとのfloat64配列で返す。
+
+        startかmax_pointsを指定した場合は、任意の期間[start, stop)をmax_points個以下の点で返す。
+        期間の長さに応じて集計する間隔(every_seconds)を選び、LTTBで形を保ったまま間引く。
+
+        hostを指定した場合は、このホストの代わりにエージェント(settings.MODE='agent')から受け取ったデータを返す。
+        host=*の場合は全ホストをまとめ、窓ごとに各ホストのmaxの最大とmeanの平均、データがあったホストの数(hosts)を返す。
+        (mem_total・disk_totalはそのホスト、またはホストの平均)
+        '''
+        if not database.storage:
             raise HTTPException(status_code=500, detail='database client is not initialized.')
-        timestamp, _records = database.get_system_stats_records_by_time(
-            duration_index=duration_index,
-            start_time=start_time,
+        binary = format == 'binary' or (format is None and BINARY_MEDIA_TYPE in request.headers.get('accept', ''))
+        key, every_seconds, fetch = _system_stats_source(duration_index, start_time, start, stop, max_points, host)
+
+        async def encode() -> bytes:
+            timestamp, columns, mem_total, disk_total = await fetch()
+            header = dict(
+                timestamp=timestamp.isoformat(), 
+                mem_total=float(mem_total), 
+                disk_total=float(disk_total), 
+                every_seconds=every_seconds, 
+            )
+            if binary:
+                with _serialize_seconds.time('binary'):
+                    return encode_columns_binary(header, columns)
+            with _serialize_seconds.time('json'):
+                return encode_columns_json(header, columns)
+
+        return await _conditional_response(
+            request, ('binary' if binary else 'compact', *key), every_seconds, 
+            BINARY_MEDIA_TYPE if binary else 'application/json', encode, delay=_host_delay(host),
         )
-        _res = MonitorResponse(
-            timestamp=timestamp, 
-            mem_total=metrics.get_mem_total(), 
-            disk_total=metrics.get_disk_total(), 
-            records=_records, 
+
+    # MARK: /api/v1/monitor/hosts
+    @router.get('/hosts', response_model=HostsResponse)
+    async def get_hosts(request: Request):
+        '''直近にサンプルを送ってきたエージェントのホストの一覧を取得する。'''
+        if not database.storage:
+            raise HTTPException(status_code=500, detail='database client is not initialized.')
+
+        async def encode() -> bytes:
+            timestamp, hosts = await database.get_hosts()
+            return HostsResponse(
+                timestamp=timestamp, 
+                hosts=[
+                    HostRecord(
+                        host=x['host'], 
+                        last_seen=datetime.fromtimestamp(x['last_seen'] / 1e9, tz=timezone.utc), 
+                        mem_total=x['mem_total'], 
+                        disk_total=x['disk_total'], 
+                    )
+                    for x in hosts
+                ], 
+            ).model_dump_json().encode()
+
+        return await _conditional_response(request, ('hosts',), settings.METRICS_INTERVAL, 'application/json', encode)
+
+    # MARK: /api/v1/monitor/stream
+    @router.get('/stream')
+    async def stream_monitor_records(
+        duration_index: int = Query(default=0, description='duration index of buckets to stream'),
+    ):
+        '''新しいサンプル(sample)と閉じたバケット(bucket)、アラートの状態の変化(alert)をServer-Sent Eventsで配信する。
+
+        クライアントが遅れてイベントが溢れた場合はresetイベントを送るので、データを取得し直すこと。
+        '''
+        if duration_index < 0 or duration_index >= len(settings.DURATIONS):
+            raise HTTPException(status_code=400, detail='Invalid duration index.')
+        every_seconds = settings.DURATIONS[duration_index].every_seconds
+        subscriber = broadcaster.subscribe({'sample', f'bucket:{every_seconds}', 'alert'})
+
+        async def events():
+            try:
+                yield ': connected\n\n'
+                while True:
+                    try:
+                        payload = await asyncio.wait_for(subscriber.queue.get(), timeout=settings.STREAM_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        payload = ': keepalive\n\n'
+                    yield payload
+            finally:
+                broadcaster.unsubscribe(subscriber)
+
+        return StreamingResponse(
+            events(), 
+            media_type='text/event-stream', 
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, 
         )
 
-        records = defaultdict(list)
-        for record in _res.records:
-            for key in MonitorRecord.model_fields.keys():
-                records[key].append(getattr(record, key))
-        return MonitorResponseCompact(
-            timestamp=timestamp, 
-            mem_total=_res.mem_total, 
-            disk_total=_res.disk_total, 
-            records=records, 
+    # MARK: /api/v1/monitor/cgroups
+    @router.get('/cgroups', response_model=CgroupResponse)
+    async def get_cgroup_records(
+        request: Request, 
+        time: datetime|None = Query(default=None, description='time to query (default: end of the last closed window)'),
+        duration_index: int = Query(default=0, description='duration index to query'),
+        metric: str = Query(default='cpu', description='metric to sort by'),
+    ):
+        '''cgroup(コンテナ・サービス)ごとのCPU使用率・メモリ[バイト]・読み書き[バイト/秒]を、timeまでの窓の
+        metric(cpu・memory・read・write)の平均が高い順に取得する。
+        '''
+        if metric not in CGROUP_METRICS:
+            raise HTTPException(status_code=404, detail=f'Unknown cgroup metric: {metric}')
+        if not database.storage:
+            raise HTTPException(status_code=500, detail='database client is not initialized.')
+        every_seconds = _every_seconds(duration_index)
+
+        async def encode() -> bytes:
+            timestamp, end, _records = await database.get_cgroup_records_at_time(
+                time=time,
+                every_seconds=every_seconds,
+            )
+            return CgroupResponse(
+                timestamp=timestamp, 
+                time=end, 
+                metric=metric, 
+                every_seconds=every_seconds, 
+                records=_compute_cgroup_records(_records, metric), 
+            ).model_dump_json().encode()
+
+        return await _conditional_response(
+            request, ('cgroups', metric, duration_index, time), every_seconds, 'application/json', encode,
         )
 
+    # MARK: /api/v1/monitor/burst
+    @router.post('/burst', response_model=BurstStatus)
+    def start_burst(
+        duration_seconds: float = Query(default=30, gt=0, le=settings.BURST_MAX_SECONDS, description='seconds to sample'),
+        interval_ms: int = Query(default=settings.BURST_INTERVAL_MS, ge=10, le=100, description='sampling interval in milliseconds'),
+    ):
+        '''バースト測定(システム状態とコアごとのCPU使用率をinterval_msごとに測定)をduration_seconds秒間行う。'''
+        _check_burst_available()
+        status = burst_sampler.start(duration_seconds, interval_ms)
+        if status is None:
+            raise HTTPException(status_code=409, detail='Burst sampling is already running.')
+        return status
+
+    @router.delete('/burst', response_model=BurstStatus)
+    def stop_burst():
+        '''実行中のバースト測定を止める。(測定したサンプルは残る)'''
+        _check_burst_available()
+        burst_sampler.stop()
+        return burst_sampler.status()
+
+    @router.get('/burst', response_model=BurstResponse, responses={200: {'content': {BINARY_MEDIA_TYPE: {}}}})
+    async def get_burst_records(
+        request: Request, 
+        start: int|None = Query(default=None, description='return samples after this time (epoch milliseconds)'),
+        max_points: int|None = Query(default=None, ge=3, le=MAX_POINTS_LIMIT, description='number of points to downsample to'),
+        format: Literal['json', 'binary']|None = Query(default=None, description='response format (default: negotiated by Accept header)'),
+    ):
+        '''最後のバースト測定のサンプルを列ごと(time、recent.FIELDS、cpu0〜)に取得する。timeはエポックミリ秒。
+
+        実行中はstartに前回の最後のtimeを指定すると、それ以降のサンプルだけを返す。
+        max_pointsを指定した場合はLTTBで間引く。
+        '''
+        _check_burst_available()
+        binary = format == 'binary' or (format is None and BINARY_MEDIA_TYPE in request.headers.get('accept', ''))
+        status = burst_sampler.status()
+        if status.start is None:
+            raise HTTPException(status_code=404, detail='No burst sampling has been run.')
+        # NOTE: サンプルが増えていなければ同じ内容なので、展開せずに304を返す
+        key = ('burst', status.start, status.samples, status.running, start, max_points, binary)
+        etag = f'W/"{hashlib.sha1(repr(key).encode()).hexdigest()[:20]}"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+        if encoding.not_modified(request.headers.get('if-none-match'), (etag,)):
+            _not_modified.inc('burst')
+            return Response(status_code=304, headers=headers)
+
+        def encode() -> bytes:
+            status, columns = burst_sampler.columns(start)
+            if max_points:
+                columns = downsample.lttb(columns, max_points)
+            header = dict(status.model_dump(), timestamp=datetime.now(tz=timezone.utc).isoformat())
+            if binary:
+                with _serialize_seconds.time('binary'):
+                    return encode_columns_binary(header, columns)
+            with _serialize_seconds.time('json'):
+                return encode_columns_json(header, columns)
+
+        content = await asyncio.to_thread(encode)
+        coding = 'identity'
+        if len(content) >= encoding.MIN_COMPRESS_SIZE:
+            coding = encoding.negotiate(request.headers.get('accept-encoding', ''), encoding.ENCODINGS)
+        if coding != 'identity':
+            content = await asyncio.to_thread(encoding.compress, content, coding)
+            headers['Content-Encoding'] = coding
+        return Response(content=content, media_type=BINARY_MEDIA_TYPE if binary else 'application/json', headers=headers)
+
     # MARK: /api/v1/monitor/process-cpu
     @router.get('/process-cpu', response_model=ProcessCpuResponse)
-    def get_process_cpu_records(
+    async def get_process_cpu_records(
+        request: Request, 
         time: datetime = Query(description='time to query'),
         duration_index: int = Query(default=0, description='duration index to query'),
     ):
         '''プロセスのCPU使用率を取得する。'''
-        if not database.client:
+        if not database.storage:
             raise HTTPException(status_code=500, detail='database client is not initialized.')
-        timestamp, _records = database.get_process_cpu_record_at_time(
-            time=time,
-            every_seconds=settings.DURATIONS[duration_index].every_seconds,
+        every_seconds = _every_seconds(duration_index)
+
+        async def encode() -> bytes:
+            timestamp, _records = await database.get_process_records_at_time(
+                metric='cpu',
+                time=time,
+                every_seconds=every_seconds,
+            )
+            return ProcessCpuResponse(
+                timestamp=timestamp, 
+                records=[
+                    ProcessCpuRecord(pid=x.pid, name=x.name, cpu_max=x.max, cpu_min=x.min, cpu_mean=x.mean)
+                    for x in _compute_process_records(_records)
+                ], 
+            ).model_dump_json().encode()
+
+        return await _conditional_response(
+            request, ('process-cpu', duration_index, time), every_seconds, 'application/json', encode,
         )
 
-        return ProcessCpuResponse(
-            timestamp=timestamp, 
-            records=_compute_process_cpu_records(_records), 
+    # MARK: /api/v1/monitor/process-{metric}
+    @router.get('/process-{metric}', response_model=ProcessResponse)
+    async def get_process_records(
+        request: Request, 
+        metric: str,
+        time: datetime = Query(description='time to query'),
+        duration_index: int = Query(default=0, description='duration index to query'),
+    ):
+        '''プロセスごとの値(metric: rss=常駐メモリ[バイト]、read/write=ストレージの読み書き[バイト/秒])の上位を取得する。'''
+        if metric not in PROCESS_METRICS:
+            raise HTTPException(status_code=404, detail=f'Unknown process metric: {metric}')
+        if not database.storage:
+            raise HTTPException(status_code=500, detail='database client is not initialized.')
+        every_seconds = _every_seconds(duration_index)
+
+        async def encode() -> bytes:
+            timestamp, _records = await database.get_process_records_at_time(
+                metric=metric,
+                time=time,
+                every_seconds=every_seconds,
+            )
+            return ProcessResponse(
+                timestamp=timestamp, 
+                metric=metric, 
+                records=_compute_process_records(_records), 
+            ).model_dump_json().encode()
+
+        return await _conditional_response(
+            request, (f'process-{metric}', duration_index, time), every_seconds, 'application/json', encode,
+        )
+
+    # MARK: /api/v1/monitor/process-{metric}/timeline
+    @router.get('/process-{metric}/timeline', response_model=ProcessTimelineResponse)
+    async def get_process_timeline(
+        request: Request, 
+        metric: str,
+        duration_index: int = Query(default=0, description='duration index to query'),
+    ):
+        '''期間の全ての窓について、窓ごとのプロセスの上位(ヒートマップ用)を1回で取得する。
+
+        timeは窓の終了時刻(エポックミリ秒)。processes[i]の窓ごとの値がmean[i]・max[i]で、
+        その窓で上位に入らなかった場合はnullになる。processesは期間全体の合計が大きい順。
+        '''
+        if metric not in PROCESS_METRICS:
+            raise HTTPException(status_code=404, detail=f'Unknown process metric: {metric}')
+        if not database.storage:
+            raise HTTPException(status_code=500, detail='database client is not initialized.')
+        every_seconds = _every_seconds(duration_index)
+
+        async def encode() -> bytes:
+            timestamp, start, end, _records = await database.get_process_timeline(
+                metric=metric,
+                duration_index=duration_index,
+            )
+            return _compute_process_timeline(timestamp, metric, every_seconds, start, end, _records).model_dump_json().encode()
+
+        return await _conditional_response(
+            request, (f'process-{metric}-timeline', duration_index), every_seconds, 'application/json', encode,
         )
 
     return router
 
+# MARK: conditional responses
+
+BINARY_MEDIA_TYPE = 'application/octet-stream'
+MAX_POINTS_LIMIT = 10000    # max_pointsの上限
+HOST_PATTERN = r'^(\*|[A-Za-z0-9][A-Za-z0-9._-]{0,252})$'   # hostに指定できる値(*は全ホスト)
+FLEET = '*'
+
+_serialize_seconds = instrument.histogram('psmon_serialize_seconds', 'Time spent encoding monitor responses', ('format',))
+_not_modified = instrument.counter('psmon_not_modified_total', 'Monitor requests answered with 304 Not Modified', ('endpoint',))
+
+# NOTE: 応答は最後に閉じたバケットが進むまで変わらないため、エンコード・圧縮した本体もバケットが閉じるまで共有する
+response_cache = QueryCache(settings.QUERY_CACHE_SIZE)
+
+async def _conditional_response(
+    request: Request, key: tuple, every_seconds: int, media_type: str, encode: Callable[[], Awaitable[bytes]], delay: float = 0,
+) -> Response:
+    '''(エンドポイント, 引数, 最後に閉じたバケット)から作ったETagで条件付きのレスポンスを返す。
+
+    If-None-Matchが一致すればDBに問い合わせずに304を返す。本体はAccept-Encodingに応じて圧縮する。
+    delayはデータが揃うまでの時間[秒]で、その分だけ前に閉じたバケットを最後のバケットとする。(database.last_closed_bucketを参照)
+    '''
+    bucket = database.last_closed_bucket(every_seconds, delay)
+    key = (*key, bucket)
+    # NOTE: 同じバケットでもtimestampは問い合わせた時刻になるため、弱いETagにする
+    etag = f'W/"{hashlib.sha1(repr(key).encode()).hexdigest()[:20]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+    if encoding.not_modified(request.headers.get('if-none-match'), (etag,)):
+        _not_modified.inc(key[0])
+        return Response(status_code=304, headers=headers)
+
+    expires_at = bucket + every_seconds * 1_000_000_000
+    content = await response_cache.get_or_compute(key, expires_at, encode)
+    coding = 'identity'
+    if len(content) >= encoding.MIN_COMPRESS_SIZE:
+        coding = encoding.negotiate(request.headers.get('accept-encoding', ''), encoding.ENCODINGS)
+    if coding != 'identity':
+        async def compress() -> bytes:
+            return encoding.compress(content, coding)
+        content = await response_cache.get_or_compute((*key, coding), expires_at, compress)
+        headers['Content-Encoding'] = coding
+    return Response(content=content, media_type=media_type, headers=headers)
+
+def _system_stats_source(
+    duration_index: int, start_time: datetime|None, start: datetime|None, stop: datetime|None, max_points: int|None, host: str|None = None,
+) -> tuple[tuple, int, Callable[[], Awaitable[tuple[datetime, dict[str, list], float, float]]]]:
+    '''system_statsの問い合わせを決め、(ETagのキー, 集計する間隔[秒], 問い合わせ)を返す。
+
+    問い合わせは(取得した時刻, 列ごとのデータ, mem_total, disk_total)を返す。hostを指定した場合はエージェントのデータにする。
+    '''
+    every_seconds = _every_seconds(duration_index)
+    if host is not None and start_time is not None:
+        raise HTTPException(status_code=400, detail='start_time cannot be combined with host.')
+    if start is None and stop is None and max_points is None:
+        if host is not None:
+            async def fetch():
+                timestamp, columns = await database.get_host_stats_columns_by_time(_host_or_fleet(host), duration_index=duration_index)
+                return timestamp, columns, *await _host_totals(host)
+            return ('host', host, duration_index), every_seconds, fetch
+        async def fetch():
+            timestamp, columns = await database.get_system_stats_columns_by_time(duration_index=duration_index, start_time=start_time)
+            return timestamp, columns, metrics.get_mem_total(), metrics.get_disk_total()
+        return (duration_index, start_time), every_seconds, fetch
+
+    if start_time is not None:
+        raise HTTPException(status_code=400, detail='start_time cannot be combined with start, stop or max_points.')
+    max_points = max_points or settings.MAX_POINTS
+    start, stop = _to_utc(start), _to_utc(stop)
+    # NOTE: startを省略した場合は期間の先頭からの相対的な範囲なので、ETagのキーには含めない
+    range_start = start or datetime.now(tz=timezone.utc) - timedelta(seconds=settings.DURATIONS[duration_index].period_seconds)
+    if stop is not None and stop <= range_start:
+        raise HTTPException(status_code=400, detail='stop must be later than start.')
+    every_seconds = database.select_range_every(range_start, stop, max_points)
+    key = ('range', None if start is None else start, duration_index if start is None else None, stop, max_points)
+    if host is not None:
+        async def fetch():
+            timestamp, columns = await database.get_host_stats_columns_in_range(_host_or_fleet(host), range_start, stop, max_points, every_seconds)
+            return timestamp, columns, *await _host_totals(host)
+        return (*key, 'host', host), every_seconds, fetch
+    async def fetch():
+        timestamp, columns = await database.get_system_stats_columns_in_range(range_start, stop, max_points, every_seconds)
+        return timestamp, columns, metrics.get_mem_total(), metrics.get_disk_total()
+    return key, every_seconds, fetch
+
+def _to_utc(t: datetime|None) -> datetime|None:
+    '''タイムゾーンの無い時刻はローカル時刻として(storage.to_nsと同じ)、UTCの時刻にする。'''
+    return None if t is None else t.astimezone(timezone.utc)
+
+def _host_delay(host: str|None) -> float:
+    return 0 if host is None else database.HOST_STATS_DELAY
+
+def _host_or_fleet(host: str) -> str|None:
+    return None if host == FLEET else host
+
+async def _host_totals(host: str) -> tuple[float, float]:
+    '''ホスト(全ホストの場合は平均)のmem_total・disk_totalを返す。'''
+    _, hosts = await database.get_hosts()
+    if host != FLEET:
+        hosts = [x for x in hosts if x['host'] == host]
+    if not hosts:
+        raise HTTPException(status_code=404, detail=f'No samples from host: {host}')
+    totals = []
+    for name in ('mem_total', 'disk_total'):
+        values = [x[name] for x in hosts if x[name] is not None]
+        totals.append(sum(values) / len(values) if values else 0.0)
+    return totals[0], totals[1]
+
+def _check_burst_available():
+    # NOTE: バーストのサンプルはワーカーのメモリにあり、リクエストごとに別のワーカーが受けうるので、複数ワーカーでは使えない
+    if settings.WORKERS > 1:
+        raise HTTPException(status_code=501, detail='Burst sampling is not available with WORKERS > 1.')
+
+def _every_seconds(duration_index: int) -> int:
+    if duration_index < 0 or duration_index >= len(settings.DURATIONS):
+        raise HTTPException(status_code=400, detail='Invalid duration index.')
+    return settings.DURATIONS[duration_index].every_seconds
+
 # MARK: subroutines
 
-def _compute_process_cpu_records(records: list[dict]) -> list[ProcessCpuRecord]:
+def encode_columns_json(header: dict, columns: dict[str, list]) -> bytes:
+    return json.dumps(dict(header, records=columns), separators=(',', ':')).encode()
+
+def encode_columns_binary(header: dict, columns: dict[str, list]) -> bytes:
+    '''列ごとのデータをバイナリ形式にする。
+
+    形式: ヘッダ長(uint32 LE) + ヘッダ(JSON) + 8バイト境界までの0埋め + 列ごとのfloat64 LE配列
+    ヘッダにはcount(行数)とcolumns(列名の順序)を含める。Noneの値はNaNにする。
+    '''
+    names = list(columns)
+    count = len(columns[names[0]]) if names else 0
+    meta = json.dumps(dict(header, count=count, columns=names), separators=(',', ':')).encode()
+    padding = -(4 + len(meta)) % 8
+    chunks = [struct.pack('<I', len(meta)), meta, bytes(padding)]
+    nan = float('nan')
+    for name in names:
+        values = array('d', [nan if x is None else x for x in columns[name]])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        chunks.append(values.tobytes())
+    return b''.join(chunks)
+
+
+def _compute_cgroup_records(records: list[dict], metric: str) -> list[CgroupRecord]:
+    # NOTE: recordsはDB側でcgroupごとに集計済み(生データ・ロールアップのどちらも{metric}_max/{metric}_sum/countの形式)
+    result = []
+    for record in records:
+        count = record['count'] or 1
+        values = {}
+        for name in CGROUP_METRICS:
+            values[f'{name}_max'] = record[f'{name}_max']
+            values[f'{name}_mean'] = record[f'{name}_sum'] / count
+        result.append(CgroupRecord(name=record['name'], **values))
+    result.sort(key=lambda x: getattr(x, f'{metric}_mean'), reverse=True)
+    return result[:settings.CGROUP_COUNT]
+
+def _compute_process_records(records: list[dict]) -> list[ProcessRecord]:
+    # NOTE: recordsは生データ・ロールアップのどちらもmax/min/sum/countの形式で渡される。
+    # DB側でpid(名前ごとに保存した場合はname)ごとに集計済みだが、そうでない場合も1回の走査・一定のメモリで合成できる。
+    by_name = settings.PROCESS_SCHEMA == 'name'
     process_table = {}
     for record in records:
-        pid, name, cpu_percent = record['pid'], record['name'], record['cpu_percent']
-        if pid not in process_table:
-            process_table[pid] = {
-                'pid': pid,
-                'name': name,
-                'cpu_max': cpu_percent,
-                'cpu_min': cpu_percent,
-                'cpu': [cpu_percent],
+        key = record['name'] if by_name else record['pid']
+        if key not in process_table:
+            process_table[key] = {
+                'pid': record['pid'],
+                'name': record['name'],
+                'max': record['max'],
+                'min': record['min'],
+                'sum': record['sum'],
+                'count': record['count'],
             }
         else:
-            data = process_table[pid]
-            data['cpu'].append(cpu_percent)
-            data['cpu_max'] = max(data['cpu_max'], cpu_percent)
-            data['cpu_min'] = min(data['cpu_min'], cpu_percent)
+            data = process_table[key]
+            data['max'] = max(data['max'], record['max'])
+            data['min'] = min(data['min'], record['min'])
+            data['sum'] += record['sum']
+            data['count'] += record['count']
 
     record_list = []
-    for pid, data in process_table.items():
-        record_list.append(ProcessCpuRecord(
+    for data in process_table.values():
+        record_list.append(ProcessRecord(
             pid=data['pid'],
             name=data['name'],
-            cpu_max=data['cpu_max'],
-            cpu_min=data['cpu_min'],
-            cpu_mean=round(sum(data['cpu']) / len(data['cpu']), 1),
+            max=data['max'],
+            min=data['min'],
+            mean=round(data['sum'] / data['count'], 1),
         ))
-    record_list.sort(key=lambda x: x.cpu_mean, reverse=True)
+    record_list.sort(key=lambda x: x.mean, reverse=True)
     return record_list[:settings.TOP_PROCESS_COUNT]
+
+def _compute_process_timeline(
+    timestamp: datetime, metric: str, every_seconds: int, start: int, end: int, records: list[dict],
+) -> ProcessTimelineResponse:
+    # NOTE: 窓×プロセスの行列にする。プロセス(名前ごとに保存した場合は名前)は1回だけ出力し、値は列の位置で窓に対応させる
+    by_name = settings.PROCESS_SCHEMA == 'name'
+    every = every_seconds * 1_000_000_000
+    count = max(0, (end - start) // every)
+    rows = {}   # key -> [pid, name, 合計, mean, max]
+    for record in records:
+        index = (record['window'] - start) // every
+        if index < 0 or index >= count or not record['count']:
+            continue
+        key = record['name'] if by_name else (record['pid'], record['name'])
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = [record['pid'], record['name'], 0.0, [None] * count, [None] * count]
+        mean = record['sum'] / record['count']
+        row[2] += record['sum']
+        row[3][index] = round(mean, 1)
+        row[4][index] = record['max']
+    ordered = sorted(rows.values(), key=lambda x: x[2], reverse=True)
+    return ProcessTimelineResponse(
+        timestamp=timestamp, 
+        metric=metric, 
+        every_seconds=every_seconds, 
+        time=[(start + (i + 1) * every) // 1_000_000 for i in range(count)], 
+        processes=[ProcessTimelineEntry(pid=x[0], name=x[1]) for x in ordered], 
+        mean=[x[3] for x in ordered], 
+        max=[x[4] for x in ordered], 
+    )
@@ -0,0 +1,106 @@
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from pathlib import Path
+from .common import settings
+from .common.logger import logger
+from .common import instrument
+from .db import database, recent, shared
+from .job.alerts import engine as alert_engine
+from .job.burst import sampler as burst_sampler
+from .job.metrics import collect_metrics, collect_system_stats, collect_processes, collect_cgroups, cgroups_available, apply_sample
+from .job import rollup, collector, leader
+from . import api
+from . import frontend
+
+# MARK: collection
+# NOTE: ワーカーが複数でも測定するのはリーダー(leader)の1プロセスだけで、
+# 他のワーカー(フォロワー)は共有メモリ(shared)のサンプルを自分の直近データに反映する。
+follower: shared.Follower|None = None
+
+def _start_collection():
+    '''リーダーに選ばれたら測定を始める。(フォロワーから引き継いだ場合は選出のスレッドから呼ばれる)'''
+    if follower:
+        follower.stop()
+    database.expire()
+    rollup.warm()
+    collect_metrics(True)   # 初回のcpu_percentのキャッシュ用
+    # システム状態とプロセスの走査は別々の間隔で、時刻の格子に揃えて実行する
+    tasks = [
+        ('system_stats', settings.METRICS_INTERVAL, collect_system_stats), 
+        ('processes', settings.PROCESS_INTERVAL, collect_processes), 
+    ]
+    if cgroups_available():
+        tasks.append(('cgroups', settings.CGROUP_INTERVAL, collect_cgroups))
+    collector.start(tasks)
+
+def _apply_shared_sample(t: int, row: tuple[float, ...]):
+    apply_sample(t, **dict(zip(recent.FIELDS, row)))
+
+# MARK: lifespan
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global follower
+    # app開始時の初期化処理
+    database.init()
+    await database.init_async()
+    try:
+        database.warm_recent()
+        alert_engine.warm(recent.store.get_samples())
+    except Exception as e:
+        logger.warning(f'failed to warm recent stats: {e}')
+    # まだストレージに書かれていないサンプルを共有メモリから補う
+    shared.open_samples()
+    next_seq, samples = shared.samples.samples(start=recent.store.newest_time() or 0)
+    for t, row in samples:
+        _apply_shared_sample(t, row)
+    follower = shared.Follower(shared.samples, _apply_shared_sample, next_seq)
+    if not leader.start(_start_collection):
+        logger.info('another process is collecting metrics: following its samples')
+        follower.start()
+
+    # app実行中
+    yield
+
+    # app終了時の終了処理
+    leader.stop_election()
+    burst_sampler.stop()
+    if leader.is_leader():
+        collector.stop()
+        rollup.flush()
+    else:
+        follower.stop()
+    follower = None
+    await database.exit_async()
+    database.exit()
+    leader.stop()   # 書き込みを終えてから、他のワーカーに測定を引き継ぐ
+    shared.close_samples()
+
+# MARK: create an app
+def create_app(base_path: Path) -> FastAPI:
+    # Create an application instance
+    app = FastAPI(lifespan=lifespan)
+
+    # リクエストの処理時間の計測
+    app.add_middleware(instrument.RequestTimingMiddleware)
+
+    # CORS対策
+    origins = [
+        'http://localhost:5173', 
+    #   'https://hogehoge.com', 
+    ]
+    app.add_middleware(
+        CORSMiddleware, 
+        allow_origins=origins, 
+        allow_credentials=True, 
+        allow_methods=['*'], 
+        allow_headers=['*'], 
+    )
+
+    # Initialize application instance
+    app.include_router(api.v1.create_router(base_path=base_path))
+    app.include_router(frontend.create_router(base_path=base_path))
+
+    return app
+
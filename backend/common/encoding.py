@@ -0,0 +1,54 @@
+import gzip
+
+try:
+    import brotli   # 任意: インストールされていればbrでも返す
+except ImportError:
+    brotli = None
+
+'''
+    HTTPレスポンスの圧縮(Content-Encoding)と条件付きリクエスト(If-None-Match)の処理。
+
+    フロントエンドの静的ファイル(frontend)は起動時に最高圧縮で、
+    モニタリングAPIのレスポンス(api.v1.monitor)は要求時に速い設定で圧縮する。
+'''
+
+MIN_COMPRESS_SIZE = 1024    # これより小さいレスポンスは圧縮しない
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)     # 使える圧縮形式(優先する順)
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    '''bodyをencoding(ENCODINGSのいずれか)で圧縮する。bestの場合は時間をかけて最も小さくする。'''
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body, quality=11 if best else 5)
+    raise Exception(f'Unsupported content encoding: {encoding}')
+
+def negotiate(accept_encoding: str, available) -> str:
+    '''Accept-Encoding(q値つき)で受け付けられる形式のうち、availableにあって最も優先する形式を選ぶ。なければidentity。'''
+    if not accept_encoding:
+        return 'identity'
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return 'identity'
+
+def not_modified(if_none_match: str|None, etags) -> bool:
+    '''If-None-MatchがetagsのいずれかのETagに一致すればTrueを返す。'''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # NOTE: 304の判定は弱い比較で行う(W/を無視する)
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return any(etag.removeprefix('W/') in tags for etag in etags)
@@ -0,0 +1,152 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+import threading
+import time
+
+'''
+    psmon自身の計測(処理時間のヒストグラムやカウンタ)を保持し、Prometheusのテキスト形式で出力する。
+
+    計測は固定バケットのカウントを増やすだけなので、本番環境で常に有効にしておける。
+'''
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# MARK: Histogram
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, ...], list] = {}  # ラベルの値 -> [バケットごとの件数, 合計, 件数]
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *label_values)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        for key, counts, total, count in items:
+            labels = _format_labels(self.labels, key)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels + ("le",), key + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+# MARK: Counter
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+# MARK: Gauge
+class Gauge:
+    '''出力するときにコールバックで値を取得するゲージ。'''
+    def __init__(self, name: str, help: str, callback: Callable[[], float|None], type: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.type = type
+
+    def render(self) -> list[str]:
+        value = self.callback()
+        if value is None:
+            return []
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}', f'{self.name} {value}']
+
+# MARK: registry
+_metrics: dict[str, Histogram|Counter|Gauge] = {}
+
+def histogram(name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+def counter(name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+    return _register(Counter(name, help, labels))
+
+def gauge(name: str, help: str, callback: Callable[[], float|None], type: str = 'gauge') -> Gauge:
+    return _register(Gauge(name, help, callback, type))
+
+def render() -> str:
+    '''登録されている全ての計測値をPrometheusのテキスト形式で出力する。'''
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def _register(metric):
+    existing = _metrics.get(metric.name)
+    if existing is not None:
+        return existing
+    _metrics[metric.name] = metric
+    return metric
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+# MARK: RequestTimingMiddleware
+class RequestTimingMiddleware:
+    '''ルートごとのリクエスト処理時間(レスポンス開始まで)を計測するASGIミドルウェア。'''
+    def __init__(self, app):
+        self.app = app
+        self.histogram = histogram(
+            'psmon_http_request_seconds', 'Time until the response starts, by route', ('method', 'route', 'status'),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                # NOTE: パスそのものではなくルートのテンプレートをラベルにし、系列数を抑える
+                route = scope.get('route')
+                path = getattr(route, 'path', None) or 'unmatched'
+                self.histogram.observe(time.perf_counter() - t0, scope['method'], path, str(message['status']))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -9,4 +9,3 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s", 
 )
 logger.setLevel(logging.DEBUG if settings.APP_DEBUG else logging.INFO)
-logging.getLogger("apscheduler").setLevel(logging.WARNING)  # 毎秒ログ出力されるため抑止する
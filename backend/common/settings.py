@@ -2,20 +2,59 @@ from dotenv import load_dotenv
 from pathlib import Path
 import os
 from pydantic import BaseModel
+import socket
 
 # MARK: environment variables
 
 load_dotenv()
 
+_DATA_PATH = Path(__file__).resolve().parents[2] / 'data'     # 既定のデータの置き場所(起動したディレクトリではなくパッケージの場所を基準にする)
+
 PORT = int(os.environ.get('PORT', 8000))
+MODE = os.environ.get('MODE', 'standalone')                                 # 動作: 'standalone'(単一ホスト)、'agent'(測定して送るだけ)、'aggregator'(エージェントから受け取る)
+HOST_NAME = os.environ.get('HOST_NAME', socket.gethostname())               # エージェントが送るときのホスト名
+AGGREGATOR_URL = os.environ.get('AGGREGATOR_URL', 'http://localhost:8000')  # MODE='agent'の送り先(集約するpsmon)
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN', '')                           # エージェントと集約サーバで共有するトークン(空文字列なら検査しない)
+AGENT_SEND_INTERVAL = float(os.environ.get('AGENT_SEND_INTERVAL', 30))      # エージェントがまとめて送る間隔(秒)
+AGENT_QUEUE_MAX = int(os.environ.get('AGENT_QUEUE_MAX', 10000))             # 送れなかったサンプルを残す上限(超えたら古いものから捨てる)
 APP_DEBUG = int(os.environ.get('APP_DEBUG', "0"))
 ROOTFS_PATH = os.environ.get('ROOTFS_PATH', '/')
 TOP_PROCESS_COUNT = int(os.environ.get('TOP_PROCESS_COUNT', 10))
 METRICS_INTERVAL = int(os.environ.get('METRICS_INTERVAL', 6))
+PROCESS_INTERVAL = int(os.environ.get('PROCESS_INTERVAL', METRICS_INTERVAL))     # 上位プロセスを走査する間隔(秒)
+PROCESS_SCHEMA = os.environ.get('PROCESS_SCHEMA', 'pid')                   # プロセスの保存単位: 'pid'(プロセスごと)または'name'(名前ごと、系列数を抑える)
+PROCESS_NAME_MAX = int(os.environ.get('PROCESS_NAME_MAX', 100))             # PROCESS_SCHEMA='name'で個別に残す名前の数(超えた分は'other'にまとめる)
+CGROUP_INTERVAL = int(os.environ.get('CGROUP_INTERVAL', METRICS_INTERVAL))  # cgroup(コンテナ・サービス)ごとに測定する間隔(秒)、0なら測定しない
+CGROUP_COUNT = int(os.environ.get('CGROUP_COUNT', 20))                      # 各値で上位に入るcgroupを保存する数
+CGROUP_MAX_DEPTH = int(os.environ.get('CGROUP_MAX_DEPTH', 4))               # cgroupのツリーを辿る深さ(これより深いcgroupはこの階層にまとめる)
+ALERT_RULES_PATH = os.environ.get('ALERT_RULES_PATH', '')                 # 閾値のルールを書いたJSONファイル(空文字列ならルールなし)
+BURST_MAX_SECONDS = int(os.environ.get('BURST_MAX_SECONDS', 300))           # バースト測定の期間の上限(秒)
+BURST_INTERVAL_MS = int(os.environ.get('BURST_INTERVAL_MS', 20))            # バースト測定の間隔の既定値(ミリ秒、10〜100)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'influxdb')          # 保存先: 'influxdb'または'sqlite'
+SQLITE_PATH = os.environ.get('SQLITE_PATH', str(_DATA_PATH / 'psmon.sqlite3'))           # STORAGE_BACKEND='sqlite'のときのファイル
+SQLITE_PARTITION_SECONDS = int(os.environ.get('SQLITE_PARTITION_SECONDS', 24 * 60 * 60))     # テーブルを分ける時間の単位
+SQLITE_RAW_RETENTION = int(os.environ.get('SQLITE_RAW_RETENTION', 2 * 24 * 60 * 60))        # 生データを残す秒数
+SQLITE_ROLLUP_RETENTION = int(os.environ.get('SQLITE_ROLLUP_RETENTION', 8 * 24 * 60 * 60))  # ロールアップを残す秒数
 INFLUXDB_URL = os.environ.get('INFLUXDB_URL', 'http://localhost:8086')
 INFLUXDB_TOKEN = os.environ.get('INFLUXDB_TOKEN', 'my-secret-token')
 INFLUXDB_ORG = os.environ.get('INFLUXDB_ORG', 'my-org')
 INFLUXDB_BUCKET = os.environ.get('INFLUXDB_BUCKET', 'system-metrics')
+INFLUXDB_POOL_SIZE = int(os.environ.get('INFLUXDB_POOL_SIZE', 100))         # 問い合わせに使うHTTP接続数の上限
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 5000))            # この行数が溜まったらフラッシュする
+WRITE_FLUSH_INTERVAL = float(os.environ.get('WRITE_FLUSH_INTERVAL', 10))    # 最古の行がこの秒数を超えたらフラッシュする
+WRITE_QUEUE_MAX = int(os.environ.get('WRITE_QUEUE_MAX', 100000))            # 書き込み待ち行数の上限(超えたら古い行から捨てる)
+SPOOL_PATH = os.environ.get('SPOOL_PATH', str(_DATA_PATH / 'spool'))                     # InfluxDBに書き込めなかった行を溜めるディレクトリ(空文字列なら溜めない)
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', 256 * 1024 * 1024))  # スプールの上限[バイト](超えたら古いものから捨てる)
+SPOOL_REPLAY_BATCH = int(os.environ.get('SPOOL_REPLAY_BATCH', 50000))        # スプールから1回に再送する行数
+SPOOL_REPLAY_RATE = float(os.environ.get('SPOOL_REPLAY_RATE', 50000))        # スプールから再送する速さの上限[行/秒]
+RECENT_CAPACITY = int(os.environ.get('RECENT_CAPACITY', 3600))              # メモリに保持する生サンプル数
+MAX_POINTS = int(os.environ.get('MAX_POINTS', 1000))                        # 期間を指定した問い合わせで返す点の数の既定値(max_points)
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 256))             # クエリ結果キャッシュのエントリ数の上限
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 64))            # 配信先ごとに溜めるイベント数の上限
+STREAM_KEEPALIVE = float(os.environ.get('STREAM_KEEPALIVE', 15))            # 配信が無いときにkeepaliveを送る間隔(秒)
+WORKERS = int(os.environ.get('WORKERS', 1))                                 # main.pyで起動するAPIのワーカープロセス数
+LEADER_LOCK_PATH = os.environ.get('LEADER_LOCK_PATH', str(_DATA_PATH / 'psmon.lock'))    # 測定するプロセスを1つに決めるためのロックファイル
+SHARED_RECENT_PATH = os.environ.get('SHARED_RECENT_PATH', str(_DATA_PATH / 'psmon.recent'))  # ワーカー間で直近のサンプルを共有するファイル
 
 # MARK: constants
 
@@ -33,3 +72,15 @@ DURATIONS = [
     Duration(name='1 day', period_start='-1d', period_seconds=1 * 24 * 60 * 60, every='8m', every_seconds=8 * 60), 
     Duration(name='1 week', period_start='-1w', period_seconds=7 * 24 * 60 * 60, every='1h', every_seconds=60 * 60), 
 ]
+
+# NOTE: 長い期間の問い合わせで生データを走査しないよう、collect_metricsが事前に集計したロールアップを書き込む。
+# 各DURATIONSのeveryを割り切れる最も粗いロールアップがクエリに使われる。
+class Rollup(BaseModel):
+    every: str
+    every_seconds: int
+
+ROLLUPS = [
+    Rollup(every='1m', every_seconds=1 * 60), 
+    Rollup(every='8m', every_seconds=8 * 60), 
+    Rollup(every='1h', every_seconds=60 * 60), 
+]
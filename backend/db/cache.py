@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+import threading
+import time
+from ..common import settings
+
+'''
+    モニタリング用のクエリ結果を共有するキャッシュ。
+
+    クエリ結果はdate.truncate(now(), every)が次のバケットに進むまで変わらないため、
+    キーにtruncateした時刻を含め、次のevery境界で期限切れにする。
+    同じキーの問い合わせが同時に来た場合は、最初の1つだけがクエリを実行し、残りはその結果を待つ。
+'''
+
+# MARK: CacheStats
+class CacheStats(BaseModel):
+    size: int
+    hits: int
+    misses: int
+    coalesced: int
+    evictions: int
+
+# MARK: QueryCache
+class QueryCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[int, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    async def get_or_compute(self, key: Hashable, expires_at: int, compute: Callable[[], Awaitable[Any]]) -> Any:
+        '''キャッシュされた値を返す。なければcomputeを実行してexpires_at(ns)まで保持する。'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time_ns():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                del self._entries[key]
+            task = self._in_flight.get(key)
+            if task is None:
+                task = self._in_flight[key] = asyncio.ensure_future(self._compute(key, expires_at, compute))
+                self._misses += 1
+            else:
+                self._coalesced += 1
+        # NOTE: 最初に要求したクライアントが切断しても、待っている他のクライアントのためにクエリは続ける
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, expires_at: int, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            with self._lock:
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                size=len(self._entries),
+                hits=self._hits,
+                misses=self._misses,
+                coalesced=self._coalesced,
+                evictions=self._evictions,
+            )
+
+query_cache = QueryCache(settings.QUERY_CACHE_SIZE)
@@ -1,87 +1,135 @@
-from influxdb_client import InfluxDBClient, BucketRetentionRules, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-from influxdb_client.client.flux_table import TableList
 from ..common import settings
 from ..common.logger import logger
-from datetime import datetime, timedelta
+from ..common import instrument
+from . import recent, cache, downsample
+from .storage import Storage, WriteStats, PROCESS_METRICS, columns_to_records, to_ns as _to_ns, _NS
+from datetime import datetime
 from dateutil import tz
-from typing import Any
+from time import time_ns
 
-client: InfluxDBClient|None = None
+'''
+    測定データの保存と問い合わせの窓口。
+
+    保存先はsettings.STORAGE_BACKENDで選んだストレージ(storage.Storage)で、
+    問い合わせは直近データのメモリ(recent)とクエリ結果のキャッシュ(cache)を経由する。
+'''
+
+storage: Storage|None = None
+
+# NOTE: エージェントはAGENT_SEND_INTERVALごとにまとめて送り、書き込みはWRITE_FLUSH_INTERVALまで遅れうるため、
+# ホストのデータはこの秒数より前に閉じたバケットまでを返す。(まだ届いていないサンプルで欠けたバケットをキャッシュしない)
+HOST_STATS_DELAY = settings.AGENT_SEND_INTERVAL + settings.WRITE_FLUSH_INTERVAL
+
+_query_source = instrument.counter('psmon_query_source_total', 'Monitor queries by the source that answered them', ('source',))
+instrument.gauge('psmon_write_queue_depth', 'Lines waiting to be written', lambda: _write_stat('queue_depth'))
+instrument.gauge('psmon_write_dropped_lines_total', 'Lines dropped because the write queue overflowed', lambda: _write_stat('dropped_lines'), type='counter')
+instrument.gauge('psmon_write_errors_total', 'Failed batch writes', lambda: _write_stat('flush_errors'), type='counter')
+instrument.gauge('psmon_spool_lines', 'Lines waiting in the spool to be replayed', lambda: _write_stat('spool_lines'))
+instrument.gauge('psmon_spool_bytes', 'Size of the spool on disk', lambda: _write_stat('spool_bytes'))
+instrument.gauge('psmon_spool_replayed_lines_total', 'Lines replayed from the spool', lambda: _write_stat('replayed_lines'), type='counter')
+instrument.gauge('psmon_spool_evicted_lines_total', 'Lines evicted because the spool was full', lambda: _write_stat('evicted_lines'), type='counter')
+instrument.gauge('psmon_query_cache_hits_total', 'Query cache hits', lambda: cache.query_cache.stats().hits, type='counter')
+instrument.gauge('psmon_query_cache_misses_total', 'Query cache misses', lambda: cache.query_cache.stats().misses, type='counter')
+instrument.gauge('psmon_query_cache_coalesced_total', 'Requests that waited for an identical in-flight query', lambda: cache.query_cache.stats().coalesced, type='counter')
 
 # MARK: init & exit
+
 def init():
-    global client
-    if client:
+    global storage
+    if storage:
         return
-    client = InfluxDBClient(
-        url=settings.INFLUXDB_URL, 
-        token=settings.INFLUXDB_TOKEN, 
-        org=settings.INFLUXDB_ORG, 
-    )
+    if settings.STORAGE_BACKEND == 'influxdb':
+        from .influxdb import InfluxDBStorage
+        storage = InfluxDBStorage()
+    elif settings.STORAGE_BACKEND == 'sqlite':
+        from .sqlite import SQLiteStorage
+        storage = SQLiteStorage(settings.SQLITE_PATH)
+    else:
+        raise Exception(f'Unknown storage backend: {settings.STORAGE_BACKEND}')
+    storage.init()
+    logger.info(f'storage backend: {settings.STORAGE_BACKEND}')
 
-    # 参考: retention periodが1週間のバケットの作成方法
-    # DOCKER_INFLUXDB_INIT_RETENTIONで設定できるため、以下のコードは不要になった
+async def init_async():
+    '''問い合わせの準備をする。(イベントループ上で呼び出すこと)'''
+    if not storage:
+        raise Exception('No database client object.')
+    await storage.init_async()
 
-    #buckets_api = client.buckets_api()
-    #existing_buckets = [b for b in buckets_api.find_buckets().buckets if b.name == settings.INFLUXDB_BUCKET]
-    #if not existing_buckets:
-    #    retention_rule = BucketRetentionRules(type="expire", every_seconds=60 * 60 * 24 * 7)
-    #    buckets_api.create_bucket(
-    #        bucket_name=settings.INFLUXDB_BUCKET, 
-    #        org=settings.INFLUXDB_ORG, 
-    #        retention_rules=[retention_rule]
-    #    )
+async def exit_async():
+    if storage is None:
+        return
+    await storage.exit_async()
+
+def expire():
+    '''保持期間を過ぎたデータを削除する。(ワーカーが複数の場合も、測定するプロセスだけが呼び出す)'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.expire()
 
 def exit():
-    global client
-    if client is None:
+    global storage
+    if storage is None:
         return
-    client.close()
-    client = None
+    storage.exit()
+    storage = None
 
 # MARK: write & get records
-_MEASUREMENT_SYS_STATS = 'system_stats'
-_MEASUREMENT_PROCESS_CPU = 'process_cpu'
 
 def write_system_stats_record(time: int, **kwargs):
-    '''psutilで取得したシステム状態をDBのレコードに保存する。'''
-    if not client:
+    '''psutilで取得したシステム状態をDBのレコードに保存する。(書き込みはバックグラウンドで行う)'''
+    if not storage:
         raise Exception('No database client object.')
-    point = dict(
-        measurement=_MEASUREMENT_SYS_STATS, 
-        fields=kwargs,
-        time=time
-    )
-    (client
-        .write_api(write_options=SYNCHRONOUS)
-        .write(
-            bucket=settings.INFLUXDB_BUCKET, 
-            record=point, 
-        )
-    )
+    storage.write_system_stats(time, kwargs)
+
+def write_process_record(time: int, processes: list[tuple]):
+    '''上位のプロセス(pid, name, PROCESS_METRICSの値...)のリストをDBのレコードに保存する。(書き込みはバックグラウンドで行う)'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_processes(time, processes)
+
+def write_system_stats_rollup(every: str, time: int, fields: dict[str, float]):
+    '''ロールアップしたシステム状態(max/sum/count)をDBのレコードに保存する。timeはバケットの開始時刻。'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_system_stats_rollup(every, time, fields)
+
+def write_process_rollup(every: str, time: int, processes: list[tuple]):
+    '''ロールアップしたプロセスの値(PROCESS_METRICSごとのmax/min/sumとcount)をDBのレコードに保存する。timeはバケットの開始時刻。'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_processes_rollup(every, time, processes)
+
+def write_cgroup_record(time: int, cgroups: list[tuple]):
+    '''cgroup(名前, CGROUP_METRICSの値...)のリストをDBのレコードに保存する。(書き込みはバックグラウンドで行う)'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_cgroups(time, cgroups)
+
+def write_cgroup_rollup(every: str, time: int, cgroups: list[tuple]):
+    '''ロールアップしたcgroupの値(CGROUP_METRICSごとのmax・sumとcount)をDBのレコードに保存する。timeはバケットの開始時刻。'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_cgroups_rollup(every, time, cgroups)
+
+def write_host_stats(host: str, rows: list[tuple]):
+    '''エージェント(host)から受け取ったサンプル(time, recent.FIELDSの値..., mem_total, disk_total)をDBに保存する。'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_host_stats(host, rows)
+
+def write_host_stats_rollup(host: str, every: str, time: int, fields: dict[str, float]):
+    '''エージェント(host)が計算したロールアップをDBに保存する。timeはバケットの開始時刻。'''
+    if not storage:
+        raise Exception('No database client object.')
+    storage.write_host_stats_rollup(host, every, time, fields)
 
-def write_process_cpu_record(time: int, processes: list[tuple[float, int, str]]):
-    '''psutilで取得したCPU使用率が高いプロセスのリストをDBのレコードに保存する。'''
-    if not client:
-        raise Exception('No database client object.')
-    write_api = client.write_api(write_options=SYNCHRONOUS)
-    for cpu, pid, name in processes:
-        point = (
-            Point(_MEASUREMENT_PROCESS_CPU)
-            .time(time)
-            .tag('pid', str(pid))
-            .tag('name', name)
-            .field('cpu_percent', cpu)
-        )
-        write_api.write(
-            bucket=settings.INFLUXDB_BUCKET, 
-            record=point, 
-        )
-
-def get_system_stats_records_by_time(duration_index: int = 0, start_time: datetime|None = None):
+def get_write_stats() -> WriteStats|None:
+    '''書き込みパイプラインの統計(キューの深さ、フラッシュ所要時間など)を取得する。'''
+    return storage.write_stats() if storage else None
+
+async def get_system_stats_records_by_time(duration_index: int = 0, start_time: datetime|None = None):
     '''DBに保存してあったpsutilのデータを時間ごとに取得する。
-    
+
     Args:
         every (str): 時間ごとの間隔
         start_time (datetime|None): 取得する時間の開始時刻、Noneの場合は6時間前(now() - 6h)から取得する
@@ -89,97 +137,269 @@ def get_system_stats_records_by_time(duration_index: int = 0, start_time: dateti
     Returns:
         tuple[datetime, list[dict]]: 取得した時刻とデータ
     '''
-    if not client:
+    timestamp, columns = await get_system_stats_columns_by_time(duration_index=duration_index, start_time=start_time)
+    return timestamp, columns_to_records(columns)
+
+async def get_system_stats_columns_by_time(duration_index: int = 0, start_time: datetime|None = None):
+    '''DBに保存してあったpsutilのデータを時間ごとに列(recent.COLUMNS)単位で取得する。
+
+    Returns:
+        tuple[datetime, dict[str, list]]: 取得した時刻と列ごとのデータ(timeはエポックミリ秒)
+    '''
+    if not storage:
         raise Exception('No database client object.')
     if duration_index < 0 or duration_index >= len(settings.DURATIONS):
         raise Exception('Invalid duration index.')
     duration = settings.DURATIONS[duration_index]
-    if start_time:
-        start = (start_time + timedelta(microseconds=1)).isoformat()
-    else:
-        start = duration.period_start
-    query = _generate_system_stats_query(
-        fields=['cpu_percent', 'mem_available', 'disk_used'], 
-        every=duration.every, 
-        start=start, 
+    every = duration.every_seconds * _NS
+    truncated_end = last_closed_bucket(duration.every_seconds)
+    # 結果はtruncated_endが次のバケットに進むまで変わらない
+    return await cache.query_cache.get_or_compute(
+        key=('system_stats', duration_index, truncated_end, start_time),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_system_stats(duration, start_time),
     )
-    timestamp = datetime.now(tz=tz.UTC)
-    tables = client.query_api().query(query=query)
-    #output = _convert_to_time_delta(timestamp, tables)
-    #return timestamp, output
-    return timestamp, _convert_tables_to_list(tables)
-
-def get_process_cpu_record_at_time(time: datetime, every_seconds: int):
-    '''DBに保存してあったpsutilで取得したCPU使用率が高いプロセスのリストを指定された時刻で取得する。
-    
+
+async def get_process_records_at_time(metric: str, time: datetime, every_seconds: int):
+    '''DBに保存してあったプロセスのリストを、指定された時刻までの窓のmetricの平均が高い順に取得する。
+
     Args:
+        metric (str): PROCESS_METRICSのいずれか
         time (datetime): 取得する時刻
 
     Returns:
-        tuple[datetime, list[dict]]: 取得した時刻と、PID・プロセス名・CPU使用率のリスト
+        tuple[datetime, list[dict]]: 取得した時刻と、pid・name・max/min/sum/countのリスト
+    '''
+    if not storage:
+        raise Exception('No database client object.')
+    if metric not in PROCESS_METRICS:
+        raise Exception(f'Unknown process metric: {metric}')
+    every = every_seconds * _NS
+    truncated_end = last_closed_bucket(every_seconds)
+    return await cache.query_cache.get_or_compute(
+        key=('process', metric, every_seconds, truncated_end, time),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_processes(metric, time, every_seconds),
+    )
+
+async def get_cgroup_records_at_time(time: datetime|None, every_seconds: int):
+    '''DBに保存してあったcgroupごとの値を、指定された時刻までの窓について取得する。
+
+    Args:
+        time (datetime|None): 取得する時刻、Noneの場合は最後に閉じたバケットの終了時刻
+
+    Returns:
+        tuple[datetime, datetime, list[dict]]: 取得した時刻、窓の終了時刻と、name・{metric}_max・{metric}_sum・countのリスト
+    '''
+    if not storage:
+        raise Exception('No database client object.')
+    every = every_seconds * _NS
+    truncated_end = last_closed_bucket(every_seconds)
+    end = _to_ns(time) if time else truncated_end
+    return await cache.query_cache.get_or_compute(
+        key=('cgroups', every_seconds, truncated_end, end),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_cgroups(end, every_seconds),
+    )
+
+async def get_process_timeline(metric: str, duration_index: int = 0):
+    '''DURATIONSの期間の全ての窓について、窓ごとにmetricの平均が高いプロセスを1回の問い合わせで取得する。
+
+    Args:
+        metric (str): PROCESS_METRICSのいずれか
+        duration_index (int): DURATIONSのインデックス
+
+    Returns:
+        tuple[datetime, int, int, list[dict]]: 取得した時刻、期間の開始・終了時刻(ns, 窓の境界)と、
+            window(窓の開始時刻(ns))・pid・name・max/min/sum/countのリスト(窓の順)
+    '''
+    if not storage:
+        raise Exception('No database client object.')
+    if metric not in PROCESS_METRICS:
+        raise Exception(f'Unknown process metric: {metric}')
+    if duration_index < 0 or duration_index >= len(settings.DURATIONS):
+        raise Exception('Invalid duration index.')
+    duration = settings.DURATIONS[duration_index]
+    every = duration.every_seconds * _NS
+    truncated_end = last_closed_bucket(duration.every_seconds)
+    return await cache.query_cache.get_or_compute(
+        key=('process_timeline', metric, duration_index, truncated_end),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_process_timeline(metric, duration, truncated_end),
+    )
+
+async def get_host_stats_columns_by_time(host: str|None, duration_index: int = 0):
+    '''エージェントから受け取ったデータをDURATIONSの期間について列(recent.COLUMNSとhosts)単位で取得する。
+
+    Args:
+        host (str|None): ホスト名、Noneの場合は全ホストをまとめる(窓ごとに各ホストのmaxの最大とmeanの平均)
+
+    Returns:
+        tuple[datetime, dict[str, list]]: 取得した時刻と列ごとのデータ(timeはエポックミリ秒)
     '''
-    if not client:
-        raise Exception('No database client object.')
-    start_time = (time - timedelta(seconds=every_seconds)).isoformat()
-    end_time = time.isoformat()
-    # NOTE: tagはpivotの対象ではないが、行に自動で含まれる。keepで明示的に残す。
-    # (tagはPandasのDataFrameにおける「インデックスやカラムの属性情報」に近いイメージ)
-    query = f'''
-    from(bucket: "{settings.INFLUXDB_BUCKET}")
-      |> range(start: {start_time}, stop: {end_time})
-      |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_PROCESS_CPU}")
-      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-      |> keep(columns: ["pid", "name", "cpu_percent"])
-    //  |> sort(columns: ["cpu_percent"], desc: true)
+    if not storage:
+        raise Exception('No database client object.')
+    if duration_index < 0 or duration_index >= len(settings.DURATIONS):
+        raise Exception('Invalid duration index.')
+    duration = settings.DURATIONS[duration_index]
+    every = duration.every_seconds * _NS
+    truncated_end = last_closed_bucket(duration.every_seconds, HOST_STATS_DELAY)
+    start = (truncated_end - duration.period_seconds * _NS) // every * every
+    return await cache.query_cache.get_or_compute(
+        key=('host_stats', host, duration_index, truncated_end),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_host_stats(host, duration.every_seconds, start, truncated_end),
+    )
+
+async def get_host_stats_columns_in_range(host: str|None, start: datetime, stop: datetime|None, max_points: int, every_seconds: int):
+    '''エージェントから受け取ったデータを任意の期間[start, stop)について、every_secondsごとに集計してから
+    LTTBでmax_points個に間引いて取得する。(get_system_stats_columns_in_rangeのホスト版)
+    '''
+    if not storage:
+        raise Exception('No database client object.')
+    every = every_seconds * _NS
+    truncated_end = last_closed_bucket(every_seconds, HOST_STATS_DELAY)
+    range_start = _to_ns(start) // every * every
+    range_end = min(-(-_to_ns(stop) // every) * every, truncated_end) if stop else truncated_end
+    return await cache.query_cache.get_or_compute(
+        key=('host_stats_range', host, every_seconds, range_start, range_end, max_points),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_host_stats(host, every_seconds, range_start, range_end, max_points),
+    )
+
+async def get_hosts():
+    '''直近(DURATIONSの最長の期間)にサンプルを送ってきたホストの一覧を取得する。
+
+    Returns:
+        tuple[datetime, list[dict]]: 取得した時刻と、host・last_seen(ns)・mem_total・disk_totalのリスト
+    '''
+    if not storage:
+        raise Exception('No database client object.')
+    every = settings.METRICS_INTERVAL * _NS
+    truncated_end = last_closed_bucket(settings.METRICS_INTERVAL)
+    return await cache.query_cache.get_or_compute(
+        key=('hosts', truncated_end),
+        expires_at=truncated_end + every,
+        compute=_query_hosts,
+    )
+
+def select_range_every(start: datetime, stop: datetime|None, max_points: int) -> int:
+    '''任意の期間[start, stop)をmax_points個程度の点で返すために集計する間隔[秒]を選ぶ。(downsampleを参照)'''
+    now = time_ns()
+    range_start = _to_ns(start)
+    range_stop = min(_to_ns(stop), now) if stop else now
+    # 生データが残っていない古い期間はロールアップで集計できる間隔にする
+    raw_available = storage is None or storage.raw_retention is None or range_start >= now - storage.raw_retention * _NS
+    return downsample.select_every(max(0, range_stop - range_start) / _NS, max_points, raw_available)
+
+async def get_system_stats_columns_in_range(start: datetime, stop: datetime|None, max_points: int, every_seconds: int):
+    '''DBに保存してあったpsutilのデータを任意の期間[start, stop)について、every_secondsごとに集計してから
+    LTTBでmax_points個に間引いて取得する。
+
+    Returns:
+        tuple[datetime, dict[str, list]]: 取得した時刻と列(recent.COLUMNS)ごとのデータ(timeはエポックミリ秒)
     '''
+    if not storage:
+        raise Exception('No database client object.')
+    every = every_seconds * _NS
+    truncated_end = last_closed_bucket(every_seconds)
+    range_start = _to_ns(start) // every * every
+    range_end = min(-(-_to_ns(stop) // every) * every, truncated_end) if stop else truncated_end
+    return await cache.query_cache.get_or_compute(
+        key=('system_stats_range', every_seconds, range_start, range_end, max_points),
+        expires_at=truncated_end + every,
+        compute=lambda: _query_system_stats_range(every_seconds, range_start, range_end, max_points),
+    )
+
+def last_closed_bucket(every_seconds: int, delay: float = 0) -> int:
+    '''最後に閉じたバケット(delay秒前の時点で閉じていたもの)の終了時刻(ns)。問い合わせの結果はこの時刻が進むまで変わらない。'''
+    every = every_seconds * _NS
+    return (time_ns() - int(delay * _NS)) // every * every
+
+def get_cache_stats() -> cache.CacheStats:
+    '''クエリ結果キャッシュの統計(ヒット数、ミス数など)を取得する。'''
+    return cache.query_cache.stats()
+
+async def _query_system_stats(duration: settings.Duration, start_time: datetime|None):
+    timestamp = datetime.now(tz=tz.UTC)
+
+    # メモリ上に揃っている範囲ならストレージに問い合わせない
+    now = _to_ns(timestamp)
+    every = duration.every_seconds * _NS
+    if start_time:
+        range_start = _to_ns(start_time) + 1000
+    else:
+        range_start = now - duration.period_seconds * _NS
+    columns = recent.store.get_columns(duration.every_seconds, range_start, now // every * every)
+    if columns is not None:
+        _query_source.inc('memory')
+        return timestamp, columns
+    _query_source.inc(settings.STORAGE_BACKEND)
+    return timestamp, await storage.query_system_stats(duration, range_start, now, start_time)
+
+async def _query_system_stats_range(every_seconds: int, start: int, end: int, max_points: int):
+    timestamp = datetime.now(tz=tz.UTC)
+    if start >= end:
+        return timestamp, {name: [] for name in recent.COLUMNS}
+    columns = recent.store.get_columns(every_seconds, start, end)
+    if columns is not None:
+        _query_source.inc('memory')
+    else:
+        _query_source.inc(settings.STORAGE_BACKEND)
+        columns = await storage.query_system_stats_range(every_seconds, start, end, time_ns())
+    return timestamp, downsample.lttb(columns, max_points)
+
+async def _query_processes(metric: str, time: datetime, every_seconds: int):
+    timestamp = datetime.now(tz=tz.UTC)
+    return timestamp, await storage.query_processes(metric, _to_ns(time), every_seconds, _to_ns(timestamp))
+
+async def _query_cgroups(end: int, every_seconds: int):
+    timestamp = datetime.now(tz=tz.UTC)
+    records = await storage.query_cgroups(end, every_seconds, _to_ns(timestamp))
+    return timestamp, datetime.fromtimestamp(end / _NS, tz=tz.UTC), records
+
+async def _query_process_timeline(metric: str, duration: settings.Duration, end: int):
+    timestamp = datetime.now(tz=tz.UTC)
+    every = duration.every_seconds * _NS
+    start = (end - duration.period_seconds * _NS) // every * every
+    return timestamp, start, end, await storage.query_process_timeline(metric, duration.every_seconds, start, end, _to_ns(timestamp))
+
+async def _query_host_stats(host: str|None, every_seconds: int, start: int, end: int, max_points: int|None = None):
+    timestamp = datetime.now(tz=tz.UTC)
+    if start >= end:
+        return timestamp, {name: [] for name in (*recent.COLUMNS, 'hosts')}
+    _query_source.inc(settings.STORAGE_BACKEND)
+    columns = await storage.query_host_stats(every_seconds, start, end, _to_ns(timestamp), host)
+    return timestamp, downsample.lttb(columns, max_points) if max_points else columns
+
+async def _query_hosts():
     timestamp = datetime.now(tz=tz.UTC)
-    tables = client.query_api().query(query=query)
-    records = _convert_tables_to_list(tables)
-    # records = sorted(records, key=lambda x: x['cpu_percent'], reverse=True)
-    return timestamp, records
+    longest = max(duration.period_seconds for duration in settings.DURATIONS)
+    return timestamp, await storage.query_hosts(_to_ns(timestamp) - longest * _NS)
+
+def load_process_rollup(every: str, time: int) -> list[tuple]:
+    '''保存してあるプロセスのロールアップのうち、開始時刻timeのバケットを読み込む。(形式はwrite_process_rollupと同じ)'''
+    if not storage:
+        raise Exception('No database client object.')
+    return storage.load_processes_rollup(every, time)
+
+def load_cgroup_rollup(every: str, time: int) -> list[tuple]:
+    '''保存してあるcgroupのロールアップのうち、開始時刻timeのバケットを読み込む。(形式はwrite_cgroup_rollupと同じ)'''
+    if not storage:
+        raise Exception('No database client object.')
+    return storage.load_cgroups_rollup(every, time)
+
+def warm_recent():
+    '''ストレージに保存してあるデータで直近データのメモリ(recent.store)を初期化する。'''
+    if not storage:
+        raise Exception('No database client object.')
+    now = time_ns()
+    raw, aggregated = storage.load_recent(now)
+    recent.store.warm(now, raw, aggregated)
+    logger.info(f'warmed recent stats: {len(raw)} samples')
 
 # MARK: subroutines
 
-def _generate_system_stats_query(fields: list[str], every: str, start: str) -> str:
-    field_filter = " or ".join([f'r._field == "{field}"' for field in fields])
-    pivot_columns = [f"{field}_max" for field in fields] + [f"{field}_mean" for field in fields]
-    pivot_columns_str = ", ".join([f'"{col}"' for col in pivot_columns])
-
-    query = f'''
-import "date"
-truncated_end = date.truncate(t: now(), unit: {every})
-data = from(bucket: "{settings.INFLUXDB_BUCKET}")
-  |> range(start: {start})
-  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_SYS_STATS}")
-  |> filter(fn: (r) => {field_filter})
-  |> filter(fn: (r) => r._time < truncated_end)
-
-max_data = data
-  |> aggregateWindow(every: {every}, fn: max, createEmpty: false)
-  |> map(fn: (r) => ({{r with _stat: "max"}}))
-
-mean_data = data
-  |> aggregateWindow(every: {every}, fn: mean, createEmpty: false)
-  |> map(fn: (r) => ({{r with _stat: "mean"}}))
-
-union(tables: [max_data, mean_data])
-  |> map(fn: (r) => ({{r with _field: r._field + "_" + r._stat}}))
-  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
-  |> keep(columns: ["_time", {pivot_columns_str}])
-'''
-    return query
-
-def _convert_to_time_delta(timestamp: datetime, tables: TableList) -> list[dict]:
-    output = []
-    for table in tables:
-        for record in table.records:
-            record['time_delta'] = (record['_time'] - timestamp).total_seconds()
-            output.append(record.values)
-    return output
-
-def _convert_tables_to_list(tables: TableList) -> list[dict]:
-    output = []
-    for table in tables:
-        for record in table.records:
-            output.append(record.values)
-    return output
+def _write_stat(name: str) -> float|None:
+    stats = get_write_stats()
+    return getattr(stats, name) if stats else None
@@ -0,0 +1,90 @@
+from ..common import settings
+from .storage import select_rollup
+
+'''
+    任意の期間をmax_points個程度の点で返すための解像度の選択とダウンサンプリング。
+
+    まず期間の長さとmax_pointsから集計する間隔(every)を選び、ストレージ(生データまたはロールアップ)で
+    max_pointsのOVERSAMPLE倍以下の窓に集計する。その結果をLTTB(Largest-Triangle-Three-Buckets)で
+    max_points個に間引くため、レスポンスの大きさと描画の手間は期間の長さではなく画面の幅で決まる。
+'''
+
+OVERSAMPLE = 4      # LTTBで間引く前に集計する窓の数(max_pointsの倍数)
+
+def resolutions() -> list[int]:
+    '''集計する間隔[秒]の候補。(測定間隔、DURATIONSとROLLUPSの間隔)'''
+    candidates = {settings.METRICS_INTERVAL}
+    candidates.update(duration.every_seconds for duration in settings.DURATIONS)
+    candidates.update(rollup.every_seconds for rollup in settings.ROLLUPS)
+    return sorted(candidates)
+
+def select_every(span_seconds: float, max_points: int, raw_available: bool = True) -> int:
+    '''期間span_secondsの窓の数がmax_points * OVERSAMPLE以下になる最も細かい間隔[秒]を選ぶ。
+
+    Args:
+        raw_available: Falseの場合はロールアップで集計できる間隔だけから選ぶ(生データが残っていない古い期間)
+    '''
+    limit = max_points * OVERSAMPLE
+    candidates = resolutions()
+    for every in candidates:
+        if not raw_available and select_rollup(every) is None:
+            continue
+        if span_seconds / every <= limit:
+            return every
+    # 候補で足りない長い期間は、最も粗いロールアップの倍数にする
+    coarsest = max(rollup.every_seconds for rollup in settings.ROLLUPS) if settings.ROLLUPS else candidates[-1]
+    return coarsest * max(1, -(-int(span_seconds) // (coarsest * limit)))
+
+def lttb(columns: dict[str, list], threshold: int) -> dict[str, list]:
+    '''列ごとのデータ(recent.COLUMNS)をLTTBでthreshold行に間引く。
+
+    全ての列で同じ行を残すため、三角形の面積は列ごとに値の幅で正規化して合計する。
+    Noneの値はその列の面積に含めない。
+    '''
+    times = columns['time']
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return columns
+    series = []
+    for name, values in columns.items():
+        if name == 'time':
+            continue
+        present = [x for x in values if x is not None]
+        if not present:
+            continue
+        span = max(present) - min(present)
+        series.append((values, 1.0 / span if span else 0.0))
+    t_scale = 1.0 / (times[-1] - times[0]) if times[-1] != times[0] else 0.0
+
+    indices = [0]
+    size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * size) + 1
+        stop = int((i + 1) * size) + 1
+        next_stop = min(max(int((i + 2) * size) + 1, stop + 1), n)
+        # 次の区間の平均を3つ目の頂点にする
+        next_times = times[stop:next_stop]
+        avg_t = sum(next_times) / len(next_times)
+        averages = []
+        for values, scale in series:
+            present = [x for x in values[stop:next_stop] if x is not None]
+            averages.append(sum(present) / len(present) if present else None)
+
+        ta = times[a]
+        best, best_area = start, -1.0
+        for j in range(start, stop):
+            dt_avg = (ta - avg_t) * t_scale
+            dt_j = (ta - times[j]) * t_scale
+            area = 0.0
+            for (values, scale), avg in zip(series, averages):
+                ya, yj = values[a], values[j]
+                if ya is None or yj is None or avg is None:
+                    continue
+                area += abs(dt_avg * (yj - ya) - dt_j * (avg - ya)) * scale
+            if area > best_area:
+                best, best_area = j, area
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return {name: [values[i] for i in indices] for name, values in columns.items()}
@@ -0,0 +1,233 @@
+import struct
+
+'''
+    Gorilla(FacebookのインメモリTSDB)の方式で、時刻と浮動小数点数の列をビット単位に圧縮して保持する。
+
+    - 時刻(整数): 前回の間隔との差(delta-of-delta)を可変長で書く。一定の間隔なら1サンプル1ビット
+    - 値(float64): 前回の値とのXORの、先頭と末尾の0を除いた部分だけを書く。変わらなければ1ビット
+
+    GorillaSeriesはBLOCK_SIZE行ごとにブロックを閉じるため、startより後だけを読む場合は
+    それ以前のブロックを展開しない。追記中の(書きかけの)ブロックもそのまま読み出せる。
+'''
+
+BLOCK_SIZE = 1024   # 1ブロックの行数
+
+_MASK64 = (1 << 64) - 1
+_DOUBLE = struct.Struct('>d')
+_UINT64 = struct.Struct('>Q')
+
+# MARK: BitWriter
+class BitWriter:
+    def __init__(self):
+        self.data = bytearray()
+        self._acc = 0       # まだバイトにしていないビット(8ビット未満)
+        self._bits = 0
+
+    def write(self, value: int, bits: int):
+        acc = (self._acc << bits) | value
+        n = self._bits + bits
+        if n >= 8:
+            whole = n >> 3
+            n &= 7
+            self.data += (acc >> n).to_bytes(whole, 'big')
+            acc &= (1 << n) - 1
+        self._acc = acc
+        self._bits = n
+
+    def getvalue(self) -> bytes:
+        '''書いたビット列(最後のバイトの余りは0で埋める)'''
+        if not self._bits:
+            return bytes(self.data)
+        return bytes(self.data) + bytes([self._acc << (8 - self._bits)])
+
+    def __len__(self) -> int:
+        return len(self.data) + (1 if self._bits else 0)
+
+# MARK: BitReader
+class BitReader:
+    def __init__(self, data: bytes):
+        self.data = bytes(data) + bytes(9)  # 末尾を読み越えても良いように埋める
+        self.pos = 0
+
+    def read(self, bits: int) -> int:
+        pos = self.pos
+        i = pos >> 3
+        chunk = int.from_bytes(self.data[i:i + 9], 'big')
+        self.pos = pos + bits
+        return (chunk >> (72 - (pos & 7) - bits)) & ((1 << bits) - 1)
+
+    def read_bit(self) -> int:
+        pos = self.pos
+        self.pos = pos + 1
+        return (self.data[pos >> 3] >> (7 - (pos & 7))) & 1
+
+# MARK: TimeColumn
+class TimeColumn:
+    '''整数の時刻の列。(delta-of-delta)'''
+    def __init__(self):
+        self.writer = BitWriter()
+        self.count = 0
+        self._prev = 0
+        self._delta = 0
+
+    def append(self, t: int):
+        w = self.writer
+        if self.count == 0:
+            w.write(t & _MASK64, 64)
+        else:
+            delta = t - self._prev
+            dod = delta - self._delta
+            if dod == 0:
+                w.write(0, 1)
+            elif -63 <= dod <= 64:
+                w.write((0b10 << 7) | (dod + 63), 9)
+            elif -255 <= dod <= 256:
+                w.write((0b110 << 9) | (dod + 255), 12)
+            elif -2047 <= dod <= 2048:
+                w.write((0b1110 << 12) | (dod + 2047), 16)
+            else:
+                w.write(0b1111, 4)
+                w.write(dod & _MASK64, 64)
+            self._delta = delta
+        self._prev = t
+        self.count += 1
+
+def decode_times(data: bytes, count: int) -> list[int]:
+    if not count:
+        return []
+    r = BitReader(data)
+    t = _signed(r.read(64))
+    delta = 0
+    output = [t]
+    for _ in range(count - 1):
+        if not r.read_bit():
+            pass
+        elif not r.read_bit():
+            delta += r.read(7) - 63
+        elif not r.read_bit():
+            delta += r.read(9) - 255
+        elif not r.read_bit():
+            delta += r.read(12) - 2047
+        else:
+            delta += _signed(r.read(64))
+        t += delta
+        output.append(t)
+    return output
+
+# MARK: ValueColumn
+class ValueColumn:
+    '''float64の値の列。(前回の値とのXOR)'''
+    def __init__(self):
+        self.writer = BitWriter()
+        self.count = 0
+        self._prev = 0
+        self._leading = -1      # 前回書いた有効ビットの範囲(先頭・末尾の0の数)
+        self._trailing = 0
+
+    def append(self, value: float):
+        bits = _UINT64.unpack(_DOUBLE.pack(value))[0]
+        w = self.writer
+        if self.count == 0:
+            w.write(bits, 64)
+        else:
+            xor = bits ^ self._prev
+            if xor == 0:
+                w.write(0, 1)
+            else:
+                leading = min(64 - xor.bit_length(), 31)
+                trailing = (xor & -xor).bit_length() - 1
+                if self._leading >= 0 and leading >= self._leading and trailing >= self._trailing:
+                    # 前回の範囲に収まれば、範囲を書かずに済ませる
+                    meaningful = 64 - self._leading - self._trailing
+                    w.write((0b10 << meaningful) | (xor >> self._trailing), 2 + meaningful)
+                else:
+                    meaningful = 64 - leading - trailing
+                    w.write((0b11 << 11) | (leading << 6) | (meaningful & 63), 13)  # NOTE: 64ビットは0で表す
+                    w.write(xor >> trailing, meaningful)
+                    self._leading, self._trailing = leading, trailing
+        self._prev = bits
+        self.count += 1
+
+def decode_values(data: bytes, count: int) -> list[float]:
+    if not count:
+        return []
+    r = BitReader(data)
+    bits = r.read(64)
+    unpack, pack = _DOUBLE.unpack, _UINT64.pack
+    output = [unpack(pack(bits))[0]]
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if r.read_bit():
+            if r.read_bit():
+                leading = r.read(5)
+                meaningful = r.read(6) or 64
+                trailing = 64 - leading - meaningful
+            bits ^= r.read(64 - leading - trailing) << trailing
+        output.append(unpack(pack(bits))[0])
+    return output
+
+# MARK: GorillaSeries
+class GorillaSeries:
+    '''時刻とfieldsの値の行を圧縮して追記する。(スレッドセーフではないので、呼び出し側でロックすること)'''
+    def __init__(self, fields: tuple[str, ...], block_size: int = BLOCK_SIZE):
+        self.fields = fields
+        self.block_size = block_size
+        self.blocks: list[tuple[int, int, int, bytes, list[bytes]]] = []    # (最初の時刻, 最後の時刻, 行数, 時刻, 値の列)
+        self.count = 0
+        self._open()
+
+    def _open(self):
+        self._times = TimeColumn()
+        self._columns = [ValueColumn() for _ in self.fields]
+        self._first: int|None = None
+        self._last: int|None = None
+
+    def append(self, t: int, values: tuple[float, ...]):
+        if self._first is None:
+            self._first = t
+        self._last = t
+        self._times.append(t)
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        self.count += 1
+        if self._times.count >= self.block_size:
+            self.blocks.append(self._current())
+            self._open()
+
+    def _current(self) -> tuple[int, int, int, bytes, list[bytes]]:
+        return (
+            self._first, self._last, self._times.count,
+            self._times.writer.getvalue(), [column.writer.getvalue() for column in self._columns],
+        )
+
+    def snapshot(self) -> list[tuple[int, int, int, bytes, list[bytes]]]:
+        '''閉じたブロックと書きかけのブロックの圧縮されたままのコピー。(decodeはロックの外で行える)'''
+        blocks = list(self.blocks)
+        if self._times.count:
+            blocks.append(self._current())
+        return blocks
+
+    @property
+    def nbytes(self) -> int:
+        '''圧縮後の大きさ[バイト]'''
+        size = sum(len(times) + sum(len(x) for x in columns) for _, _, _, times, columns in self.blocks)
+        return size + len(self._times.writer) + sum(len(column.writer) for column in self._columns)
+
+def decode(fields: tuple[str, ...], blocks: list[tuple[int, int, int, bytes, list[bytes]]], start: int|None = None) -> dict[str, list]:
+    '''snapshotのブロックを列ごとのデータ(time, fields...)にする。startを指定した場合は時刻がstartより後の行だけ。'''
+    columns = {name: [] for name in ('time', *fields)}
+    for first, last, count, times, values in blocks:
+        if start is not None and last <= start:
+            continue
+        block_times = decode_times(times, count)
+        skip = 0
+        if start is not None and first <= start:
+            while block_times[skip] <= start:
+                skip += 1
+        columns['time'] += block_times[skip:]
+        for name, data in zip(fields, values):
+            columns[name] += decode_values(data, count)[skip:]
+    return columns
+
+def _signed(value: int) -> int:
+    return value - (1 << 64) if value >> 63 else value
@@ -0,0 +1,726 @@
+from influxdb_client import InfluxDBClient, BucketRetentionRules, Dialect, Point
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+from influxdb_client.client.query_api_async import QueryApiAsync
+from influxdb_client.client.write_api import SYNCHRONOUS, WriteApi
+from influxdb_client.client.flux_table import TableList
+from ..common import settings
+from ..common.logger import logger
+from ..common import instrument
+from . import recent
+from .spool import Spool
+from .storage import Storage, WritePipeline, WriteStats, PROCESS_METRICS, CGROUP_METRICS, combine_hosts, select_rollup, to_ns, _NS
+from datetime import datetime, timedelta
+from dateutil import tz
+import asyncio
+import csv
+import io
+
+'''
+    InfluxDB v2に保存するストレージ。(settings.STORAGE_BACKEND='influxdb')
+'''
+
+_MEASUREMENT_SYS_STATS = 'system_stats'
+_MEASUREMENT_PROCESS_CPU = 'process_cpu'
+_MEASUREMENT_SYS_STATS_ROLLUP = 'system_stats_rollup'
+_MEASUREMENT_PROCESS_CPU_ROLLUP = 'process_cpu_rollup'
+
+# NOTE: 以前から書き込んでいるデータを読めるよう、測定名・cpuのフィールド名(cpu_percent)・
+# ロールアップの件数(cpu_count)はCPU使用率だけを保存していたときの名前のままにする
+_PROCESS_FIELDS = {'cpu': 'cpu_percent', 'rss': 'rss', 'read': 'read', 'write': 'write'}
+_PROCESS_COUNT_FIELD = 'cpu_count'
+
+# NOTE: settings.PROCESS_SCHEMA='name'では、系列数(タグの組み合わせの数)が増え続けないよう
+# nameだけをタグにし、pidはフィールドに保存する。nameの数はprocscan.NameRegistryで抑えている
+_MEASUREMENT_PROCESS_NAME = 'process_name'
+_MEASUREMENT_PROCESS_NAME_ROLLUP = 'process_name_rollup'
+
+# NOTE: cgroup(コンテナ・サービス)ごとの値。cgroupのパスはcgroupタグ
+_MEASUREMENT_CGROUP = 'cgroup_stats'
+_MEASUREMENT_CGROUP_ROLLUP = 'cgroup_stats_rollup'
+
+# NOTE: settings.MODE='aggregator'でエージェントから受け取ったサンプル。ホスト名はhostタグ
+_MEASUREMENT_HOST_STATS = 'host_stats'
+_MEASUREMENT_HOST_STATS_ROLLUP = 'host_stats_rollup'
+_HOST_EXTRA = ('mem_total', 'disk_total')   # host_statsだけにあるフィールド
+
+_query_seconds = instrument.histogram('psmon_query_seconds', 'Time spent in storage queries', ('query',))
+
+# MARK: InfluxDBStorage
+class InfluxDBStorage(Storage):
+    def __init__(self):
+        self.client: InfluxDBClient|None = None               # 書き込み・起動時のウォームアップ用
+        self.async_client: InfluxDBClientAsync|None = None    # APIからの問い合わせ用
+        self.writer: WritePipeline|None = None
+        self._write_api: WriteApi|None = None
+
+    # MARK: init & exit
+    def init(self):
+        self.client = InfluxDBClient(
+            url=settings.INFLUXDB_URL,
+            token=settings.INFLUXDB_TOKEN,
+            org=settings.INFLUXDB_ORG,
+        )
+        self._write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        spool = Spool(settings.SPOOL_PATH, settings.SPOOL_MAX_BYTES) if settings.SPOOL_PATH else None
+        self.writer = WritePipeline(self._write_lines, spool)
+        self.writer.start()
+
+        # 参考: retention periodが1週間のバケットの作成方法
+        # DOCKER_INFLUXDB_INIT_RETENTIONで設定できるため、以下のコードは不要になった
+
+        #buckets_api = client.buckets_api()
+        #existing_buckets = [b for b in buckets_api.find_buckets().buckets if b.name == settings.INFLUXDB_BUCKET]
+        #if not existing_buckets:
+        #    retention_rule = BucketRetentionRules(type="expire", every_seconds=60 * 60 * 24 * 7)
+        #    buckets_api.create_bucket(
+        #        bucket_name=settings.INFLUXDB_BUCKET,
+        #        org=settings.INFLUXDB_ORG,
+        #        retention_rules=[retention_rule]
+        #    )
+
+    async def init_async(self):
+        self.async_client = InfluxDBClientAsync(
+            url=settings.INFLUXDB_URL,
+            token=settings.INFLUXDB_TOKEN,
+            org=settings.INFLUXDB_ORG,
+            connection_pool_maxsize=settings.INFLUXDB_POOL_SIZE,
+        )
+
+    async def exit_async(self):
+        if self.async_client is None:
+            return
+        await self.async_client.close()
+        self.async_client = None
+
+    def exit(self):
+        if self.writer:
+            self.writer.stop()
+            self.writer = None
+        if self._write_api:
+            self._write_api.close()
+            self._write_api = None
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    # MARK: write
+    def _write_lines(self, lines: list[str]):
+        self._write_api.write(bucket=settings.INFLUXDB_BUCKET, record='\n'.join(lines))
+
+    def write_system_stats(self, time: int, fields: dict[str, float]):
+        point = Point.from_dict(dict(
+            measurement=_MEASUREMENT_SYS_STATS,
+            fields=fields,
+            time=time
+        ))
+        self.writer.put([point.to_line_protocol()])
+
+    def write_processes(self, time: int, processes: list[tuple]):
+        measurement, _ = _process_measurements()
+        lines = []
+        for pid, name, *values in processes:
+            point = _process_point(measurement, pid, name).time(time)
+            for metric, value in zip(PROCESS_METRICS, values):
+                point.field(_PROCESS_FIELDS[metric], value)
+            lines.append(point.to_line_protocol())
+        self.writer.put(lines)
+
+    def write_system_stats_rollup(self, every: str, time: int, fields: dict[str, float]):
+        point = Point.from_dict(dict(
+            measurement=_MEASUREMENT_SYS_STATS_ROLLUP,
+            tags={'every': every},
+            fields=fields,
+            time=time
+        ))
+        self.writer.put([point.to_line_protocol()])
+
+    def write_processes_rollup(self, every: str, time: int, processes: list[tuple]):
+        _, measurement = _process_measurements()
+        lines = []
+        for pid, name, *values in processes:
+            point = _process_point(measurement, pid, name).time(time).tag('every', every)
+            for k, metric in enumerate(PROCESS_METRICS):
+                point.field(f'{metric}_max', values[3 * k])
+                point.field(f'{metric}_min', values[3 * k + 1])
+                point.field(f'{metric}_sum', values[3 * k + 2])
+            point.field(_PROCESS_COUNT_FIELD, values[-1])
+            lines.append(point.to_line_protocol())
+        self.writer.put(lines)
+
+    def write_cgroups(self, time: int, cgroups: list[tuple]):
+        lines = []
+        for name, *values in cgroups:
+            point = Point(_MEASUREMENT_CGROUP).tag('cgroup', name).time(time)
+            for metric, value in zip(CGROUP_METRICS, values):
+                point.field(metric, value)
+            lines.append(point.to_line_protocol())
+        self.writer.put(lines)
+
+    def write_cgroups_rollup(self, every: str, time: int, cgroups: list[tuple]):
+        lines = []
+        for name, *values in cgroups:
+            point = Point(_MEASUREMENT_CGROUP_ROLLUP).tag('cgroup', name).tag('every', every).time(time)
+            for k, metric in enumerate(CGROUP_METRICS):
+                point.field(f'{metric}_max', values[2 * k])
+                point.field(f'{metric}_sum', values[2 * k + 1])
+            point.field('count', values[-1])
+            lines.append(point.to_line_protocol())
+        self.writer.put(lines)
+
+    def write_host_stats(self, host: str, rows: list[tuple]):
+        names = (*recent.FIELDS, *_HOST_EXTRA)
+        self.writer.put([
+            Point.from_dict(dict(
+                measurement=_MEASUREMENT_HOST_STATS,
+                tags={'host': host},
+                fields={name: value for name, value in zip(names, row[1:]) if value is not None},
+                time=row[0],
+            )).to_line_protocol()
+            for row in rows
+        ])
+
+    def write_host_stats_rollup(self, host: str, every: str, time: int, fields: dict[str, float]):
+        point = Point.from_dict(dict(
+            measurement=_MEASUREMENT_HOST_STATS_ROLLUP,
+            tags={'host': host, 'every': every},
+            fields=fields,
+            time=time
+        ))
+        self.writer.put([point.to_line_protocol()])
+
+    def write_stats(self) -> WriteStats|None:
+        return self.writer.stats() if self.writer else None
+
+    # MARK: query
+    async def query_system_stats(self, duration: settings.Duration, start: int, now: int, start_time: datetime|None) -> dict[str, list]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        fields = list(recent.FIELDS)
+        query_api = self.async_client.query_api()
+        rollup = select_rollup(duration.every_seconds)
+        if rollup is None:
+            if start_time:
+                range_start = (start_time + timedelta(microseconds=1)).isoformat()
+            else:
+                range_start = duration.period_start
+            query = _generate_system_stats_query(fields=fields, every=duration.every, start=range_start)
+            return await _query_columns(query_api, query)
+
+        # 最後のバケットはロールアップの書き込みが間に合っていない可能性があるため生データから集計する
+        every = duration.every_seconds * _NS
+        cutoff = now // every * every - every
+        queries = []
+        if start < cutoff:
+            # NOTE: ロールアップのタイムスタンプはバケットの開始時刻なので、start_timeちょうどから含める
+            range_start = start_time.isoformat() if start_time else duration.period_start
+            query = _generate_system_stats_rollup_query(
+                fields=fields,
+                rollup=rollup,
+                every=duration.every,
+                start=range_start,
+                stop=_ns_to_isoformat(cutoff),
+            )
+            queries.append(query)
+        queries.append(_generate_system_stats_query(
+            fields=fields,
+            every=duration.every,
+            start=_ns_to_isoformat(max(start, cutoff)),
+        ))
+        # ロールアップと生データのクエリは並行して実行する
+        results = await asyncio.gather(*[_query_columns(query_api, query) for query in queries])
+        columns = results[0]
+        for tail in results[1:]:
+            for name, values in tail.items():
+                columns[name].extend(values)
+        return columns
+
+    async def query_system_stats_range(self, every_seconds: int, start: int, end: int, now: int) -> dict[str, list]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        fields = list(recent.FIELDS)
+        query_api = self.async_client.query_api()
+        every = f'{every_seconds}s'
+        rollup = select_rollup(every_seconds)
+        cutoff = now // (every_seconds * _NS) * (every_seconds * _NS) - every_seconds * _NS
+        queries = []
+        if rollup is not None and start < cutoff:
+            queries.append(_generate_system_stats_rollup_query(
+                fields=fields,
+                rollup=rollup,
+                every=every,
+                start=_ns_to_isoformat(start),
+                stop=_ns_to_isoformat(min(cutoff, end)),
+            ))
+            start = cutoff
+        if start < end:
+            queries.append(_generate_system_stats_query(
+                fields=fields,
+                every=every,
+                start=_ns_to_isoformat(start),
+                stop=_ns_to_isoformat(end),
+            ))
+        if not queries:
+            return {name: [] for name in recent.COLUMNS}
+        results = await asyncio.gather(*[_query_columns(query_api, query) for query in queries])
+        columns = results[0]
+        for tail in results[1:]:
+            for name, values in tail.items():
+                columns[name].extend(values)
+        return columns
+
+    async def query_processes(self, metric: str, time: int, every_seconds: int, now: int) -> list[dict]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        every = every_seconds * _NS
+        start_time = _ns_to_isoformat(time - every)
+        end_time = _ns_to_isoformat(time)
+
+        # 書き込み済みのロールアップで窓を埋められる場合は生データを読まない
+        rollup = select_rollup(every_seconds)
+        if rollup is None or time > now // every * every - every:
+            rollup = None
+        by_name = settings.PROCESS_SCHEMA == 'name'
+        query = _generate_process_query(source=_process_source(metric, rollup), start=start_time, stop=end_time, by_name=by_name)
+        with _query_seconds.time('processes'):
+            tables = await self.async_client.query_api().query(query=query)
+        return [
+            dict(pid=int(record['pid']), name=record['name'], max=record['value_max'], min=record['value_min'], sum=record['value_sum'], count=record['value_count'])
+            for record in _convert_tables_to_list(tables)
+        ]
+
+    async def query_process_timeline(self, metric: str, every_seconds: int, start: int, end: int, now: int) -> list[dict]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        every = every_seconds * _NS
+        by_name = settings.PROCESS_SCHEMA == 'name'
+        # 書き込み済みのロールアップで埋められる窓はロールアップから、残りの窓は生データから集計する
+        queries = []
+        rollup = select_rollup(every_seconds)
+        cutoff = now // every * every - every
+        if rollup is not None and start < cutoff:
+            queries.append(_generate_process_query(
+                source=_process_source(metric, rollup), start=_ns_to_isoformat(start), stop=_ns_to_isoformat(min(cutoff, end)),
+                by_name=by_name, every=f'{every_seconds}s',
+            ))
+            start = cutoff
+        if start < end:
+            queries.append(_generate_process_query(
+                source=_process_source(metric, None), start=_ns_to_isoformat(start), stop=_ns_to_isoformat(end),
+                by_name=by_name, every=f'{every_seconds}s',
+            ))
+        query_api = self.async_client.query_api()
+        with _query_seconds.time('process_timeline'):
+            results = await asyncio.gather(*[query_api.query(query=query) for query in queries])
+        output = []
+        for tables in results:
+            output.extend(
+                dict(window=to_ns(record['_start']), pid=int(record['pid']), name=record['name'], max=record['value_max'], min=record['value_min'], sum=record['value_sum'], count=record['value_count'])
+                for record in _convert_tables_to_list(tables)
+            )
+        output.sort(key=lambda x: x['window'])
+        return output
+
+    async def query_cgroups(self, time: int, every_seconds: int, now: int) -> list[dict]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        every = every_seconds * _NS
+        # 書き込み済みのロールアップで窓を埋められる場合は生データを読まない
+        rollup = select_rollup(every_seconds)
+        if rollup is None or time > now // every * every - every:
+            rollup = None
+        query = _generate_cgroup_query(rollup=rollup, start=_ns_to_isoformat(time - every), stop=_ns_to_isoformat(time))
+        with _query_seconds.time('cgroups'):
+            tables = await self.async_client.query_api().query(query=query)
+        names = [f'{metric}_{stat}' for metric in CGROUP_METRICS for stat in ('max', 'sum')] + ['count']
+        return [
+            dict(name=record['cgroup'], **{name: record.get(name) or 0.0 for name in names})
+            for record in _convert_tables_to_list(tables)
+        ]
+
+    async def query_host_stats(self, every_seconds: int, start: int, end: int, now: int, host: str|None) -> dict[str, list]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        every = every_seconds * _NS
+        # NOTE: 全ホストを1つのクエリで(ホストごとの系列のまま)窓ごとに集計し、ホストをまたぐ合成はcombine_hostsで行う
+        queries = []
+        rollup = select_rollup(every_seconds)
+        cutoff = now // every * every - every
+        if rollup is not None and start < cutoff:
+            queries.append(_generate_host_stats_query(
+                rollup=rollup, every=f'{every_seconds}s', start=_ns_to_isoformat(start), stop=_ns_to_isoformat(min(cutoff, end)), host=host,
+            ))
+            start = cutoff
+        if start < end:
+            queries.append(_generate_host_stats_query(
+                rollup=None, every=f'{every_seconds}s', start=_ns_to_isoformat(start), stop=_ns_to_isoformat(end), host=host,
+            ))
+        query_api = self.async_client.query_api()
+        with _query_seconds.time('host_stats' if host else 'fleet_stats'):
+            results = await asyncio.gather(*[query_api.query(query=query) for query in queries])
+        n = len(recent.FIELDS)
+        hosts: dict[tuple[int, str], list] = {}
+        for tables in results:
+            for record in _convert_tables_to_list(tables):
+                # NOTE: aggregateWindowの_timeは窓の終了時刻
+                key = (to_ns(record['_time']) // every - 1, record['host'])
+                values = [record.get(f'{field}_{stat}') for stat in ('max', 'sum', 'count') for field in recent.FIELDS]
+                data = hosts.get(key)
+                if data is None:
+                    hosts[key] = values
+                    continue
+                for k in range(n):
+                    if values[k] is not None and (data[k] is None or values[k] > data[k]):
+                        data[k] = values[k]
+                for k in range(n, 3 * n):
+                    data[k] = (data[k] or 0.0) + (values[k] or 0.0)
+        return combine_hosts(hosts, every)
+
+    async def query_hosts(self, start: int) -> list[dict]:
+        if not self.async_client:
+            raise Exception('No database client object.')
+        field_filter = ' or '.join(f'r._field == "{field}"' for field in _HOST_EXTRA)
+        query = f'''
+from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {_ns_to_isoformat(start)})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_HOST_STATS}" and ({field_filter}))
+  |> last()
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> keep(columns: ["_time", "host", "mem_total", "disk_total"])
+'''
+        with _query_seconds.time('hosts'):
+            tables = await self.async_client.query_api().query(query=query)
+        hosts = {}
+        for record in _convert_tables_to_list(tables):
+            last_seen = to_ns(record['_time'])
+            if record['host'] not in hosts or hosts[record['host']]['last_seen'] < last_seen:
+                hosts[record['host']] = dict(host=record['host'], last_seen=last_seen, mem_total=record.get('mem_total'), disk_total=record.get('disk_total'))
+        return [hosts[host] for host in sorted(hosts)]
+
+    def load_recent(self, now: int) -> tuple[list[tuple[int, tuple[float, ...]]], dict[int, list[dict]]]:
+        if not self.client:
+            raise Exception('No database client object.')
+        fields = list(recent.FIELDS)
+        query_api = self.client.query_api()
+
+        aggregated = {}
+        for duration in settings.DURATIONS:
+            if duration.every_seconds in aggregated:
+                continue
+            query = _generate_system_stats_query(fields=fields, every=duration.every, start=duration.period_start)
+            aggregated[duration.every_seconds] = _convert_tables_to_list(query_api.query(query=query))
+
+        field_filter = " or ".join([f'r._field == "{field}"' for field in fields])
+        fields_str = ", ".join([f'"{field}"' for field in fields])
+        query = f'''
+from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: time(v: {recent.raw_warm_start(now)}))
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_SYS_STATS}")
+  |> filter(fn: (r) => {field_filter})
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> keep(columns: ["_time", {fields_str}])
+  |> sort(columns: ["_time"])
+'''
+        raw = [
+            (to_ns(record['_time']), tuple(float(record[field] or 0.0) for field in fields))
+            for record in _convert_tables_to_list(query_api.query(query=query))
+        ]
+        return raw, aggregated
+
+    def load_processes_rollup(self, every: str, time: int) -> list[tuple]:
+        _, measurement = _process_measurements()
+        rows = []
+        for record in self._load_rollup(measurement, every, time):
+            values = [record.get(f'{metric}_{stat}') or 0.0 for metric in PROCESS_METRICS for stat in ('max', 'min', 'sum')]
+            rows.append((int(record['pid']), record['name'], *values, record[_PROCESS_COUNT_FIELD]))
+        return rows
+
+    def load_cgroups_rollup(self, every: str, time: int) -> list[tuple]:
+        return [
+            (record['cgroup'], *[record[f'{metric}_{stat}'] for metric in CGROUP_METRICS for stat in ('max', 'sum')], record['count'])
+            for record in self._load_rollup(_MEASUREMENT_CGROUP_ROLLUP, every, time)
+        ]
+
+    def _load_rollup(self, measurement: str, every: str, time: int) -> list[dict]:
+        '''ロールアップの開始時刻timeの点を、フィールドを列にしたレコードで返す。'''
+        if not self.client:
+            raise Exception('No database client object.')
+        query = f'''
+from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: time(v: {time}), stop: time(v: {time + 1}))
+  |> filter(fn: (r) => r._measurement == "{measurement}" and r.every == "{every}")
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+'''
+        return _convert_tables_to_list(self.client.query_api().query(query=query))
+
+# MARK: subroutines
+
+def _generate_system_stats_query(fields: list[str], every: str, start: str, stop: str|None = None) -> str:
+    field_filter = " or ".join([f'r._field == "{field}"' for field in fields])
+    pivot_columns = [f"{field}_max" for field in fields] + [f"{field}_mean" for field in fields]
+    pivot_columns_str = ", ".join([f'"{col}"' for col in pivot_columns])
+
+    # NOTE: stopを指定しない場合は、まだ閉じていないバケットを含めない
+    truncated_end = stop if stop else f'date.truncate(t: now(), unit: {every})'
+    query = f'''
+import "date"
+truncated_end = {truncated_end}
+data = from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}{f', stop: {stop}' if stop else ''})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_SYS_STATS}")
+  |> filter(fn: (r) => {field_filter})
+  |> filter(fn: (r) => r._time < truncated_end)
+
+max_data = data
+  |> aggregateWindow(every: {every}, fn: max, createEmpty: false)
+  |> map(fn: (r) => ({{r with _stat: "max"}}))
+
+mean_data = data
+  |> aggregateWindow(every: {every}, fn: mean, createEmpty: false)
+  |> map(fn: (r) => ({{r with _stat: "mean"}}))
+
+union(tables: [max_data, mean_data])
+  |> map(fn: (r) => ({{r with _field: r._field + "_" + r._stat}}))
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> keep(columns: ["_time", {pivot_columns_str}])
+'''
+    return query
+
+def _generate_system_stats_rollup_query(fields: list[str], rollup: settings.Rollup, every: str, start: str, stop: str) -> str:
+    field_filter = " or ".join([f'r._field == "{field}_{stat}"' for field in fields for stat in ('max', 'sum', 'count')])
+    columns = ", ".join(
+        [f'{field}_max: r.{field}_max' for field in fields] +
+        [f'{field}_mean: r.{field}_sum / r.{field}_count' for field in fields]
+    )
+
+    query = f'''
+data = from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_SYS_STATS_ROLLUP}" and r.every == "{rollup.every}")
+  |> filter(fn: (r) => {field_filter})
+
+max_data = data
+  |> filter(fn: (r) => r._field =~ /_max$/)
+  |> aggregateWindow(every: {every}, fn: max, createEmpty: false)
+
+sum_data = data
+  |> filter(fn: (r) => r._field !~ /_max$/)
+  |> aggregateWindow(every: {every}, fn: sum, createEmpty: false)
+
+union(tables: [max_data, sum_data])
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> map(fn: (r) => ({{_time: r._time, {columns}}}))
+'''
+    return query
+
+def _generate_host_stats_query(rollup: settings.Rollup|None, every: str, start: str, stop: str, host: str|None) -> str:
+    '''host_stats(rollupがNoneの場合は生データ)を、ホストごと・窓ごとの各fieldのmax/sum/countにする。'''
+    # NOTE: hostはAPIで英数字と.-_だけに制限している
+    host_filter = f' and r.host == "{host}"' if host else ''
+    keep_columns = ', '.join(f'"{field}_{stat}"' for field in recent.FIELDS for stat in ('max', 'sum', 'count'))
+    if rollup is not None:
+        field_filter = ' or '.join(f'r._field == "{field}_{stat}"' for field in recent.FIELDS for stat in ('max', 'sum', 'count'))
+        return f'''
+data = from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_HOST_STATS_ROLLUP}" and r.every == "{rollup.every}"{host_filter})
+  |> filter(fn: (r) => {field_filter})
+
+max_data = data
+  |> filter(fn: (r) => r._field =~ /_max$/)
+  |> aggregateWindow(every: {every}, fn: max, createEmpty: false)
+
+sum_data = data
+  |> filter(fn: (r) => r._field !~ /_max$/)
+  |> aggregateWindow(every: {every}, fn: sum, createEmpty: false)
+
+union(tables: [max_data, sum_data])
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> keep(columns: ["_time", "host", {keep_columns}])
+'''
+    field_filter = ' or '.join(f'r._field == "{field}"' for field in recent.FIELDS)
+    return f'''
+data = from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_HOST_STATS}"{host_filter})
+  |> filter(fn: (r) => {field_filter})
+
+max_data = data
+  |> aggregateWindow(every: {every}, fn: max, createEmpty: false)
+  |> map(fn: (r) => ({{r with _field: r._field + "_max"}}))
+
+sum_data = data
+  |> aggregateWindow(every: {every}, fn: sum, createEmpty: false)
+  |> map(fn: (r) => ({{r with _field: r._field + "_sum"}}))
+
+count_data = data
+  |> aggregateWindow(every: {every}, fn: count, createEmpty: false)
+  |> map(fn: (r) => ({{r with _field: r._field + "_count", _value: float(v: r._value)}}))
+
+union(tables: [max_data, sum_data, count_data])
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> keep(columns: ["_time", "host", {keep_columns}])
+'''
+
+def _generate_cgroup_query(rollup: settings.Rollup|None, start: str, stop: str) -> str:
+    '''cgroup_stats(rollupがNoneの場合は生データ)の[start, stop)を、cgroupごとの各metricのmax/sumとcountにする。'''
+    keep_columns = ', '.join(f'"{metric}_{stat}"' for metric in CGROUP_METRICS for stat in ('max', 'sum'))
+    if rollup is not None:
+        source = f'''
+data = from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_CGROUP_ROLLUP}" and r.every == "{rollup.every}")
+
+max_data = data
+  |> filter(fn: (r) => r._field =~ /_max$/)
+  |> max()
+
+sum_data = data
+  |> filter(fn: (r) => r._field !~ /_max$/)
+  |> sum()
+'''
+        tables = 'max_data, sum_data'
+    else:
+        source = f'''
+data = from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == "{_MEASUREMENT_CGROUP}")
+
+max_data = data
+  |> max()
+  |> map(fn: (r) => ({{r with _field: r._field + "_max"}}))
+
+sum_data = data
+  |> sum()
+  |> map(fn: (r) => ({{r with _field: r._field + "_sum"}}))
+
+count_data = data
+  |> filter(fn: (r) => r._field == "{CGROUP_METRICS[0]}")
+  |> count()
+  |> map(fn: (r) => ({{r with _field: "count", _value: float(v: r._value)}}))
+'''
+        tables = 'max_data, sum_data, count_data'
+    return f'''{source}
+union(tables: [{tables}])
+  |> group(columns: ["cgroup"])
+  |> pivot(rowKey: ["cgroup"], columnKey: ["_field"], valueColumn: "_value")
+  |> keep(columns: ["cgroup", {keep_columns}, "count"])
+'''
+
+def _process_source(metric: str, rollup: settings.Rollup|None) -> str:
+    '''プロセスの生データ(rollupがNoneの場合)またはロールアップを、value_max/min/sum/countの列にするFlux'''
+    raw_measurement, rollup_measurement = _process_measurements()
+    by_name = settings.PROCESS_SCHEMA == 'name'
+    extra = ' or r._field == "pid"' if by_name else ''
+    if rollup is not None:
+        fields = [f'{metric}_max', f'{metric}_min', f'{metric}_sum', _PROCESS_COUNT_FIELD]
+        field_filter = ' or '.join(f'r._field == "{field}"' for field in fields)
+        return f'''
+  |> filter(fn: (r) => r._measurement == "{rollup_measurement}" and r.every == "{rollup.every}")
+  |> filter(fn: (r) => {field_filter}{extra})
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> map(fn: (r) => ({{r with value_max: r.{fields[0]}, value_min: r.{fields[1]}, value_sum: r.{fields[2]}, value_count: r.{fields[3]}}}))'''
+    field = _PROCESS_FIELDS[metric]
+    if by_name:
+        return f'''
+  |> filter(fn: (r) => r._measurement == "{raw_measurement}" and (r._field == "{field}"{extra}))
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> map(fn: (r) => ({{r with value_max: r.{field}, value_min: r.{field}, value_sum: r.{field}, value_count: 1.0}}))'''
+    # NOTE: 生データも1サンプルをmax/min/sum/countの形式にしてロールアップと同じように集計する
+    return f'''
+  |> filter(fn: (r) => r._measurement == "{raw_measurement}" and r._field == "{field}")
+  |> map(fn: (r) => ({{r with value_max: r._value, value_min: r._value, value_sum: r._value, value_count: 1.0}}))'''
+
+def _generate_process_query(source: str, start: str, stop: str, by_name: bool = False, every: str|None = None) -> str:
+    # NOTE: pid・name(名前ごとに保存した場合はname)ごとにreduceで1回走査してmax/min/sum/countを求め、平均の上位だけを返す。
+    # tagはreduceの後もグループキーとして行に残る。名前ごとの場合のpidはフィールドなので、value_maxが最大の行のものを残す
+    # everyを指定した場合は、everyの窓(_start)ごとに同じ集計をして窓ごとの上位を返す
+    if by_name:
+        group_columns = '"name"'
+        pid_identity = 'pid: 0, '
+        pid_reduce = '''
+        pid: if r.value_max > accumulator.value_max then r.pid else accumulator.pid,'''
+    else:
+        group_columns = '"pid", "name"'
+        pid_identity = ''
+        pid_reduce = ''
+    window = ''
+    if every:
+        window = f'\n  |> window(every: {every})'
+        group_columns = '"_start", ' + group_columns
+    query = f'''
+from(bucket: "{settings.INFLUXDB_BUCKET}")
+  |> range(start: {start}, stop: {stop}){source}{window}
+  |> group(columns: [{group_columns}])
+  |> reduce(
+      identity: {{{pid_identity}value_max: -1.0e300, value_min: 1.0e300, value_sum: 0.0, value_count: 0.0}},
+      fn: (r, accumulator) => ({{{pid_reduce}
+        value_max: if r.value_max > accumulator.value_max then r.value_max else accumulator.value_max,
+        value_min: if r.value_min < accumulator.value_min then r.value_min else accumulator.value_min,
+        value_sum: accumulator.value_sum + r.value_sum,
+        value_count: accumulator.value_count + r.value_count,
+      }}),
+  )
+  |> group({'columns: ["_start"]' if every else ''})
+  |> map(fn: (r) => ({{r with value_mean: r.value_sum / r.value_count}}))
+  |> top(n: {settings.TOP_PROCESS_COUNT}, columns: ["value_mean"])
+  |> keep(columns: [{'"_start", ' if every else ''}"pid", "name", "value_max", "value_min", "value_sum", "value_count"])
+'''
+    return query
+
+def _process_measurements() -> tuple[str, str]:
+    '''プロセスの(生データ, ロールアップ)の測定名'''
+    if settings.PROCESS_SCHEMA == 'name':
+        return _MEASUREMENT_PROCESS_NAME, _MEASUREMENT_PROCESS_NAME_ROLLUP
+    return _MEASUREMENT_PROCESS_CPU, _MEASUREMENT_PROCESS_CPU_ROLLUP
+
+def _process_point(measurement: str, pid: int, name: str) -> Point:
+    point = Point(measurement).tag('name', name)
+    if measurement in (_MEASUREMENT_PROCESS_NAME, _MEASUREMENT_PROCESS_NAME_ROLLUP):
+        return point.field('pid', int(pid))
+    return point.tag('pid', str(pid))
+
+def _ns_to_isoformat(t: int) -> str:
+    return (datetime.fromtimestamp(t // _NS, tz=tz.UTC) + timedelta(microseconds=t % _NS // 1000)).isoformat()
+
+def _convert_to_time_delta(timestamp: datetime, tables: TableList) -> list[dict]:
+    output = []
+    for table in tables:
+        for record in table.records:
+            record['time_delta'] = (record['_time'] - timestamp).total_seconds()
+            output.append(record.values)
+    return output
+
+async def _query_columns(query_api: QueryApiAsync, query: str) -> dict[str, list]:
+    # NOTE: FluxRecordを作らずにCSVの行から直接列を作る。(_timeはエポックミリ秒にする)
+    with _query_seconds.time('system_stats'):
+        text = await query_api.query_raw(query=query, dialect=_COLUMNS_DIALECT)
+    return _convert_csv_to_columns(csv.reader(io.StringIO(text)), recent.COLUMNS)
+
+_COLUMNS_DIALECT = Dialect(header=True, delimiter=',', annotations=[], comment_prefix='#', date_time_format='RFC3339')
+
+def _convert_csv_to_columns(rows, names: tuple[str, ...]) -> dict[str, list]:
+    columns = {name: [] for name in names}
+    times = columns['time']
+    values = [(columns[name], name) for name in names if name != 'time']
+    header = None
+    for row in rows:
+        if not row or not any(row):
+            header = None   # テーブルの区切り
+            continue
+        if header is None:
+            header = {name: i for i, name in enumerate(row)}
+            time_index = header['_time']
+            indices = [(column, header.get(name)) for column, name in values]
+            continue
+        times.append(int(datetime.fromisoformat(row[time_index]).timestamp() * 1000))
+        for column, i in indices:
+            cell = row[i] if i is not None else ''
+            column.append(float(cell) if cell else None)
+    return columns
+
+def _convert_tables_to_list(tables: TableList) -> list[dict]:
+    output = []
+    for table in tables:
+        for record in table.records:
+            output.append(record.values)
+    return output
@@ -0,0 +1,242 @@
+from array import array
+from datetime import datetime
+from dateutil import tz
+from typing import Iterable
+import threading
+from ..common import settings
+
+'''
+    直近のsystem_statsをメモリ上に保持する。
+
+    - SampleRing: 生サンプルの固定長リングバッファ
+    - BucketSeries: every秒ごとのmax/meanバケット(DURATIONSのeveryごとに1つ)
+
+    collect_metricsから直接追記されるため、差分取得(start_time指定)や短い期間の問い合わせは
+    InfluxDBに問い合わせずに返すことができる。
+'''
+
+FIELDS = ('cpu_percent', 'mem_available', 'disk_used')
+COLUMNS = ('time',) + tuple(f'{field}_{stat}' for field in FIELDS for stat in ('max', 'mean'))
+
+_NS = 1_000_000_000
+
+# MARK: SampleRing
+class SampleRing:
+    '''生サンプルを固定長の配列に循環して保持する。'''
+    def __init__(self, capacity: int, fields: tuple[str, ...] = FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self._times = array('q', bytes(8 * capacity))
+        self._values = [array('d', bytes(8 * capacity)) for _ in fields]
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, t: int, values: tuple[float, ...]):
+        i = self._next
+        self._times[i] = t
+        for column, value in zip(self._values, values):
+            column[i] = value
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def oldest_time(self) -> int|None:
+        if not self._count:
+            return None
+        return self._times[(self._next - self._count) % self.capacity]
+
+    def newest_time(self) -> int|None:
+        if not self._count:
+            return None
+        return self._times[(self._next - 1) % self.capacity]
+
+    def samples(self, start: int = 0) -> list[tuple[int, tuple[float, ...]]]:
+        '''時刻startより後のサンプルを古い順に取得する。'''
+        output = []
+        for k in range(self._count):
+            i = (self._next - self._count + k) % self.capacity
+            t = self._times[i]
+            if t > start:
+                output.append((t, tuple(column[i] for column in self._values)))
+        return output
+
+# MARK: BucketSeries
+class BucketSeries:
+    '''every秒ごとのバケットのcount/sum/maxを逐次更新する。
+
+    バケットはエポックに揃えたeveryの境界で区切る(FluxのaggregateWindowと同じ)。
+    スロットはバケットの開始時刻から決まるため、古いバケットは自然に上書きされる。
+    '''
+    def __init__(self, every_seconds: int, period_seconds: int, fields: tuple[str, ...] = FIELDS):
+        self.every = every_seconds * _NS
+        self.period = period_seconds * _NS
+        self.slots = period_seconds // every_seconds + 2
+        self.fields = fields
+        self.coverage_start: int|None = None  # これ以降のバケットはメモリ上で欠けがない
+        self.current: int|None = None         # 集計中のバケットの開始時刻
+        self._starts = array('q', [-1]) * self.slots
+        self._counts = array('q', bytes(8 * self.slots))
+        self._sums = [array('d', bytes(8 * self.slots)) for _ in fields]
+        self._maxes = [array('d', bytes(8 * self.slots)) for _ in fields]
+
+    def bucket_start(self, t: int) -> int:
+        return t // self.every * self.every
+
+    def add(self, t: int, values: tuple[float, ...]) -> int|None:
+        '''サンプルを追加する。前のバケットが閉じた場合はその開始時刻を返す。'''
+        start = self.bucket_start(t)
+        closed = None
+        if self.current is not None and self.current < start:
+            closed = self.current
+        if self.current is None or self.current < start:
+            self.current = start
+        i = (start // self.every) % self.slots
+        if self._starts[i] != start:
+            self._starts[i] = start
+            self._counts[i] = 1
+            for k, value in enumerate(values):
+                self._sums[k][i] = value
+                self._maxes[k][i] = value
+        else:
+            self._counts[i] += 1
+            for k, value in enumerate(values):
+                self._sums[k][i] += value
+                if value > self._maxes[k][i]:
+                    self._maxes[k][i] = value
+        if self.coverage_start is None:
+            # 途中から集計を始めたバケットは不完全なので、次のバケットから有効とする
+            self.coverage_start = start + self.every
+        return closed
+
+    def load(self, start: int, maxes: tuple[float, ...], means: tuple[float, ...]):
+        '''集計済みのバケットを読み込む。(起動時のウォームアップ用)'''
+        i = (start // self.every) % self.slots
+        self._starts[i] = start
+        self._counts[i] = 1
+        for k in range(len(self.fields)):
+            self._sums[k][i] = means[k]
+            self._maxes[k][i] = maxes[k]
+
+    def covers(self, start: int) -> bool:
+        if self.coverage_start is None or self.coverage_start > self.bucket_start(start):
+            return False
+        # NOTE: スロットを一巡して上書きされたバケットは返せない
+        return self.current is None or self.bucket_start(start) > self.current - (self.slots - 1) * self.every
+
+    def columns(self, start: int, end: int) -> dict[str, list]:
+        '''時刻startより後に終わり、時刻end以前に終わるバケットを列ごとに取得する。timeはバケットの終了時刻(エポックミリ秒)。'''
+        times = []
+        maxes = [[] for _ in self.fields]
+        means = [[] for _ in self.fields]
+        first = self.bucket_start(start)
+        for bucket in range(first, end, self.every):
+            stop = bucket + self.every
+            if stop <= start or stop > end:
+                continue
+            i = (bucket // self.every) % self.slots
+            if self._starts[i] != bucket:
+                continue
+            times.append(stop // 1_000_000)
+            count = self._counts[i]
+            for k in range(len(self.fields)):
+                maxes[k].append(self._maxes[k][i])
+                means[k].append(self._sums[k][i] / count)
+        columns = {'time': times}
+        for k, field in enumerate(self.fields):
+            columns[f'{field}_max'] = maxes[k]
+            columns[f'{field}_mean'] = means[k]
+        return columns
+
+    def record(self, bucket: int) -> dict|None:
+        '''開始時刻がbucketのバケットをFluxのクエリ結果と同じ形式(_timeはバケットの終了時刻)で取得する。'''
+        i = (bucket // self.every) % self.slots
+        if self._starts[i] != bucket:
+            return None
+        record = {'_time': datetime.fromtimestamp((bucket + self.every) / _NS, tz=tz.UTC)}
+        count = self._counts[i]
+        for k, field in enumerate(self.fields):
+            record[f'{field}_max'] = self._maxes[k][i]
+            record[f'{field}_mean'] = self._sums[k][i] / count
+        return record
+
+# MARK: RecentStats
+class RecentStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ring = SampleRing(settings.RECENT_CAPACITY)
+        self.series: dict[int, BucketSeries] = {}
+        for duration in settings.DURATIONS:
+            series = self.series.get(duration.every_seconds)
+            if series is None or series.slots < duration.period_seconds // duration.every_seconds + 2:
+                self.series[duration.every_seconds] = BucketSeries(duration.every_seconds, duration.period_seconds)
+
+    def append(self, t: int, **values: float) -> list[tuple[int, dict]]:
+        '''サンプルを追加し、閉じたバケットを(every_seconds, レコード)のリストで返す。'''
+        row = tuple(float(values[field]) for field in FIELDS)
+        closed = []
+        with self._lock:
+            self.ring.append(t, row)
+            for every_seconds, series in self.series.items():
+                bucket = series.add(t, row)
+                if bucket is not None:
+                    record = series.record(bucket)
+                    if record is not None:
+                        closed.append((every_seconds, record))
+        return closed
+
+    def warm(self, now: int, raw: Iterable[tuple[int, tuple[float, ...]]], aggregated: dict[int, list[dict]]):
+        '''InfluxDBから読み込んだデータでメモリを初期化する。
+
+        Args:
+            now (int): 問い合わせた時刻(ns)
+            raw: rawの範囲の生サンプル(時刻, 値)のリスト。時刻順であること
+            aggregated: everyごとの集計済みレコード(Fluxのクエリ結果と同じ形式)
+        '''
+        raw = list(raw)
+        raw_start = raw_warm_start(now)
+        with self._lock:
+            for t, row in raw:
+                self.ring.append(t, row)
+            for every_seconds, series in self.series.items():
+                # raw_start以降のバケットは生サンプルから作り直す
+                boundary = -(-raw_start // series.every) * series.every
+                for record in aggregated.get(every_seconds, []):
+                    stop = int(record['_time'].timestamp()) * _NS
+                    start = stop - series.every
+                    if start < boundary:
+                        series.load(
+                            start,
+                            tuple(record.get(f'{field}_max') or 0.0 for field in FIELDS),
+                            tuple(record.get(f'{field}_mean') or 0.0 for field in FIELDS),
+                        )
+                for t, row in raw:
+                    if t >= boundary:
+                        series.add(t, row)
+                # 期間内のバケットは全て読み込んだので、以降はメモリで返せる
+                series.coverage_start = series.bucket_start(now - series.period)
+
+    def get_columns(self, every_seconds: int, start: int, end: int) -> dict[str, list]|None:
+        '''メモリ上で返せる場合は列ごとのデータを返す。返せない場合はNoneを返す。'''
+        with self._lock:
+            series = self.series.get(every_seconds)
+            if series is None or not series.covers(start):
+                return None
+            return series.columns(start, end)
+
+    def newest_time(self) -> int|None:
+        with self._lock:
+            return self.ring.newest_time()
+
+    def get_samples(self, start: int = 0) -> list[tuple[int, tuple[float, ...]]]:
+        with self._lock:
+            return self.ring.samples(start)
+
+def raw_warm_start(now: int) -> int:
+    '''ウォームアップで生サンプルを読み込む範囲の開始時刻(ns)'''
+    max_every = max(duration.every_seconds for duration in settings.DURATIONS)
+    span = max(max_every, settings.RECENT_CAPACITY * settings.METRICS_INTERVAL)
+    return now - span * _NS
+
+store = RecentStats()
@@ -0,0 +1,135 @@
+from pathlib import Path
+from typing import Callable
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from ..common import settings
+from ..common.logger import logger
+from . import recent
+
+'''
+    測定したサンプルを複数のワーカープロセスで共有するためのリングバッファ。(mmapしたファイル)
+
+    リーダー(測定するプロセス)だけが書き込み、フォロワー(APIだけを処理するプロセス)は
+    新しいサンプルを読んで自分のrecent.storeに追記する。直近データはどのワーカーでもメモリから返せるため、
+    読み込みの処理能力はワーカー数に応じて伸びる。
+
+    レイアウト: ヘッダ(容量, 次の通し番号)と、通し番号付きのスロット(seq, time, FIELDSの値)の配列。
+    書き込み中のスロットはseqを-1にしておき、読み込み側は前後で読んだseqが一致するときだけ採用する。(seqlock)
+'''
+
+_HEADER = struct.Struct('<qq')
+_SLOT = struct.Struct('<qq' + 'd' * len(recent.FIELDS))
+_POLL_SECONDS = 0.25    # フォロワーが新しいサンプルを確認する間隔
+
+# MARK: SharedSamples
+class SharedSamples:
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        size = _HEADER.size + _SLOT.size * capacity
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # 初期化は1つのプロセスだけが行う
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != size or self._read_capacity(fd) != capacity:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, _HEADER.pack(capacity, 0), 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read_capacity(fd: int) -> int|None:
+        header = os.pread(fd, _HEADER.size, 0)
+        return _HEADER.unpack(header)[0] if len(header) == _HEADER.size else None
+
+    def close(self):
+        self._mm.close()
+
+    def next_seq(self) -> int:
+        return _HEADER.unpack_from(self._mm, 0)[1]
+
+    def append(self, t: int, row: tuple[float, ...]):
+        '''サンプルを書き込む。(リーダーだけが呼び出すこと)'''
+        seq = self.next_seq()
+        offset = _HEADER.size + _SLOT.size * (seq % self.capacity)
+        struct.pack_into('<q', self._mm, offset, -1)
+        _SLOT.pack_into(self._mm, offset, -1, t, *row)
+        struct.pack_into('<q', self._mm, offset, seq)
+        struct.pack_into('<q', self._mm, 8, seq + 1)
+
+    def read(self, seq: int) -> tuple[int, tuple[float, ...]]|None:
+        '''通し番号seqのサンプルを読む。上書きされたか書き込み中の場合はNoneを返す。'''
+        offset = _HEADER.size + _SLOT.size * (seq % self.capacity)
+        before, t, *row = _SLOT.unpack_from(self._mm, offset)
+        after = struct.unpack_from('<q', self._mm, offset)[0]
+        if before != seq or after != seq:
+            return None
+        return t, tuple(row)
+
+    def samples(self, start: int = 0) -> tuple[int, list[tuple[int, tuple[float, ...]]]]:
+        '''時刻startより後のサンプルを古い順に読み、(次の通し番号, サンプル)を返す。'''
+        end = self.next_seq()
+        output = []
+        for seq in range(max(0, end - self.capacity), end):
+            sample = self.read(seq)
+            if sample is not None and sample[0] > start:
+                output.append(sample)
+        return end, output
+
+# MARK: Follower
+class Follower:
+    '''共有リングバッファの新しいサンプルをon_sampleに渡し続ける。'''
+    def __init__(self, shared: SharedSamples, on_sample: Callable[[int, tuple[float, ...]], None], next_seq: int):
+        self.shared = shared
+        self.on_sample = on_sample
+        self._next = next_seq
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='psmon-follower', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._poll()    # 止める直前までのサンプルを取りこぼさない
+
+    def _run(self):
+        while not self._stop.wait(_POLL_SECONDS):
+            try:
+                self._poll()
+            except Exception as e:
+                logger.exception(f'failed to follow shared samples: {e}')
+
+    def _poll(self):
+        end = self.shared.next_seq()
+        if end - self._next > self.shared.capacity:
+            logger.warning(f'follower lagged behind: skipped {end - self._next - self.shared.capacity} samples')
+            self._next = end - self.shared.capacity
+        while self._next < end:
+            sample = self.shared.read(self._next)
+            self._next += 1
+            if sample is not None:
+                self.on_sample(*sample)
+
+# MARK: open & close
+samples: SharedSamples|None = None
+
+def open_samples():
+    global samples
+    if samples is None:
+        samples = SharedSamples(settings.SHARED_RECENT_PATH, settings.RECENT_CAPACITY)
+
+def close_samples():
+    global samples
+    if samples is not None:
+        samples.close()
+        samples = None
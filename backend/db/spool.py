@@ -0,0 +1,179 @@
+from pathlib import Path
+import fcntl
+import os
+import struct
+import zlib
+from ..common.logger import logger
+
+'''
+    ストレージに書き込めなかった行をディスクに溜めておき、復旧後にまとめて再送するためのスプール。
+
+    ディレクトリの中に番号順のセグメントファイル(0000000001.seg, ...)を作り、最新のセグメントに追記する。
+    合計がmax_bytesを超えたら最も古いセグメントから捨てる。再送は最も古いセグメントの先頭から読み、
+    書き込めたところまで読み出し位置を進め、読み終えたセグメントを削除する。
+
+    レコードの形式: ヘッダ(マジック'PSP1', 圧縮後の長さ, 行数, CRC32: 各uint32 LE) + zlibで圧縮した行('\n'区切り)
+    書き込みの途中で落ちた場合に備え、開くときにCRCが合わないレコード以降を切り捨てる。
+
+    読み出し位置はメモリにしか持たないため、再送の途中で落ちると一部の行をもう一度送る。
+    (InfluxDBは同じ系列・同じ時刻の点を上書きするので、重複しても結果は変わらない)
+'''
+
+_MAGIC = b'PSP1'
+_HEADER = struct.Struct('<4sIII')
+_SEGMENTS = 8                   # max_bytesを何個のセグメントに分けるか(捨てる単位)
+_MIN_SEGMENT_BYTES = 64 * 1024
+
+# MARK: Spool
+class Spool:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(max_bytes // _SEGMENTS, _MIN_SEGMENT_BYTES)
+        self.evicted_lines = 0
+        self._segments: list[list[int]] = []    # [番号, バイト数, 未送信の行数](古い順)
+        self._offset = 0                        # 最も古いセグメントの読み出し位置
+        self._file = None                       # 追記中のセグメント(最新のセグメント)
+        self._lock_fd: int|None = None
+
+    # MARK: open & close
+    def open(self) -> bool:
+        '''ディレクトリをロックして既存のセグメントを読み込む。他のプロセスが使っていればFalseを返す。'''
+        if self._lock_fd is not None:
+            return True
+        self.path.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path / 'lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        self._segments = []
+        self._offset = 0
+        for file in sorted(self.path.glob('*.seg')):
+            size, lines = _scan(file)
+            if size == 0:
+                file.unlink()
+                continue
+            self._segments.append([int(file.stem), size, lines])
+        if self._segments:
+            logger.info(f'spool has {self.lines} lines ({self.bytes} bytes) to replay')
+        return True
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._lock_fd is not None
+
+    @property
+    def lines(self) -> int:
+        '''まだ再送していない行数'''
+        return sum(segment[2] for segment in self._segments)
+
+    @property
+    def bytes(self) -> int:
+        return sum(segment[1] for segment in self._segments)
+
+    # MARK: append
+    def append(self, lines: list[str]):
+        '''行をまとめて1つのレコードとして追記する。'''
+        if not lines:
+            return
+        payload = zlib.compress('\n'.join(lines).encode(), 1)
+        record = _HEADER.pack(_MAGIC, len(payload), len(lines), zlib.crc32(payload)) + payload
+        if self._file is None or self._segments[-1][1] + len(record) > self.segment_bytes:
+            self._rotate()
+        self._file.write(record)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._segments[-1][1] += len(record)
+        self._segments[-1][2] += len(lines)
+        self._evict()
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        seq = self._segments[-1][0] + 1 if self._segments else 1
+        self._file = open(self.path / f'{seq:010d}.seg', 'ab')
+        self._segments.append([seq, 0, 0])
+
+    def _evict(self):
+        # NOTE: 追記中のセグメントは捨てない
+        while len(self._segments) > 1 and self.bytes > self.max_bytes:
+            seq, _, lines = self._segments.pop(0)
+            (self.path / f'{seq:010d}.seg').unlink(missing_ok=True)
+            self._offset = 0
+            self.evicted_lines += lines
+            logger.warning(f'spool is full: evicted {lines} lines')
+
+    # MARK: replay
+    def read(self, max_lines: int) -> tuple[list[str], tuple[int, int, int]]:
+        '''最も古いセグメントから最大max_lines行程度を読む。(最低1レコード)
+
+        Returns:
+            tuple[list[str], tuple]: 読んだ行と、書き込めた後にcommitに渡す読み出し位置
+        '''
+        if not self._segments:
+            return [], (0, 0, 0)
+        seq, size, _ = self._segments[0]
+        lines = []
+        offset = self._offset
+        with open(self.path / f'{seq:010d}.seg', 'rb') as f:
+            f.seek(offset)
+            while offset < size and (not lines or len(lines) < max_lines):
+                header = f.read(_HEADER.size)
+                _, length, _, _ = _HEADER.unpack(header)
+                payload = f.read(length)
+                lines.extend(zlib.decompress(payload).decode().split('\n'))
+                offset += _HEADER.size + length
+        return lines, (seq, offset, len(lines))
+
+    def commit(self, position: tuple[int, int, int]):
+        '''readで読んだ行を書き込めたので、読み出し位置を進める。'''
+        seq, offset, lines = position
+        if not self._segments or self._segments[0][0] != seq:
+            return  # 書き込んでいる間に捨てられた
+        segment = self._segments[0]
+        segment[2] -= lines
+        if offset < segment[1]:
+            self._offset = offset
+            return
+        # 読み終えたセグメントを削除する
+        if len(self._segments) == 1 and self._file:
+            self._file.close()
+            self._file = None
+        self._segments.pop(0)
+        self._offset = 0
+        (self.path / f'{seq:010d}.seg').unlink(missing_ok=True)
+
+# MARK: subroutines
+
+def _scan(file: Path) -> tuple[int, int]:
+    '''セグメントのレコードを検証し、(正しいレコードまでのバイト数, 行数)を返す。壊れたレコード以降は切り捨てる。'''
+    offset = 0
+    lines = 0
+    with open(file, 'r+b') as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+            magic, length, count, crc = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                break
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            offset += _HEADER.size + length
+            lines += count
+        if f.seek(0, os.SEEK_END) != offset:
+            logger.warning(f'spool segment {file.name} is truncated at {offset} bytes')
+            f.truncate(offset)
+    return offset, lines
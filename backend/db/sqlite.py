@@ -0,0 +1,542 @@
+from ..common import settings
+from ..common.logger import logger
+from ..common import instrument
+from . import recent
+from .storage import Storage, WritePipeline, WriteStats, PROCESS_METRICS, CGROUP_METRICS, columns_to_records, combine_hosts, select_rollup, to_ns, _NS
+from datetime import datetime
+from pathlib import Path
+import asyncio
+import sqlite3
+import threading
+import time as _time
+
+'''
+    単一ホスト向けに、InfluxDBの代わりにSQLiteのファイルへ保存するストレージ。(settings.STORAGE_BACKEND='sqlite')
+
+    テーブルは種類ごとにsettings.SQLITE_PARTITION_SECONDSの期間で分け(例: system_stats_20000)、
+    保持期間を過ぎたテーブルはDROPする。行単位のDELETEやVACUUMは行わない。
+    長い期間の問い合わせは、collect_metricsが書き込むロールアップのテーブル(ダウンサンプリング済み)を使うため、
+    生データは直近の分だけ残せばよい。
+
+    書き込みはWritePipelineのスレッドが1つの接続でまとめて行い、
+    問い合わせはスレッドごとの読み取り専用の接続で行う。(WALなので書き込みと並行して読める)
+'''
+
+_query_seconds = instrument.histogram('psmon_query_seconds', 'Time spent in storage queries', ('query',))
+
+_SYS_STATS = 'system_stats'
+_PROCESSES = 'process_stats'
+_SYS_STATS_ROLLUP = 'system_stats_rollup'
+_PROCESSES_ROLLUP = 'process_stats_rollup'
+_PROCESS_NAMES = 'process_names'                    # settings.PROCESS_SCHEMA='name'のとき
+_PROCESS_NAMES_ROLLUP = 'process_names_rollup'
+_CGROUPS = 'cgroup_stats'
+_CGROUPS_ROLLUP = 'cgroup_stats_rollup'
+_HOST_STATS = 'host_stats'                          # settings.MODE='aggregator'でエージェントから受け取ったサンプル
+_HOST_STATS_ROLLUP = 'host_stats_rollup'
+_HOST_EXTRA = ('mem_total', 'disk_total')           # host_statsだけにある列
+
+# MARK: SQLiteStorage
+class SQLiteStorage(Storage):
+    def __init__(self, path: str):
+        self.path = path
+        self.raw_retention = settings.SQLITE_RAW_RETENTION
+        self.partition = settings.SQLITE_PARTITION_SECONDS * _NS
+        self.writer: WritePipeline|None = None
+        self._conn: sqlite3.Connection|None = None      # 書き込み用(WritePipelineのスレッドで使う)
+        self._local = threading.local()                 # 問い合わせ用の接続(スレッドごと)
+        self._readers: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._tables: set[str] = set()
+        self._expire_requested = False                  # 次の書き込みで保持期間を過ぎたテーブルを削除する
+
+    # MARK: init & exit
+    def init(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._tables = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.writer = WritePipeline(self._write_rows)
+        self.writer.start()
+
+    def expire(self):
+        # NOTE: 書き込み用の接続はWritePipelineのスレッドで使うため、削除も次の書き込みのときにそのスレッドで行う
+        self._expire_requested = True
+
+    def exit(self):
+        if self.writer:
+            self.writer.stop()
+            self.writer = None
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    # MARK: write
+    def write_system_stats(self, time: int, fields: dict[str, float]):
+        self.writer.put([(_SYS_STATS, (time, *[fields.get(field) for field in recent.FIELDS]))])
+
+    def write_processes(self, time: int, processes: list[tuple]):
+        prefix, _ = _process_prefixes()
+        self.writer.put([(prefix, (time, *process)) for process in processes])
+
+    def write_system_stats_rollup(self, every: str, time: int, fields: dict[str, float]):
+        row = [time]
+        for field in recent.FIELDS:
+            row += [fields[f'{field}_max'], fields[f'{field}_sum'], fields[f'{field}_count']]
+        self.writer.put([(f'{_SYS_STATS_ROLLUP}_{every}', tuple(row))])
+
+    def write_processes_rollup(self, every: str, time: int, processes: list[tuple]):
+        prefix = f'{_process_prefixes()[1]}_{every}'
+        self.writer.put([(prefix, (time, *process)) for process in processes])
+
+    def write_cgroups(self, time: int, cgroups: list[tuple]):
+        self.writer.put([(_CGROUPS, (time, *cgroup)) for cgroup in cgroups])
+
+    def write_cgroups_rollup(self, every: str, time: int, cgroups: list[tuple]):
+        self.writer.put([(f'{_CGROUPS_ROLLUP}_{every}', (time, *cgroup)) for cgroup in cgroups])
+
+    def write_host_stats(self, host: str, rows: list[tuple]):
+        self.writer.put([(_HOST_STATS, (row[0], host, *row[1:])) for row in rows])
+
+    def write_host_stats_rollup(self, host: str, every: str, time: int, fields: dict[str, float]):
+        row = [time, host]
+        for field in recent.FIELDS:
+            row += [fields[f'{field}_max'], fields[f'{field}_sum'], fields[f'{field}_count']]
+        self.writer.put([(f'{_HOST_STATS_ROLLUP}_{every}', tuple(row))])
+
+    def write_stats(self) -> WriteStats|None:
+        return self.writer.stats() if self.writer else None
+
+    def _write_rows(self, items: list[tuple[str, tuple]]):
+        groups: dict[str, tuple[str, list[tuple]]] = {}
+        for prefix, row in items:
+            table = f'{prefix}_{row[0] // self.partition}'
+            group = groups.get(table)
+            if group is None:
+                group = groups[table] = (prefix, [])
+            group[1].append(row)
+        created = []
+        with self._conn:
+            for table, (prefix, rows) in groups.items():
+                if table not in self._tables:
+                    self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" {_schema(prefix)}')
+                    created.append(table)
+                placeholders = ', '.join('?' * len(rows[0]))
+                self._conn.executemany(f'INSERT OR REPLACE INTO "{table}" VALUES ({placeholders})', rows)
+        if created:
+            # NOTE: コミット後に登録し、問い合わせ側からテーブルが見えるようにする
+            with self._lock:
+                self._tables.update(created)
+        if created or self._expire_requested:
+            self._expire_requested = False
+            self._expire(_time.time_ns())
+
+    def _expire(self, now: int):
+        '''保持期間を過ぎたパーティションのテーブルを削除する。'''
+        expired = []
+        with self._lock:
+            for table in list(self._tables):
+                prefix, _, index = table.rpartition('_')
+                if not index.isdigit():
+                    continue
+                retention = settings.SQLITE_RAW_RETENTION if prefix in (_SYS_STATS, _PROCESSES, _PROCESS_NAMES, _CGROUPS, _HOST_STATS) else settings.SQLITE_ROLLUP_RETENTION
+                if (int(index) + 1) * self.partition <= now - retention * _NS:
+                    self._tables.discard(table)
+                    expired.append(table)
+        for table in expired:
+            self._conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        if expired:
+            self._conn.commit()
+            logger.info(f'dropped expired partitions: {", ".join(expired)}')
+
+    # MARK: query
+    async def query_system_stats(self, duration: settings.Duration, start: int, now: int, start_time: datetime|None) -> dict[str, list]:
+        with _query_seconds.time('system_stats'):
+            return await asyncio.to_thread(self._query_system_stats, duration, start, now, start_time)
+
+    async def query_system_stats_range(self, every_seconds: int, start: int, end: int, now: int) -> dict[str, list]:
+        with _query_seconds.time('system_stats_range'):
+            return await asyncio.to_thread(self._query_windows, every_seconds, start, start, end, now)
+
+    async def query_processes(self, metric: str, time: int, every_seconds: int, now: int) -> list[dict]:
+        with _query_seconds.time('processes'):
+            return await asyncio.to_thread(self._query_processes, metric, time, every_seconds, now)
+
+    async def query_process_timeline(self, metric: str, every_seconds: int, start: int, end: int, now: int) -> list[dict]:
+        with _query_seconds.time('process_timeline'):
+            return await asyncio.to_thread(self._query_process_timeline, metric, every_seconds, start, end, now)
+
+    async def query_cgroups(self, time: int, every_seconds: int, now: int) -> list[dict]:
+        with _query_seconds.time('cgroups'):
+            return await asyncio.to_thread(self._query_cgroups, time, every_seconds, now)
+
+    async def query_host_stats(self, every_seconds: int, start: int, end: int, now: int, host: str|None) -> dict[str, list]:
+        with _query_seconds.time('host_stats' if host else 'fleet_stats'):
+            return await asyncio.to_thread(self._query_host_stats, every_seconds, start, end, now, host)
+
+    async def query_hosts(self, start: int) -> list[dict]:
+        with _query_seconds.time('hosts'):
+            return await asyncio.to_thread(self._query_hosts, start)
+
+    def load_recent(self, now: int) -> tuple[list[tuple[int, tuple[float, ...]]], dict[int, list[dict]]]:
+        aggregated = {}
+        for duration in settings.DURATIONS:
+            if duration.every_seconds in aggregated:
+                continue
+            columns = self._query_system_stats(duration, now - duration.period_seconds * _NS, now, None)
+            aggregated[duration.every_seconds] = columns_to_records(columns)
+
+        conn = self._reader()
+        fields = ', '.join(recent.FIELDS)
+        start = recent.raw_warm_start(now)
+        raw = []
+        for table in self._partitions(_SYS_STATS, start, now + 1):
+            for row in conn.execute(f'SELECT time, {fields} FROM "{table}" WHERE time >= ? ORDER BY time', (start,)):
+                raw.append((row[0], tuple(float(x or 0.0) for x in row[1:])))
+        return raw, aggregated
+
+    def load_processes_rollup(self, every: str, time: int) -> list[tuple]:
+        return self._load_rollup(f'{_process_prefixes()[1]}_{every}', time)
+
+    def load_cgroups_rollup(self, every: str, time: int) -> list[tuple]:
+        return self._load_rollup(f'{_CGROUPS_ROLLUP}_{every}', time)
+
+    def _load_rollup(self, prefix: str, time: int) -> list[tuple]:
+        '''ロールアップのテーブルの開始時刻timeの行を、time以外の列で返す。'''
+        conn = self._reader()
+        return [
+            row[1:]
+            for table in self._partitions(prefix, time, time + 1)
+            for row in conn.execute(f'SELECT * FROM "{table}" WHERE time = ?', (time,))
+        ]
+
+    def _query_system_stats(self, duration: settings.Duration, start: int, now: int, start_time: datetime|None) -> dict[str, list]:
+        every = duration.every_seconds * _NS
+        # NOTE: ロールアップのタイムスタンプはバケットの開始時刻なので、start_timeちょうどから含める
+        rollup_start = to_ns(start_time) if start_time else start
+        return self._query_windows(duration.every_seconds, start, rollup_start, now // every * every, now)
+
+    def _query_windows(self, every_seconds: int, start: int, rollup_start: int, end: int, now: int) -> dict[str, list]:
+        '''[start, end)をevery_secondsの窓ごとに集計する。ロールアップはrollup_startから読む。'''
+        every = every_seconds * _NS
+        windows: dict[int, list[float]] = {}    # 窓の番号 -> [各fieldのmax..., sum..., count...]
+        rollup = select_rollup(every_seconds)
+        if rollup is None:
+            self._aggregate(windows, _SYS_STATS, _RAW_STATS_SQL, every, start, end)
+        else:
+            # 最後のバケットはロールアップの書き込みが間に合っていない可能性があるため生データから集計する
+            cutoff = now // every * every - every
+            if start < cutoff:
+                self._aggregate(windows, f'{_SYS_STATS_ROLLUP}_{rollup.every}', _ROLLUP_STATS_SQL, every, rollup_start, min(cutoff, end))
+            self._aggregate(windows, _SYS_STATS, _RAW_STATS_SQL, every, max(start, cutoff), end)
+
+        n = len(recent.FIELDS)
+        columns = {name: [] for name in recent.COLUMNS}
+        times = columns['time']
+        outputs = [(columns[f'{field}_max'], columns[f'{field}_mean']) for field in recent.FIELDS]
+        for window in sorted(windows):
+            values = windows[window]
+            # aggregateWindowと同じく、窓の終了時刻をタイムスタンプにする
+            times.append((window + 1) * every // 1_000_000)
+            for k, (maxes, means) in enumerate(outputs):
+                count = values[2 * n + k]
+                maxes.append(values[k])
+                means.append(values[n + k] / count if count else None)
+        return columns
+
+    def _aggregate(self, windows: dict, prefix: str, sql: str, every: int, start: int, end: int, params: tuple = (), keys: int = 1):
+        '''行の先頭のkeys列(窓の番号、ホストごとの場合は窓の番号とホスト)ごとに、各fieldのmax・sum・countを合成する。'''
+        if start >= end:
+            return
+        n = len(recent.FIELDS)
+        conn = self._reader()
+        for table in self._partitions(prefix, start, end):
+            # NOTE: パーティションの境界が窓の途中にある場合も、max/sum/countなので窓ごとに合成できる
+            for row in conn.execute(sql.format(table=table), (every, start, end, *params)):
+                key = row[0] if keys == 1 else row[:keys]
+                values = windows.get(key)
+                if values is None:
+                    windows[key] = list(row[keys:])
+                    continue
+                for k in range(n):
+                    if row[keys + k] is not None and (values[k] is None or row[keys + k] > values[k]):
+                        values[k] = row[keys + k]
+                for k in range(n, 3 * n):
+                    values[k] = (values[k] or 0.0) + (row[keys + k] or 0.0)
+
+    def _query_host_stats(self, every_seconds: int, start: int, end: int, now: int, host: str|None) -> dict[str, list]:
+        every = every_seconds * _NS
+        hosts: dict[tuple[int, str], list[float]] = {}     # (窓の番号, ホスト) -> [各fieldのmax..., sum..., count...]
+        params, condition = ((host,), ' AND host = ?') if host else ((), '')
+        # NOTE: ロールアップはエージェントが計算して送ってくるため、書き込まれるまでの時間を見込んで1つ前のバケットまで使う
+        rollup = select_rollup(every_seconds)
+        cutoff = now // every * every - every
+        if rollup is not None and start < cutoff:
+            sql = _ROLLUP_HOST_SQL.format(table='{table}', condition=condition)
+            self._aggregate(hosts, f'{_HOST_STATS_ROLLUP}_{rollup.every}', sql, every, start, min(cutoff, end), params, keys=2)
+            start = cutoff
+        sql = _RAW_HOST_SQL.format(table='{table}', condition=condition)
+        self._aggregate(hosts, _HOST_STATS, sql, every, start, end, params, keys=2)
+
+        return combine_hosts(hosts, every)
+
+    def _query_hosts(self, start: int) -> list[dict]:
+        conn = self._reader()
+        hosts: dict[str, dict] = {}
+        for table in self._partitions(_HOST_STATS, start, _time.time_ns() + self.partition):
+            # NOTE: SQLiteでは、MAX()と一緒に選んだ列は最大の行の値になる
+            for host, last_seen, mem_total, disk_total in conn.execute(
+                f'SELECT host, MAX(time), mem_total, disk_total FROM "{table}" WHERE time >= ? GROUP BY host', (start,),
+            ):
+                hosts[host] = dict(host=host, last_seen=last_seen, mem_total=mem_total, disk_total=disk_total)
+        return [hosts[host] for host in sorted(hosts)]
+
+    def _query_processes(self, metric: str, time: int, every_seconds: int, now: int) -> list[dict]:
+        every = every_seconds * _NS
+        raw_prefix, rollup_prefix = _process_prefixes()
+        by_name = settings.PROCESS_SCHEMA == 'name'
+        rollup = select_rollup(every_seconds)
+        if rollup is not None and time <= now // every * every - every:
+            # 書き込み済みのロールアップで窓を埋められる場合は生データを読まない
+            prefix, sql = f'{rollup_prefix}_{rollup.every}', _ROLLUP_PROCESS_SQL
+        else:
+            prefix, sql = raw_prefix, _RAW_PROCESS_SQL
+        sql = sql.format(table='{table}', window='', metric=metric, pid=_pid_column(sql, metric, by_name), group='name' if by_name else 'pid, name')
+        conn = self._reader()
+        processes: dict[tuple[int, str]|str, list] = {}
+        for table in self._partitions(prefix, time - every, time):
+            for row in conn.execute(sql.format(table=table), (time - every, time)):
+                _merge_process(processes, row[1] if by_name else row[:2], row)
+        top = sorted(processes.values(), key=lambda x: x[4] / x[5], reverse=True)[:settings.TOP_PROCESS_COUNT]
+        return [
+            dict(pid=data[0], name=data[1], max=data[2], min=data[3], sum=data[4], count=data[5])
+            for data in top
+        ]
+
+    def _query_process_timeline(self, metric: str, every_seconds: int, start: int, end: int, now: int) -> list[dict]:
+        every = every_seconds * _NS
+        raw_prefix, rollup_prefix = _process_prefixes()
+        by_name = settings.PROCESS_SCHEMA == 'name'
+        # 書き込み済みのロールアップで埋められる窓はロールアップから、残りの窓は生データから集計する
+        ranges = []
+        rollup = select_rollup(every_seconds)
+        cutoff = now // every * every - every
+        if rollup is not None and start < cutoff:
+            ranges.append((f'{rollup_prefix}_{rollup.every}', _ROLLUP_PROCESS_SQL, start, min(cutoff, end)))
+            start = cutoff
+        if start < end:
+            ranges.append((raw_prefix, _RAW_PROCESS_SQL, start, end))
+
+        conn = self._reader()
+        windows: dict[int, dict[tuple[int, str]|str, list]] = {}  # 窓の番号 -> プロセス -> [pid, name, max, min, sum, count]
+        for prefix, sql, range_start, range_end in ranges:
+            sql = sql.format(
+                table='{table}', window='time / ? AS window, ', metric=metric, 
+                pid=_pid_column(sql, metric, by_name), group='window, name' if by_name else 'window, pid, name',
+            )
+            for table in self._partitions(prefix, range_start, range_end):
+                for row in conn.execute(sql.format(table=table), (every, range_start, range_end)):
+                    processes = windows.get(row[0])
+                    if processes is None:
+                        processes = windows[row[0]] = {}
+                    _merge_process(processes, row[2] if by_name else row[1:3], row[1:])
+        output = []
+        for window in sorted(windows):
+            top = sorted(windows[window].values(), key=lambda x: x[4] / x[5], reverse=True)[:settings.TOP_PROCESS_COUNT]
+            output.extend(
+                dict(window=window * every, pid=data[0], name=data[1], max=data[2], min=data[3], sum=data[4], count=data[5])
+                for data in top
+            )
+        return output
+
+    def _query_cgroups(self, time: int, every_seconds: int, now: int) -> list[dict]:
+        every = every_seconds * _NS
+        rollup = select_rollup(every_seconds)
+        if rollup is not None and time <= now // every * every - every:
+            # 書き込み済みのロールアップで窓を埋められる場合は生データを読まない
+            prefix, sql = f'{_CGROUPS_ROLLUP}_{rollup.every}', _ROLLUP_CGROUP_SQL
+        else:
+            prefix, sql = _CGROUPS, _RAW_CGROUP_SQL
+        n = len(CGROUP_METRICS)
+        conn = self._reader()
+        cgroups: dict[str, list] = {}     # 名前 -> [各metricのmax..., sum..., count]
+        for table in self._partitions(prefix, time - every, time):
+            for name, *values in conn.execute(sql.format(table=table), (time - every, time)):
+                data = cgroups.get(name)
+                if data is None:
+                    cgroups[name] = values
+                    continue
+                for k in range(n):
+                    data[k] = max(data[k], values[k])
+                for k in range(n, 2 * n + 1):
+                    data[k] += values[k]
+        return [
+            dict(
+                name=name,
+                **{f'{metric}_max': data[k] for k, metric in enumerate(CGROUP_METRICS)},
+                **{f'{metric}_sum': data[n + k] for k, metric in enumerate(CGROUP_METRICS)},
+                count=data[2 * n],
+            )
+            for name, data in cgroups.items()
+        ]
+
+    def _partitions(self, prefix: str, start: int, end: int) -> list[str]:
+        '''[start, end)に重なるパーティションのテーブル名を時刻順に返す。'''
+        names = [f'{prefix}_{index}' for index in range(start // self.partition, (end - 1) // self.partition + 1)]
+        with self._lock:
+            missing = any(name not in self._tables for name in names)
+        if missing:
+            # NOTE: リーダー(他のワーカー)が後から作ったテーブルはself._tablesに無いので、sqlite_masterを読み直す
+            tables = {row[0] for row in self._reader().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            with self._lock:
+                self._tables = tables
+        with self._lock:
+            tables = self._tables
+            return [name for name in names if name in tables]
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA query_only=1')
+            conn.create_aggregate('ARGMAX', 2, _ArgMax)
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+# MARK: subroutines
+
+def _process_prefixes() -> tuple[str, str]:
+    '''プロセスの(生データ, ロールアップ)のテーブル名の接頭辞'''
+    if settings.PROCESS_SCHEMA == 'name':
+        return _PROCESS_NAMES, _PROCESS_NAMES_ROLLUP
+    return _PROCESSES, _PROCESSES_ROLLUP
+
+def _pid_column(sql: str, metric: str, by_name: bool) -> str:
+    '''プロセスのSQLでpidとして選ぶ式。名前ごとに保存した場合のPIDは名前の代表なので、metricが最大の行のものにする。'''
+    if not by_name:
+        return 'pid'
+    return f'ARGMAX({metric}_max, pid)' if sql is _ROLLUP_PROCESS_SQL else f'ARGMAX({metric}, pid)'
+
+class _ArgMax:
+    '''ARGMAX(value, x): valueが最大の行のx。(MAX()の行の列を選ぶSQLiteの仕組みは、MIN()も使うクエリでは使えない)'''
+    def __init__(self):
+        self.value = None
+        self.x = None
+
+    def step(self, value, x):
+        if value is not None and (self.value is None or value > self.value):
+            self.value, self.x = value, x
+
+    def finalize(self):
+        return self.x
+
+def _merge_process(processes: dict, key, row: tuple):
+    '''(pid, name, max, min, sum, count)の行をkeyごとに合成する。(パーティションの境界をまたぐ窓の分、pidはmaxの行のもの)'''
+    data = processes.get(key)
+    if data is None:
+        processes[key] = list(row)
+        return
+    if row[2] > data[2]:
+        data[0] = row[0]
+        data[2] = row[2]
+    data[3] = min(data[3], row[3])
+    data[4] += row[4]
+    data[5] += row[5]
+
+def _schema(prefix: str) -> str:
+    if prefix == _SYS_STATS:
+        return '(time INTEGER PRIMARY KEY, ' + ', '.join(f'{field} REAL' for field in recent.FIELDS) + ')'
+    if prefix.startswith(_SYS_STATS_ROLLUP):
+        return '(time INTEGER PRIMARY KEY, ' + ', '.join(
+            f'{field}_{stat} REAL' for field in recent.FIELDS for stat in ('max', 'sum', 'count')
+        ) + ')'
+    if prefix.startswith((_PROCESSES, _PROCESS_NAMES)):
+        if prefix in (_PROCESSES, _PROCESS_NAMES):
+            columns = [f'{metric} REAL' for metric in PROCESS_METRICS]
+        else:
+            columns = [f'{metric}_{stat} REAL' for metric in PROCESS_METRICS for stat in ('max', 'min', 'sum')] + ['count REAL']
+        # NOTE: 名前ごとに保存する場合、同じ時刻の同じ名前の行は1つだけ
+        key = 'time, name' if prefix.startswith(_PROCESS_NAMES) else 'time, pid, name'
+        return (
+            '(time INTEGER NOT NULL, pid INTEGER NOT NULL, name TEXT NOT NULL, '
+            + ''.join(f'{column}, ' for column in columns)
+            + f'PRIMARY KEY ({key})) WITHOUT ROWID'
+        )
+    if prefix.startswith(_CGROUPS):
+        if prefix == _CGROUPS:
+            columns = [f'{metric} REAL' for metric in CGROUP_METRICS]
+        else:
+            columns = [f'{metric}_{stat} REAL' for metric in CGROUP_METRICS for stat in ('max', 'sum')] + ['count REAL']
+        return (
+            '(time INTEGER NOT NULL, name TEXT NOT NULL, '
+            + ''.join(f'{column}, ' for column in columns)
+            + 'PRIMARY KEY (time, name)) WITHOUT ROWID'
+        )
+    if prefix == _HOST_STATS:
+        return (
+            '(time INTEGER NOT NULL, host TEXT NOT NULL, '
+            + ''.join(f'{field} REAL, ' for field in (*recent.FIELDS, *_HOST_EXTRA))
+            + 'PRIMARY KEY (time, host)) WITHOUT ROWID'
+        )
+    if prefix.startswith(_HOST_STATS_ROLLUP):
+        return (
+            '(time INTEGER NOT NULL, host TEXT NOT NULL, '
+            + ''.join(f'{field}_{stat} REAL, ' for field in recent.FIELDS for stat in ('max', 'sum', 'count'))
+            + 'PRIMARY KEY (time, host)) WITHOUT ROWID'
+        )
+    raise Exception(f'Unknown table: {prefix}')
+
+# NOTE: 窓の番号(time / every)ごとに、各fieldのmax・sum・countを返す
+_RAW_STATS_SQL = 'SELECT time / ? AS window, {columns} FROM "{{table}}" WHERE time >= ? AND time < ? GROUP BY window'.format(
+    columns=', '.join(
+        [f'MAX({field})' for field in recent.FIELDS] +
+        [f'SUM({field})' for field in recent.FIELDS] +
+        [f'COUNT({field})' for field in recent.FIELDS]
+    ),
+)
+_ROLLUP_STATS_SQL = 'SELECT time / ? AS window, {columns} FROM "{{table}}" WHERE time >= ? AND time < ? GROUP BY window'.format(
+    columns=', '.join(
+        [f'MAX({field}_max)' for field in recent.FIELDS] +
+        [f'SUM({field}_sum)' for field in recent.FIELDS] +
+        [f'SUM({field}_count)' for field in recent.FIELDS]
+    ),
+)
+# NOTE: metricはPROCESS_METRICSのいずれか(database側で検査済み)。pid・groupは保存単位(PROCESS_SCHEMA)で変わる
+# NOTE: windowは窓ごとに集計する場合に'time / ? AS window, 'を入れる
+_RAW_PROCESS_SQL = (
+    'SELECT {window}{pid}, name, MAX({metric}), MIN({metric}), SUM({metric}), COUNT({metric}) FROM "{table}" '
+    'WHERE time >= ? AND time < ? GROUP BY {group}'
+)
+_ROLLUP_PROCESS_SQL = (
+    'SELECT {window}{pid}, name, MAX({metric}_max), MIN({metric}_min), SUM({metric}_sum), SUM(count) FROM "{table}" '
+    'WHERE time >= ? AND time < ? GROUP BY {group}'
+)
+# NOTE: host_statsはホストごと(窓の番号, ホスト)に集計する。conditionはホストを指定した場合に' AND host = ?'を入れる
+_RAW_HOST_SQL = 'SELECT time / ? AS window, host, {columns} FROM "{{table}}" WHERE time >= ? AND time < ?{{condition}} GROUP BY window, host'.format(
+    columns=', '.join(
+        [f'MAX({field})' for field in recent.FIELDS] +
+        [f'SUM({field})' for field in recent.FIELDS] +
+        [f'COUNT({field})' for field in recent.FIELDS]
+    ),
+)
+_ROLLUP_HOST_SQL = 'SELECT time / ? AS window, host, {columns} FROM "{{table}}" WHERE time >= ? AND time < ?{{condition}} GROUP BY window, host'.format(
+    columns=', '.join(
+        [f'MAX({field}_max)' for field in recent.FIELDS] +
+        [f'SUM({field}_sum)' for field in recent.FIELDS] +
+        [f'SUM({field}_count)' for field in recent.FIELDS]
+    ),
+)
+# NOTE: cgroupごとに、各metricのmax...・sum...・countを返す
+_RAW_CGROUP_SQL = 'SELECT name, {columns}, COUNT(*) FROM "{{table}}" WHERE time >= ? AND time < ? GROUP BY name'.format(
+    columns=', '.join([f'MAX({metric})' for metric in CGROUP_METRICS] + [f'SUM({metric})' for metric in CGROUP_METRICS]),
+)
+_ROLLUP_CGROUP_SQL = 'SELECT name, {columns}, SUM(count) FROM "{{table}}" WHERE time >= ? AND time < ? GROUP BY name'.format(
+    columns=', '.join([f'MAX({metric}_max)' for metric in CGROUP_METRICS] + [f'SUM({metric}_sum)' for metric in CGROUP_METRICS]),
+)
@@ -0,0 +1,409 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime
+from dateutil import tz
+from pydantic import BaseModel
+from typing import Any, Callable
+from . import recent
+from .spool import Spool
+import threading
+import time as _time
+from ..common import settings
+from ..common.logger import logger
+from ..common import instrument
+
+'''
+    測定データの保存先(ストレージ)の共通部分。
+
+    ストレージはStorageを継承し、settings.STORAGE_BACKENDで選ばれる。(database.init()を参照)
+    直近データのメモリ(recent)やクエリ結果のキャッシュはdatabase側で扱うため、
+    ストレージは保存と、メモリで返せなかった範囲の集計だけを実装すればよい。
+'''
+
+_NS = 1_000_000_000
+
+# NOTE: プロセスごとに測定する値。1回の/procの走査でまとめて測り、それぞれの上位の和集合を保存する。
+# cpu: CPU使用率(%)、rss: 常駐メモリ(バイト)、read/write: ストレージへの読み書き(バイト/秒)
+PROCESS_METRICS = ('cpu', 'rss', 'read', 'write')
+
+# NOTE: cgroup(コンテナ・サービス)ごとに測定する値。cpu: CPU使用率(%)、memory: メモリ(バイト)、read/write: ストレージへの読み書き(バイト/秒)
+CGROUP_METRICS = ('cpu', 'memory', 'read', 'write')
+
+_flush_seconds = instrument.histogram('psmon_write_flush_seconds', 'Time spent writing one batch to the storage')
+
+# MARK: Storage
+class Storage(ABC):
+    '''ストレージのインターフェース。時刻は全てエポックナノ秒で受け渡す。'''
+
+    raw_retention: int|None = None  # 生データを残す秒数(Noneは制限なし)。これより古い範囲はロールアップから返す
+
+    @abstractmethod
+    def init(self):
+        '''書き込みを始める。(イベントループの外で呼び出す)'''
+        raise NotImplementedError
+
+    async def init_async(self):
+        '''問い合わせの準備をする。(イベントループ上で呼び出す)'''
+
+    async def exit_async(self):
+        pass
+
+    @abstractmethod
+    def exit(self):
+        '''書き込み待ちのデータを保存して終了する。'''
+        raise NotImplementedError
+
+    def expire(self):
+        '''保持期間を過ぎたデータを削除する。(測定するプロセスが起動時に呼び出す。InfluxDBはバケットの保持期間で消える)'''
+
+    @abstractmethod
+    def write_system_stats(self, time: int, fields: dict[str, float]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_processes(self, time: int, processes: list[tuple]):
+        '''processesは(pid, name, PROCESS_METRICSの値...)。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_system_stats_rollup(self, every: str, time: int, fields: dict[str, float]):
+        '''fieldsは{field}_max・{field}_sum・{field}_count。timeはバケットの開始時刻。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_processes_rollup(self, every: str, time: int, processes: list[tuple]):
+        '''processesは(pid, name, PROCESS_METRICSごとのmax・min・sum..., count)。timeはバケットの開始時刻。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_cgroups(self, time: int, cgroups: list[tuple]):
+        '''cgroupsは(名前, CGROUP_METRICSの値...)。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_cgroups_rollup(self, every: str, time: int, cgroups: list[tuple]):
+        '''cgroupsは(名前, CGROUP_METRICSごとのmax・sum..., count)。timeはバケットの開始時刻。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_host_stats(self, host: str, rows: list[tuple]):
+        '''エージェントから受け取ったサンプル。rowsは(time, recent.FIELDSの値..., mem_total, disk_total)。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_host_stats_rollup(self, host: str, every: str, time: int, fields: dict[str, float]):
+        '''エージェントが計算したロールアップ。fieldsはwrite_system_stats_rollupと同じ。'''
+        raise NotImplementedError
+
+    def write_stats(self) -> 'WriteStats|None':
+        return None
+
+    @abstractmethod
+    async def query_system_stats(self, duration: settings.Duration, start: int, now: int, start_time: datetime|None) -> dict[str, list]:
+        '''[start, truncate(now, every))をeveryごとに集計した列(recent.COLUMNS)を返す。
+
+        Args:
+            start (int): 範囲の開始時刻。start_timeが指定された場合はその直後
+            start_time (datetime|None): APIで指定された開始時刻(なければ期間の先頭から)
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_system_stats_range(self, every_seconds: int, start: int, end: int, now: int) -> dict[str, list]:
+        '''[start, end)をevery_secondsごとに集計した列(recent.COLUMNS)を返す。start・endはeveryの境界に揃えてあること。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_processes(self, metric: str, time: int, every_seconds: int, now: int) -> list[dict]:
+        '''[time - every, time)のプロセスごとのmetricの値を、平均の上位だけpid・name・max/min/sum/countの形式で返す。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_process_timeline(self, metric: str, every_seconds: int, start: int, end: int, now: int) -> list[dict]:
+        '''[start, end)のevery_secondsの窓ごとに、metricの平均の上位のプロセスを1回の問い合わせで返す。
+
+        要素はwindow(窓の開始時刻)・pid・name・max/min/sum/count。start・endはeveryの境界に揃えてあること。
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_cgroups(self, time: int, every_seconds: int, now: int) -> list[dict]:
+        '''[time - every, time)のcgroupごとの値を、name・CGROUP_METRICSごとの{metric}_max・{metric}_sum・countの形式で返す。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_host_stats(self, every_seconds: int, start: int, end: int, now: int, host: str|None) -> dict[str, list]:
+        '''エージェントのサンプルの[start, end)をevery_secondsごとに集計した列(recent.COLUMNSとhosts)を返す。
+
+        hostがNoneの場合は全ホストをまとめて、窓ごとに各ホストのmaxの最大とmeanの平均を返す。(hostsは窓にデータがあったホストの数)
+        start・endはeveryの境界に揃えてあること。
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_hosts(self, start: int) -> list[dict]:
+        '''start以降にサンプルを送ってきたホストごとの、最後の時刻(last_seen)・mem_total・disk_totalを返す。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_recent(self, now: int) -> tuple[list[tuple[int, tuple[float, ...]]], dict[int, list[dict]]]:
+        '''直近データのメモリを初期化するための(生サンプル, everyごとの集計済みレコード)を返す。'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_processes_rollup(self, every: str, time: int) -> list[tuple]:
+        '''開始時刻timeのバケットのプロセスのロールアップを、write_processes_rollupと同じ形式で返す。(再起動後に集計を続けるため)'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_cgroups_rollup(self, every: str, time: int) -> list[tuple]:
+        '''開始時刻timeのバケットのcgroupのロールアップを、write_cgroups_rollupと同じ形式で返す。'''
+        raise NotImplementedError
+
+# MARK: write pipeline
+class WriteStats(BaseModel):
+    queue_depth: int
+    last_flush_lines: int
+    last_flush_seconds: float
+    max_flush_seconds: float
+    flushed_lines: int
+    dropped_lines: int
+    flush_errors: int
+    spool_lines: int = 0        # スプールに溜まっていて、まだ再送していない行数
+    spool_bytes: int = 0
+    spooled_lines: int = 0      # 書き込めずにスプールに溜めた行数(累計)
+    replayed_lines: int = 0     # スプールから再送した行数(累計)
+    evicted_lines: int = 0      # スプールの上限を超えて捨てた行数(累計)
+
+class WritePipeline:
+    '''書き込むデータを溜め込み、バックグラウンドでまとめてwrite_batchに渡す。
+
+    件数が`settings.WRITE_BATCH_SIZE`に達するか、最古のデータが`settings.WRITE_FLUSH_INTERVAL`秒を
+    超えたらフラッシュする。呼び出し側(collect_metrics)はキューに積むだけなので、
+    ストレージが遅くても測定間隔は伸びない。
+
+    spoolを渡した場合は、書き込めなかったバッチをメモリに戻す代わりにスプール(ディスク)に溜め、
+    書き込めるようになったら`settings.SPOOL_REPLAY_BATCH`行ずつ、`settings.SPOOL_REPLAY_RATE`行/秒以下で再送する。
+    再送は測定したデータのフラッシュの合間に行うため、測定したデータの書き込みは待たされない。
+    '''
+    def __init__(self, write_batch: Callable[[list[Any]], None], spool: Spool|None = None):
+        self._write_batch = write_batch
+        self._spool = spool
+        self._spool_wanted = False  # putされたら(書き込むプロセスになったら)スプールを開く
+        self._spool_busy = False    # スプールを他のプロセスが使っている
+        self._replay_at = 0.0       # 次に再送してよい時刻(monotonic)
+        self._spooled_lines = 0
+        self._replayed_lines = 0
+        self._lock = threading.Lock()
+        self._queue: deque[Any] = deque()
+        self._oldest: float|None = None     # キュー中の最古のデータを積んだ時刻(monotonic)
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='psmon-writer', daemon=True)
+        self._last_flush_lines = 0
+        self._last_flush_seconds = 0.0
+        self._max_flush_seconds = 0.0
+        self._flushed_lines = 0
+        self._dropped_lines = 0
+        self._flush_errors = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        '''残っているデータをフラッシュしてからスレッドを止める。'''
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def put(self, lines: list[Any]):
+        if self._spool is not None and not self._spool_wanted:
+            # 前回溜めた行があればすぐに再送を始められるよう、書き込みスレッドにスプールを開かせる
+            self._spool_wanted = True
+            self._wakeup.set()
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = _time.monotonic()
+            self._queue.extend(lines)
+            self._drop_overflow()
+            if len(self._queue) >= settings.WRITE_BATCH_SIZE:
+                self._wakeup.set()
+
+    def stats(self) -> WriteStats:
+        spool = self._spool
+        with self._lock:
+            return WriteStats(
+                spool_lines=spool.lines if spool else 0,
+                spool_bytes=spool.bytes if spool else 0,
+                spooled_lines=self._spooled_lines,
+                replayed_lines=self._replayed_lines,
+                evicted_lines=spool.evicted_lines if spool else 0,
+                queue_depth=len(self._queue),
+                last_flush_lines=self._last_flush_lines,
+                last_flush_seconds=self._last_flush_seconds,
+                max_flush_seconds=self._max_flush_seconds,
+                flushed_lines=self._flushed_lines,
+                dropped_lines=self._dropped_lines,
+                flush_errors=self._flush_errors,
+            )
+
+    def _drop_overflow(self):
+        overflow = len(self._queue) - settings.WRITE_QUEUE_MAX
+        if overflow > 0:
+            for _ in range(overflow):
+                self._queue.popleft()
+            self._dropped_lines += overflow
+            logger.warning(f'write queue overflow: dropped {overflow} lines')
+
+    def _run(self):
+        while not self._stopping:
+            with self._lock:
+                if self._oldest is None:
+                    timeout = settings.WRITE_FLUSH_INTERVAL
+                else:
+                    timeout = self._oldest + settings.WRITE_FLUSH_INTERVAL - _time.monotonic()
+            if self._spool is not None and self._spool.is_open and self._spool.lines:
+                timeout = min(timeout, self._replay_at - _time.monotonic())
+            if timeout > 0:
+                self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            self._flush()
+            self._replay()
+        self._flush()   # 停止時に残りを書き込む(書き込めなければスプールに溜める)
+        if self._spool is not None:
+            self._spool.close()
+
+    def _flush(self):
+        with self._lock:
+            if not self._queue:
+                self._oldest = None
+                return
+            batch = list(self._queue)
+            self._queue.clear()
+            self._oldest = None
+        t0 = _time.perf_counter()
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            logger.error(f'failed to write {len(batch)} lines: {e}')
+            spooled = self._append_spool(batch)
+            with self._lock:
+                if not spooled:
+                    # 書き込めなかったデータはキューの先頭に戻し、次回まとめて再送する
+                    self._queue.extendleft(reversed(batch))
+                    self._oldest = _time.monotonic()
+                    self._drop_overflow()
+                self._flush_errors += 1
+                self._last_flush_lines = 0
+            # 次のフラッシュで書き込めることを確かめるまで再送しない
+            self._replay_at = _time.monotonic() + settings.WRITE_FLUSH_INTERVAL
+            return
+        elapsed = _time.perf_counter() - t0
+        _flush_seconds.observe(elapsed)
+        with self._lock:
+            self._last_flush_lines = len(batch)
+            self._last_flush_seconds = elapsed
+            self._max_flush_seconds = max(self._max_flush_seconds, elapsed)
+            self._flushed_lines += len(batch)
+        logger.debug(f'flushed {len(batch)} lines in {elapsed:.3f}s')
+
+    # MARK: spool
+    def _open_spool(self) -> bool:
+        if self._spool is None or not self._spool_wanted:
+            return False
+        if self._spool.is_open:
+            return True
+        try:
+            opened = self._spool.open()
+        except Exception as e:
+            logger.error(f'failed to open the spool: {e}')
+            return False
+        if not opened and not self._spool_busy:
+            logger.warning(f'spool {self._spool.path} is used by another process')
+        self._spool_busy = not opened
+        return opened
+
+    def _append_spool(self, batch: list[Any]) -> bool:
+        if not self._open_spool():
+            return False
+        try:
+            self._spool.append(batch)
+        except Exception as e:
+            logger.error(f'failed to spool {len(batch)} lines: {e}')
+            return False
+        with self._lock:
+            self._spooled_lines += len(batch)
+        return True
+
+    def _replay(self):
+        '''スプールに溜めた行を1回分だけ再送する。'''
+        if not self._open_spool() or not self._spool.lines or _time.monotonic() < self._replay_at:
+            return
+        with self._lock:
+            if len(self._queue) >= settings.WRITE_BATCH_SIZE:
+                return  # 測定したデータを先に書き込む
+        lines, position = self._spool.read(settings.SPOOL_REPLAY_BATCH)
+        try:
+            self._write_batch(lines)
+        except Exception as e:
+            logger.warning(f'failed to replay {len(lines)} spooled lines: {e}')
+            with self._lock:
+                self._flush_errors += 1
+            self._replay_at = _time.monotonic() + settings.WRITE_FLUSH_INTERVAL
+            return
+        self._spool.commit(position)
+        with self._lock:
+            self._replayed_lines += len(lines)
+        # 再送する速さを抑え、ストレージと測定したデータの書き込みに余裕を残す
+        self._replay_at = _time.monotonic() + len(lines) / settings.SPOOL_REPLAY_RATE
+        logger.info(f'replayed {len(lines)} spooled lines ({self._spool.lines} left)')
+
+# MARK: subroutines
+def select_rollup(every_seconds: int) -> settings.Rollup|None:
+    '''every_secondsを割り切れる最も粗いロールアップを選ぶ。'''
+    candidates = [rollup for rollup in settings.ROLLUPS if every_seconds % rollup.every_seconds == 0]
+    return max(candidates, key=lambda x: x.every_seconds, default=None)
+
+def to_ns(t: datetime) -> int:
+    return int(t.timestamp()) * _NS + t.microsecond * 1000
+
+def combine_hosts(hosts: dict[tuple[int, str], list], every: int) -> dict[str, list]:
+    '''(窓の番号, ホスト)ごとの各fieldのmax..., sum..., count...を、窓ごとの列(recent.COLUMNSとhosts)にする。
+
+    maxは各ホストのmaxの最大、meanは各ホストの平均の平均。(サンプル数の多いホストに偏らない)
+    '''
+    n = len(recent.FIELDS)
+    windows: dict[int, list] = {}   # 窓の番号 -> [各fieldのmax..., meanの和..., meanの数..., ホスト数]
+    for (window, _), values in hosts.items():
+        data = windows.get(window)
+        if data is None:
+            data = windows[window] = [None] * n + [0.0] * n + [0] * n + [0]
+        for k in range(n):
+            if values[k] is not None and (data[k] is None or values[k] > data[k]):
+                data[k] = values[k]
+            if values[2 * n + k]:
+                data[n + k] += values[n + k] / values[2 * n + k]
+                data[2 * n + k] += 1
+        data[3 * n] += 1
+    columns = {name: [] for name in (*recent.COLUMNS, 'hosts')}
+    outputs = [(columns[f'{field}_max'], columns[f'{field}_mean']) for field in recent.FIELDS]
+    for window in sorted(windows):
+        data = windows[window]
+        # 窓の終了時刻をタイムスタンプにする
+        columns['time'].append((window + 1) * every // 1_000_000)
+        columns['hosts'].append(data[3 * n])
+        for k, (maxes, means) in enumerate(outputs):
+            maxes.append(data[k])
+            means.append(data[n + k] / data[2 * n + k] if data[2 * n + k] else None)
+    return columns
+
+def columns_to_records(columns: dict[str, list]) -> list[dict]:
+    '''列ごとのデータ(timeはエポックミリ秒)をFluxのクエリ結果と同じ形式(_timeはdatetime)のレコードにする。'''
+    output = []
+    names = [name for name in columns if name != 'time']
+    for k, t in enumerate(columns['time']):
+        record = {'_time': datetime.fromtimestamp(t / 1000, tz=tz.UTC)}
+        for name in names:
+            record[name] = columns[name][k]
+        output.append(record)
+    return output
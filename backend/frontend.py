@@ -1,35 +1,93 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
-from pathlib import Path, PurePosixPath
+from fastapi import APIRouter, HTTPException, Request, Response
+from pathlib import Path
+import hashlib
+import mimetypes
 from .common.logger import logger
+from .common import encoding as _encoding
 
 '''
     # StaticFilesを使ってローカルファイルを公開できるが、
     # アセット以外のURLパスはVue routerを実装したindex.htmlを返す必要がある。
     public_path = base_path / 'public'
     app.mount(
-        path='/', 
-        app=StaticFiles(directory=str(public_path), html=True), 
+        path='/',
+        app=StaticFiles(directory=str(public_path), html=True),
         name='public',
     )
+
+    public/はビルド後に変わらないため、起動時に全ファイルをメモリに読み込み、
+    圧縮した版(gzip, brotli)とETagも作っておく。リクエストの処理ではファイルシステムに触れない。
+    (public/を作り直した場合はアプリを再起動すること)
 '''
 
-public_path: Path|None = None
-index_path: Path|None = None
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+_IMMUTABLE_PREFIX = 'assets/'   # Viteがファイル名にハッシュを付けて出力するディレクトリ
+_CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+_CACHE_REVALIDATE = 'no-cache'  # キャッシュしてよいが、使う前にETagで確認する
+
+# MARK: StaticAsset
+class StaticAsset:
+    '''public/の1ファイル。content-encodingごとの本体とETagを持つ。'''
+    __slots__ = ('media_type', 'cache_control', 'bodies', 'etags')
+
+    def __init__(self, path: str, body: bytes):
+        self.media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.cache_control = _CACHE_IMMUTABLE if path.startswith(_IMMUTABLE_PREFIX) else _CACHE_REVALIDATE
+        self.bodies: dict[str, bytes] = {'identity': body}
+        if len(body) >= _encoding.MIN_COMPRESS_SIZE and self.media_type.startswith(_COMPRESSIBLE_TYPES):
+            for encoding in _encoding.ENCODINGS:
+                compressed = _encoding.compress(body, encoding, best=True)
+                if len(compressed) < len(body):
+                    self.bodies[encoding] = compressed
+        # NOTE: 強いETagは表現(content-encoding)ごとに変える
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+            for encoding in self.bodies
+        }
+
+    def response(self, request: Request) -> Response:
+        '''Accept-Encodingで選んだ版を返す。If-None-Matchが一致すれば304を返す。'''
+        encoding = _encoding.negotiate(request.headers.get('accept-encoding', ''), self.bodies)
+        headers = {'ETag': self.etags[encoding], 'Cache-Control': self.cache_control}
+        if len(self.bodies) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if _encoding.not_modified(request.headers.get('if-none-match'), self.etags.values()):
+            return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=self.bodies[encoding], media_type=self.media_type, headers=headers)
+
+# MARK: load assets
+assets: dict[str, StaticAsset] = {}     # URLパス(先頭の'/'なし) -> ファイル
+index_asset: StaticAsset|None = None
+
+def load_assets(public_path: Path):
+    '''public/配下の全ファイルを読み込む。'''
+    global index_asset
+    assets.clear()
+    index_asset = None
+    if not public_path.is_dir():
+        logger.error(f'public/ does NOT exist.')
+        return
+    total = 0
+    for path in sorted(public_path.rglob('*')):
+        if not path.is_file():
+            continue
+        key = path.relative_to(public_path).as_posix()
+        body = path.read_bytes()
+        assets[key] = StaticAsset(key, body)
+        total += len(body)
+    index_asset = assets.get('index.html')
+    if index_asset is None:
+        logger.error(f'public/index.html does NOT exist.')
+    logger.info(f'loaded {len(assets)} static assets ({total} bytes, encodings={",".join(_encoding.ENCODINGS)})')
 
 def create_router(base_path: Path) -> APIRouter:
     # MARK: /
     router = APIRouter(prefix='', tags=['frontend'])  # prefixは'/'で終わってはいけない
 
-    global public_path, index_path
-    if not public_path:
-        public_path = (base_path / 'public').resolve()
-        if not public_path.is_dir():
-            logger.error(f'public/ does NOT exist.')
-    if not index_path:
-        index_path = (public_path / 'index.html').resolve()
-        if not index_path.is_file():
-            logger.error(f'public/index.html does NOT exist.')
+    load_assets((base_path / 'public').resolve())
 
     # MARK: /.well-known/*
     @router.get('/.well-known/{path:path}')
@@ -38,20 +96,15 @@ def create_router(base_path: Path) -> APIRouter:
 
     # MARK: /*
     @router.get('/{path:path}')
-    def get_frontend(path: str):
-        logger.debug(f'get_frontend {path=}')
-
-        # ローカルファイルの取得
-        local_path = (public_path / Path(PurePosixPath(path))).resolve()
-        if not local_path.is_relative_to(base_path):
-            raise HTTPException(status_code=403, detail="Access denied")
-        logger.debug(f'get_frontend {local_path=}')
-        if local_path.is_file():
-            return FileResponse(local_path)
+    def get_frontend(path: str, request: Request):
+        # NOTE: 辞書を引くだけなので、public/の外のファイルを返すことはない
+        asset = assets.get(path)
+        if asset is not None:
+            return asset.response(request)
 
         # index.htmlの取得
-        if not index_path.is_file():
+        if index_asset is None:
             raise HTTPException(status_code=404, detail="index.html not found")
-        return FileResponse(index_path)
+        return index_asset.response(request)
 
     return router
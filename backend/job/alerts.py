@@ -0,0 +1,254 @@
+from collections import deque
+from pathlib import Path
+from pydantic import BaseModel, TypeAdapter, field_validator, model_validator
+from typing import Literal
+import math
+import operator
+import threading
+from ..db import recent
+from ..common import settings, instrument
+from ..common.logger import logger
+from .broadcast import broadcaster
+
+'''
+    サンプルごとに直近の窓の統計量(max・min・平均・EWMA)を逐次更新し、閾値のルールを評価する。
+
+    「CPU使用率が5分間90%を超えている」のような判定のたびにストレージへ問い合わせずに済むよう、
+    apply_sample(リーダーの測定・フォロワーの共有サンプルのどちらも)から呼ばれて、その場で評価する。
+
+    - RollingWindow: 単調なdequeで窓のmax・minを、累積和で平均を、1サンプルあたり償却O(1)で更新する
+    - Ewma: サンプルの間隔に応じた重みの指数移動平均
+    - AlertEngine: (metric, 窓)ごとの統計量を全ルールで共有し、ルールごとには比較と状態の更新だけを行う
+
+    ルールはALERT_RULES_PATHのJSONファイル(AlertRuleのリスト)で設定する。例:
+        [{"name": "cpu-high", "metric": "cpu_percent", "stat": "min", "window_seconds": 300, "op": ">", "threshold": 90}]
+'''
+
+_NS = 1_000_000_000
+
+STATE_INACTIVE, STATE_PENDING, STATE_FIRING = 'inactive', 'pending', 'firing'
+DEFAULT_WINDOWS = (60, 300)     # ルールが無くても統計量を出す窓(秒)
+
+_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+_eval_seconds = instrument.histogram(
+    'psmon_alert_eval_seconds', 'Time spent updating rolling stats and evaluating alert rules per sample',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+_transitions = instrument.counter('psmon_alert_transitions_total', 'Alert rules that changed state', ('rule', 'state'))
+
+# MARK: AlertRule
+class AlertRule(BaseModel):
+    name: str
+    metric: str                                 # recent.FIELDSのいずれか
+    stat: Literal['value', 'max', 'min', 'mean', 'ewma'] = 'value'
+    window_seconds: float = 0                   # max・min・meanの窓、ewmaの時定数(秒)
+    op: Literal['>', '>=', '<', '<='] = '>'
+    threshold: float
+    for_seconds: float = 0                      # 条件がこの秒数続いたら発報する
+
+    @field_validator('metric')
+    @classmethod
+    def _check_metric(cls, value: str) -> str:
+        if value not in recent.FIELDS:
+            raise ValueError(f'metric must be one of {", ".join(recent.FIELDS)}')
+        return value
+
+    @model_validator(mode='after')
+    def _check_window(self):
+        if self.stat != 'value' and self.window_seconds <= 0:
+            raise ValueError(f'window_seconds is required for stat={self.stat}')
+        return self
+
+# MARK: RollingWindow
+class RollingWindow:
+    '''直近window(ns)のサンプルのmax・min・平均を保持する。(時刻順に追加すること)'''
+    def __init__(self, window: int):
+        self.window = window
+        self.first: int|None = None     # 最初のサンプルの時刻(窓が埋まったかの判定用)
+        self._samples: deque[tuple[int, float]] = deque()
+        self._maxes: deque[tuple[int, float]] = deque()     # 値が単調減少
+        self._mins: deque[tuple[int, float]] = deque()      # 値が単調増加
+        self._sum = 0.0
+        self._removed = 0
+
+    def add(self, t: int, value: float):
+        if self.first is None:
+            self.first = t
+        self._samples.append((t, value))
+        self._sum += value
+        maxes, mins = self._maxes, self._mins
+        while maxes and maxes[-1][1] <= value:
+            maxes.pop()
+        maxes.append((t, value))
+        while mins and mins[-1][1] >= value:
+            mins.pop()
+        mins.append((t, value))
+
+        cutoff = t - self.window
+        samples = self._samples
+        while samples[0][0] <= cutoff:
+            self._sum -= samples.popleft()[1]
+            self._removed += 1
+        while maxes[0][0] <= cutoff:
+            maxes.popleft()
+        while mins[0][0] <= cutoff:
+            mins.popleft()
+        # NOTE: 足し引きの丸め誤差が溜まらないよう、窓の長さ分を取り除くごとに合計を計算し直す(償却O(1))
+        if self._removed >= len(samples):
+            self._sum = math.fsum(v for _, v in samples)
+            self._removed = 0
+
+    def full(self, t: int) -> bool:
+        '''窓の全体にわたってサンプルがあるか(起動直後の短い窓では判定しない)'''
+        return self.first is not None and t - self.first >= self.window
+
+    @property
+    def max(self) -> float:
+        return self._maxes[0][1]
+
+    @property
+    def min(self) -> float:
+        return self._mins[0][1]
+
+    @property
+    def mean(self) -> float:
+        return self._sum / len(self._samples)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+# MARK: Ewma
+class Ewma:
+    '''時定数tau(ns)の指数移動平均。サンプルの間隔がばらついても同じ時定数になるよう、重みを間隔から決める。'''
+    def __init__(self, tau: int):
+        self.tau = tau
+        self.value: float|None = None
+        self._last: int|None = None
+
+    def add(self, t: int, value: float):
+        if self.value is None:
+            self.value = value
+        elif t > self._last:
+            alpha = 1.0 - math.exp(-(t - self._last) / self.tau)
+            self.value += alpha * (value - self.value)
+        self._last = t
+
+# MARK: AlertEngine
+class AlertEngine:
+    def __init__(self, rules: list[AlertRule], default_windows: tuple[int, ...] = DEFAULT_WINDOWS):
+        self._lock = threading.Lock()
+        self.rules = rules
+        self.time: int|None = None
+        self._values: dict[str, float] = {}
+        self._windows: dict[tuple[str, int], RollingWindow] = {}
+        self._ewmas: dict[tuple[str, int], Ewma] = {}
+        for metric in recent.FIELDS:
+            for seconds in default_windows:
+                self._windows[(metric, seconds * _NS)] = RollingWindow(seconds * _NS)
+                self._ewmas[(metric, seconds * _NS)] = Ewma(seconds * _NS)
+        # ルールごとに(統計量の取り出し方, 比較, 閾値, 継続時間[ns])を前もって決めておく
+        self._compiled = []
+        for rule in rules:
+            key = (rule.metric, int(rule.window_seconds * _NS))
+            if rule.stat in ('max', 'min', 'mean'):
+                self._windows.setdefault(key, RollingWindow(key[1]))
+            elif rule.stat == 'ewma':
+                self._ewmas.setdefault(key, Ewma(key[1]))
+            self._compiled.append((rule.stat, key, _OPERATORS[rule.op], rule.threshold, int(rule.for_seconds * _NS)))
+        self._states = [STATE_INACTIVE] * len(rules)
+        self._since: list[int|None] = [None] * len(rules)    # 条件を満たし始めた時刻
+        self._current: list[float|None] = [None] * len(rules)
+
+    def add(self, t: int, stats: dict[str, float], notify: bool = True):
+        '''サンプルで統計量を更新し、全てのルールを評価する。状態が変わったルールはログに出して配信する。'''
+        with _eval_seconds.time():
+            with self._lock:
+                changed = self._add(t, stats)
+        if notify:
+            for index, state in changed:
+                self._notify(index, state)
+
+    def _add(self, t: int, stats: dict[str, float]) -> list[tuple[int, str]]:
+        self.time = t
+        self._values = dict(stats)
+        for (metric, _), window in self._windows.items():
+            window.add(t, stats[metric])
+        for (metric, _), ewma in self._ewmas.items():
+            ewma.add(t, stats[metric])
+
+        changed = []
+        states, since, current = self._states, self._since, self._current
+        for index, (stat, key, compare, threshold, for_ns) in enumerate(self._compiled):
+            if stat == 'value':
+                value = stats[key[0]]
+            elif stat == 'ewma':
+                value = self._ewmas[key].value
+            else:
+                window = self._windows[key]
+                if not window.full(t):
+                    continue    # 窓が埋まるまでは判定しない
+                value = window.max if stat == 'max' else window.min if stat == 'min' else window.mean
+            current[index] = value
+            state = states[index]
+            if compare(value, threshold):
+                if state == STATE_INACTIVE:
+                    since[index] = t
+                    state = STATE_PENDING
+                if state == STATE_PENDING and t - since[index] >= for_ns:
+                    state = STATE_FIRING
+            else:
+                state = STATE_INACTIVE
+                since[index] = None
+            if state != states[index]:
+                states[index] = state
+                changed.append((index, state))
+        return changed
+
+    def _notify(self, index: int, state: str):
+        rule = self.rules[index]
+        _transitions.inc(rule.name, state)
+        if state == STATE_FIRING:
+            logger.warning(f'alert {rule.name} firing: {rule.metric} {rule.stat} {rule.op} {rule.threshold} (value={self._current[index]})')
+        elif state == STATE_INACTIVE:
+            logger.info(f'alert {rule.name} resolved')
+        broadcaster.publish('alert', 'alert', dict(name=rule.name, state=state, value=self._current[index], time=self.time // 1_000_000))
+
+    def warm(self, samples: list[tuple[int, tuple[float, ...]]]):
+        '''直近のサンプル(recent.FIELDSの値)で窓を埋める。(起動時、発報の通知はしない)'''
+        for t, row in samples:
+            self.add(t, dict(zip(recent.FIELDS, row)), notify=False)
+
+    def alerts(self) -> list[dict]:
+        '''ルールごとの状態(state・since・value)を取得する。'''
+        with self._lock:
+            return [
+                dict(rule=rule, state=self._states[k], since=self._since[k], value=self._current[k])
+                for k, rule in enumerate(self.rules)
+            ]
+
+    def stats(self) -> tuple[int|None, list[dict]]:
+        '''最新のサンプルの時刻と、metric・stat・window_seconds・valueのリストを取得する。(窓が埋まっていない統計量も含める)'''
+        with self._lock:
+            records = [dict(metric=metric, stat='value', window_seconds=0, value=value) for metric, value in self._values.items()]
+            for (metric, window_ns), window in self._windows.items():
+                if len(window):
+                    for stat in ('max', 'min', 'mean'):
+                        records.append(dict(metric=metric, stat=stat, window_seconds=window_ns / _NS, value=getattr(window, stat)))
+            for (metric, tau), ewma in self._ewmas.items():
+                if ewma.value is not None:
+                    records.append(dict(metric=metric, stat='ewma', window_seconds=tau / _NS, value=ewma.value))
+            return self.time, records
+
+def load_rules(path: str) -> list[AlertRule]:
+    '''ALERT_RULES_PATHのJSONファイルからルールを読み込む。(空文字列ならルールなし)'''
+    if not path:
+        return []
+    rules = TypeAdapter(list[AlertRule]).validate_json(Path(path).read_bytes())
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise Exception(f'duplicate alert rule names in {path}')
+    logger.info(f'loaded {len(rules)} alert rules from {path}')
+    return rules
+
+engine = AlertEngine(load_rules(settings.ALERT_RULES_PATH))
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+from ..common import settings
+from ..common.logger import logger
+
+'''
+    collect_metricsで得たサンプルを購読中のクライアントへ配信する。
+
+    イベントは発行時に1回だけSSEの形式にエンコードし、全ての購読者で共有する。
+    購読者ごとのキューは長さを制限し、あふれた(クライアントが遅い)場合はキューを捨てて
+    resetイベントを送る。クライアントはresetを受けたらデータを取得し直す。
+'''
+
+# MARK: Subscriber
+class Subscriber:
+    def __init__(self, topics: set[str]):
+        self.topics = topics
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=settings.STREAM_QUEUE_SIZE)
+        self.dropped = 0
+
+    def put(self, payload: str):
+        if self.queue.full():
+            # 遅いクライアントのために溜め込まず、取得し直してもらう
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += 1
+            payload = encode('reset', {'dropped': self.dropped})
+        self.queue.put_nowait(payload)
+
+# MARK: Broadcaster
+class Broadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop|None = None
+        self._subscribers: set[Subscriber] = set()
+
+    def subscribe(self, topics: set[str]) -> Subscriber:
+        '''イベントループ上で呼び出すこと。'''
+        subscriber = Subscriber(topics)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, topic: str, event: str, data: dict):
+        '''任意のスレッドから呼び出せる。購読者がいなければ何もしない。'''
+        with self._lock:
+            if not self._subscribers or self._loop is None:
+                return
+            loop = self._loop
+        payload = encode(event, data)
+        try:
+            loop.call_soon_threadsafe(self._deliver, topic, payload)
+        except RuntimeError as e:
+            logger.debug(f'failed to publish {event}: {e}')
+
+    def _deliver(self, topic: str, payload: str):
+        with self._lock:
+            subscribers = [x for x in self._subscribers if topic in x.topics]
+        for subscriber in subscribers:
+            subscriber.put(payload)
+
+def encode(event: str, data: dict) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+broadcaster = Broadcaster()
@@ -0,0 +1,144 @@
+import psutil
+from pydantic import BaseModel
+import threading
+import time
+from ..db import gorilla, recent
+from ..common import settings, instrument
+from ..common.logger import logger
+
+'''
+    バースト測定: APIで指定した期間だけ、専用のスレッドで10〜100ミリ秒ごとにシステム状態とコアごとのCPU使用率を測定する。
+
+    METRICS_INTERVAL(既定6秒)では見えない1秒未満のCPUのスパイクを調べるためのもので、
+    サンプルはGorilla方式で圧縮したメモリ(db.gorilla.GorillaSeries)だけに保持し、/api/v1/monitor/burstで列ごとに返す。
+    DBには書き込まない。保持するのは最後のバースト1回分。
+
+    CPU使用率はpsutil.cpu_percentを使わずにcpu_times(percpu=True)の差分から計算する。
+    (cpu_percentは前回の呼び出しとの差分なので、collect_system_statsの値が短い間隔のものになってしまう)
+'''
+
+_samples = instrument.counter('psmon_burst_samples_total', 'Samples taken in burst mode')
+_overruns = instrument.counter('psmon_burst_overruns_total', 'Burst ticks skipped because sampling overran')
+
+# MARK: BurstStatus
+class BurstStatus(BaseModel):
+    running: bool = False
+    start: int|None = None          # 開始時刻(エポックミリ秒)
+    stop: int|None = None           # 終了した(する予定の)時刻(エポックミリ秒)
+    interval_ms: int = 0
+    cores: int = 0
+    samples: int = 0
+    overruns: int = 0
+    compressed_bytes: int = 0
+    raw_bytes: int = 0              # 圧縮しない場合(float64)の大きさ
+
+# MARK: BurstSampler
+class BurstSampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread|None = None
+        self._series: gorilla.GorillaSeries|None = None
+        self._status = BurstStatus()
+
+    def start(self, duration_seconds: float, interval_ms: int) -> BurstStatus|None:
+        '''バーストを始める。(前回のサンプルは捨てる) すでに実行中の場合はNoneを返す。'''
+        with self._lock:
+            if self._status.running:
+                return None
+            cores = psutil.cpu_count() or 1
+            fields = recent.FIELDS + tuple(f'cpu{k}' for k in range(cores))
+            self._series = gorilla.GorillaSeries(fields)
+            now = time.time_ns() // 1_000_000
+            self._status = BurstStatus(
+                running=True, start=now, stop=now + int(duration_seconds * 1000), interval_ms=interval_ms, cores=cores,
+            )
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(duration_seconds, interval_ms / 1000), name='psmon-burst', daemon=True,
+            )
+            self._thread.start()
+            logger.info(f'burst sampling started: every {interval_ms}ms for {duration_seconds}s ({cores} cores)')
+            return self._status.model_copy()
+
+    def stop(self):
+        '''実行中のバーストを止め、スレッドが終わるのを待つ。'''
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def status(self) -> BurstStatus:
+        with self._lock:
+            status = self._status.model_copy()
+            if self._series is not None:
+                status.samples = self._series.count
+                status.compressed_bytes = self._series.nbytes
+                status.raw_bytes = self._series.count * 8 * (len(self._series.fields) + 1)
+            return status
+
+    def columns(self, start: int|None = None) -> tuple[BurstStatus, dict[str, list]|None]:
+        '''状態と、時刻(エポックミリ秒)がstartより後のサンプルの列ごとのデータ(バーストをしていなければNone)'''
+        with self._lock:
+            series = self._series
+            blocks = series.snapshot() if series is not None else None
+        status = self.status()
+        if series is None:
+            return status, None
+        # NOTE: 展開はロックの外で行い、測定のスレッドを待たせない
+        return status, gorilla.decode(series.fields, blocks, start)
+
+    def _run(self, duration_seconds: float, interval: float):
+        prev = _cpu_busy_total(psutil.cpu_times(percpu=True))
+        t0 = time.monotonic()
+        deadline = t0 + duration_seconds
+        tick = 1
+        try:
+            while True:
+                scheduled = t0 + tick * interval
+                if scheduled > deadline or self._stop.wait(max(0.0, scheduled - time.monotonic())):
+                    break
+                current = _cpu_busy_total(psutil.cpu_times(percpu=True))
+                t = time.time_ns()
+                cores = [_percent(busy - last_busy, total - last_total) for (busy, total), (last_busy, last_total) in zip(current, prev)]
+                busy = sum(b for b, _ in current) - sum(b for b, _ in prev)
+                total = sum(x for _, x in current) - sum(x for _, x in prev)
+                prev = current
+                row = (
+                    _percent(busy, total),
+                    float(psutil.virtual_memory().available),
+                    float(psutil.disk_usage(settings.ROOTFS_PATH).used),
+                )
+                with self._lock:
+                    self._series.append(t // 1_000_000, row + tuple(cores))
+                _samples.inc()
+                # 測定が間隔を超えた場合は、過ぎた分を飛ばして次の格子の時刻から続ける
+                next_tick = int((time.monotonic() - t0) / interval) + 1
+                if next_tick > tick + 1:
+                    _overruns.inc(amount=next_tick - tick - 1)
+                    with self._lock:
+                        self._status.overruns += next_tick - tick - 1
+                tick = next_tick
+        except Exception as e:
+            logger.error(f'burst sampling failed: {e}')
+        finally:
+            with self._lock:
+                self._status.running = False
+                self._status.stop = time.time_ns() // 1_000_000
+            logger.info(f'burst sampling stopped: {self._series.count} samples')
+
+def _percent(busy: float, total: float) -> float:
+    # NOTE: 小数点以下1桁に丸めると、XORの圧縮が効きやすい(psutil.cpu_percentと同じ桁)
+    if total <= 0:
+        return 0.0
+    return min(100.0, max(0.0, round(100.0 * busy / total, 1)))
+
+def _cpu_busy_total(times) -> list[tuple[float, float]]:
+    '''コアごとの(使用中の時間, 合計の時間)。(psutil.cpu_percentと同じく、guestはuserに含まれるので除き、iowaitはidleとする)'''
+    output = []
+    for x in times:
+        total = sum(x) - getattr(x, 'guest', 0.0) - getattr(x, 'guest_nice', 0.0)
+        output.append((total - x.idle - getattr(x, 'iowait', 0.0), total))
+    return output
+
+sampler = BurstSampler()
@@ -0,0 +1,131 @@
+import heapq
+import os
+from operator import itemgetter
+import time
+from pathlib import Path
+from ..common import settings
+
+'''
+    ホストのcgroup v2のツリー(ROOTFS_PATH/sys/fs/cgroup)を読み、cgroup(コンテナやsystemdのサービス)ごとの
+    CPU使用率・メモリ・ストレージの読み書きを測定する。
+
+    プロセスごとの上位から組み立て直すと、上位に入らなかったプロセスの分が抜け落ち、全プロセスの/procを読む必要もある。
+    cgroupのカウンタは配下の全プロセスの合計なので、cgroupごとにcpu.stat・memory.current・io.statを読むだけで済む。
+
+    プロセスはツリーの葉のcgroupに属するため、葉(max_depthより深い場合はmax_depthの階層)だけを測定する。
+    葉どうしは重ならないので、値を足し合わせてもホスト全体を超えない。
+    CPU時間と読み書きの量は累積値なので、前回の測定からの差分で割合・速さにする。(procscanと同じ)
+'''
+
+# MARK: CgroupScanner
+class CgroupScanner:
+    def __init__(self, cgroup_path: str, max_depth: int = settings.CGROUP_MAX_DEPTH):
+        self.cgroup_path = cgroup_path
+        self.max_depth = max_depth
+        self._prev: dict[str, tuple[int, int, int, int, float]] = {}     # 名前 -> (inode, CPU時間[us], 読み込み, 書き込み[バイト], 読んだ時刻)
+
+    def scan(self, count: int) -> list[tuple[str, float, float, float, float]]:
+        '''storage.CGROUP_METRICSのそれぞれで上位count個に入るcgroupを取得する。初回はCPU使用率と読み書きが全て0になる。
+
+        Returns:
+            list[tuple[str, float, float, float, float]]: 名前(ルートからの相対パス)、CPU使用率、メモリ[バイト]、読み込み・書き込み[バイト/秒]
+        '''
+        prev = self._prev
+        current: dict[str, tuple[int, int, int, int, float]] = {}
+        self._prev = current    # 削除されたcgroupの状態はここで捨てられる
+        rows = []
+        for name, inode, path in self._leaves():
+            usage = _read_cpu_usage(path)
+            if usage is None:
+                continue    # 読んでいる間に削除されたcgroup
+            memory = _read_int(f'{path}/memory.current')
+            read, write = _read_io(path)
+            now = time.monotonic()
+            current[name] = (inode, usage, read, write, now)
+            last = prev.get(name)
+            cpu = read_rate = write_rate = 0.0
+            # NOTE: 同じ名前で作り直されたcgroup(inodeが変わる)はカウンタが0からなので、次回から計測する
+            if last is not None and last[0] == inode and now > last[4]:
+                elapsed = now - last[4]
+                cpu = round(max(0, usage - last[1]) / elapsed / 1e4, 1)
+                read_rate = max(0, read - last[2]) / elapsed
+                write_rate = max(0, write - last[3]) / elapsed
+            rows.append((name, cpu, float(memory or 0), read_rate, write_rate))
+        return select_top(rows, count)
+
+    def _leaves(self):
+        '''(名前, inode, パス)を返す。ルートのcgroup(ホスト全体)は含めない。'''
+        stack = [(self.cgroup_path, '', 0, 0)]
+        while stack:
+            path, name, inode, depth = stack.pop()
+            children = []
+            if depth < self.max_depth:
+                try:
+                    with os.scandir(path) as entries:
+                        children = [(entry.name, entry.inode()) for entry in entries if entry.is_dir(follow_symlinks=False)]
+                except OSError:
+                    continue    # 削除されたcgroup
+            if children:
+                for child, child_inode in children:
+                    stack.append((f'{path}/{child}', f'{name}/{child}' if name else child, child_inode, depth + 1))
+            elif depth > 0:
+                yield name, inode, path
+
+# MARK: subroutines
+def _read_int(path: str) -> int|None:
+    try:
+        with open(path, 'rb') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _read_cpu_usage(path: str) -> int|None:
+    '''cpu.statのusage_usec(cpuコントローラが無効でも読める)'''
+    try:
+        with open(f'{path}/cpu.stat', 'rb') as f:
+            for line in f:
+                if line.startswith(b'usage_usec '):
+                    return int(line[11:])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _read_io(path: str) -> tuple[int, int]:
+    '''io.statの全デバイスのrbytes・wbytesの合計(ioコントローラが無効なら0)'''
+    read = write = 0
+    try:
+        with open(f'{path}/io.stat', 'rb') as f:
+            data = f.read()
+    except OSError:
+        return 0, 0
+    # 形式: "8:0 rbytes=1 wbytes=2 rios=3 wios=4 dbytes=0 dios=0"
+    for item in data.split():
+        if item.startswith(b'rbytes='):
+            read += int(item[7:])
+        elif item.startswith(b'wbytes='):
+            write += int(item[7:])
+    return read, write
+
+def select_top(rows: list[tuple], count: int) -> list[tuple]:
+    '''storage.CGROUP_METRICSのそれぞれで上位count個に入る行の和集合を返す。(値が0の行は含めない)'''
+    selected: dict[str, tuple] = {}
+    for k in range(1, len(rows[0]) if rows else 0):
+        for row in heapq.nlargest(count, rows, key=itemgetter(k)):
+            if row[k] > 0:
+                selected.setdefault(row[0], row)
+    return list(selected.values())
+
+def find_cgroup_root() -> str|None:
+    '''cgroup v2のツリーのパスを返す。(ハイブリッド構成ではunified/、v1だけの環境ではNone)'''
+    base = Path(settings.ROOTFS_PATH) / 'sys' / 'fs' / 'cgroup'
+    for path in (base, base / 'unified'):
+        if (path / 'cgroup.controllers').is_file():
+            return str(path)
+    return None
+
+def create_scanner() -> CgroupScanner|None:
+    '''cgroup v2が読めない環境ではNoneを返す。'''
+    path = find_cgroup_root()
+    if path is None:
+        return None
+    return CgroupScanner(path)
@@ -0,0 +1,129 @@
+from pydantic import BaseModel
+from typing import Callable
+import threading
+import time
+from ..common.logger import logger
+from ..common import instrument
+
+'''
+    測定処理を一定の間隔で実行するスケジューラ。
+
+    実行時刻は間隔の倍数の時刻(例: 6秒間隔なら毎分0, 6, 12, ...秒)に揃え、前回の実行時刻に間隔を足すのではなく
+    毎回この格子から次の時刻を求めるため、実行が遅れても時刻がずれていかない。
+    実行が次の時刻を過ぎた場合(オーバーラン)は、過ぎた分の実行を飛ばして次の格子の時刻から再開し、回数を記録する。
+
+    処理ごとに専用のスレッドで動かすため、時間のかかるプロセスの走査が軽いシステム状態の測定を遅らせない。
+'''
+
+_run_seconds = instrument.histogram('psmon_collector_run_seconds', 'Time spent in each collector run', ('task',))
+_jitter_seconds = instrument.histogram(
+    'psmon_collector_jitter_seconds', 'Delay between the scheduled tick and the actual start of a run', ('task',),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+_overruns = instrument.counter('psmon_collector_overruns_total', 'Ticks skipped because the previous run overran', ('task',))
+_errors = instrument.counter('psmon_collector_errors_total', 'Collector runs that raised an exception', ('task',))
+
+# MARK: CollectorStats
+class CollectorStats(BaseModel):
+    interval: float
+    runs: int
+    overruns: int
+    errors: int
+    last_seconds: float
+    max_seconds: float
+    last_jitter: float
+    max_jitter: float
+
+# MARK: PeriodicTask
+class PeriodicTask:
+    def __init__(self, name: str, interval: float, fn: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'psmon-collector-{name}', daemon=True)
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._overruns = 0
+        self._errors = 0
+        self._last_seconds = 0.0
+        self._max_seconds = 0.0
+        self._last_jitter = 0.0
+        self._max_jitter = 0.0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        '''実行中の処理が終わるのを待って止める。'''
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self) -> CollectorStats:
+        with self._lock:
+            return CollectorStats(
+                interval=self.interval,
+                runs=self._runs,
+                overruns=self._overruns,
+                errors=self._errors,
+                last_seconds=self._last_seconds,
+                max_seconds=self._max_seconds,
+                last_jitter=self._last_jitter,
+                max_jitter=self._max_jitter,
+            )
+
+    def _run(self):
+        interval = self.interval
+        deadline = (time.time() // interval + 1) * interval
+        while not self._stop.wait(max(0.0, deadline - time.time())):
+            started = time.time()
+            jitter = started - deadline
+            t0 = time.perf_counter()
+            try:
+                self.fn()
+            except Exception as e:
+                logger.exception(f'collector task {self.name} failed: {e}')
+                _errors.inc(self.name)
+                with self._lock:
+                    self._errors += 1
+            elapsed = time.perf_counter() - t0
+            _run_seconds.observe(elapsed, self.name)
+            _jitter_seconds.observe(jitter, self.name)
+
+            # 次の格子の時刻。過ぎてしまった時刻の分は実行しない
+            deadline += interval
+            now = time.time()
+            skipped = 0
+            if now >= deadline:
+                skipped = int((now - deadline) // interval) + 1
+                deadline += skipped * interval
+                _overruns.inc(self.name, amount=skipped)
+                logger.warning(f'collector task {self.name} overran: took {elapsed:.3f}s, skipped {skipped} tick(s)')
+            with self._lock:
+                self._runs += 1
+                self._overruns += skipped
+                self._last_seconds = elapsed
+                self._max_seconds = max(self._max_seconds, elapsed)
+                self._last_jitter = jitter
+                self._max_jitter = max(self._max_jitter, jitter)
+
+# MARK: start & stop
+_tasks: list[PeriodicTask] = []
+
+def start(tasks: list[tuple[str, float, Callable[[], None]]]):
+    '''(名前, 間隔[秒], 処理)ごとにスレッドを起動する。'''
+    for name, interval, fn in tasks:
+        task = PeriodicTask(name, interval, fn)
+        task.start()
+        _tasks.append(task)
+        logger.info(f'collector task {name} started: every {interval}s')
+
+def stop():
+    for task in _tasks:
+        task._stop.set()
+    while _tasks:
+        _tasks.pop().stop()
+
+def get_stats() -> dict[str, CollectorStats]:
+    '''測定処理ごとの統計(実行回数、オーバーラン回数、ジッタなど)を取得する。'''
+    return {task.name: task.stats() for task in _tasks}
@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Callable
+import fcntl
+import os
+import threading
+from ..common import settings
+from ..common.logger import logger
+
+'''
+    複数のワーカー(uvicorn --workers)で動かすときに、測定するプロセスを1つだけにするためのリーダー選出。
+
+    ファイルロック(flock)を取れたプロセスがリーダーになる。ロックはプロセスが終了するとOSが外すため、
+    リーダーが落ちても残りのプロセスの1つが次の確認でリーダーを引き継ぐ。
+'''
+
+_RETRY_SECONDS = 1.0    # フォロワーがロックを取り直す間隔
+
+# MARK: Election
+class Election:
+    def __init__(self, path: str, on_elected: Callable[[], None]):
+        self.path = path
+        self.on_elected = on_elected
+        self.is_leader = False
+        self._fd: int|None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread|None = None
+
+    def start(self) -> bool:
+        '''ロックを取れたらon_electedを呼んでTrueを返す。取れなかったらバックグラウンドで取り直す。'''
+        if self._try_acquire():
+            return True
+        self._thread = threading.Thread(target=self._run, name='psmon-election', daemon=True)
+        self._thread.start()
+        return False
+
+    def stop_election(self):
+        '''ロックを取り直すのをやめる。以降はis_leaderが変わらない。'''
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def stop(self):
+        self.stop_election()
+        if self._fd is not None:
+            os.close(self._fd)  # ロックを外す
+            self._fd = None
+        self.is_leader = False
+
+    def _run(self):
+        while not self._stop.wait(_RETRY_SECONDS):
+            if self._try_acquire():
+                return
+
+    def _try_acquire(self) -> bool:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self._fd = fd
+        self.is_leader = True
+        logger.info(f'elected as the collector leader (pid={os.getpid()})')
+        self.on_elected()
+        return True
+
+# MARK: start & stop
+election: Election|None = None
+
+def start(on_elected: Callable[[], None]) -> bool:
+    '''リーダーになれたらTrueを返す。'''
+    global election
+    election = Election(settings.LEADER_LOCK_PATH, on_elected)
+    return election.start()
+
+def stop_election():
+    if election is not None:
+        election.stop_election()
+
+def stop():
+    global election
+    if election is not None:
+        election.stop()
+        election = None
+
+def is_leader() -> bool:
+    return election is not None and election.is_leader
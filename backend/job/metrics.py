@@ -1,34 +1,87 @@
 import psutil
 from pathlib import Path
-from ..db import database
+from ..db import database, recent, shared
+from . import rollup, procscan, cgroupscan
+from .alerts import engine as alert_engine
+from .broadcast import broadcaster
 from ..common import settings
 from ..common.logger import logger
+from ..common import instrument
 import time
 
 # NOTE: プロセスのCPU使用率を取得するために、ホストの/procを参照している:
 # see also: https://www.reddit.com/r/docker/comments/mo9wq5/accessing_host_resources_from_inside_a_container/
 psutil.PROCFS_PATH = str(Path(settings.ROOTFS_PATH) / 'proc')
+_scanner = procscan.create_scanner()
+_process_names = procscan.NameRegistry(settings.PROCESS_NAME_MAX)
+_cgroup_scanner = cgroupscan.create_scanner() if settings.CGROUP_INTERVAL > 0 else None
+
+_collect_seconds = instrument.histogram('psmon_collect_seconds', 'Time spent in collect_metrics', ('step',))
 
 def collect_metrics(init: bool = False):
-    '''psutilで取得したデータをDBに保存する。'''
+    '''psutilで取得したデータをDBに保存する。(システム状態とプロセスを続けて測定する)'''
     logger.debug(f'collect_metrics(init={init})')
     if init:
         # 初回はpsutilのキャッシュを作成する
         psutil.cpu_percent()
-        _get_top_cpu_processes()
+        _get_top_processes()
+        if _cgroup_scanner:
+            _cgroup_scanner.scan(settings.CGROUP_COUNT)
         return
     
-    t = time.time_ns()
-    database.write_system_stats_record(
-        t,
-        cpu_percent=psutil.cpu_percent(), 
-        mem_available=float(psutil.virtual_memory().available), 
-        disk_used=float(psutil.disk_usage(settings.ROOTFS_PATH).used), 
-    )
-    database.write_process_cpu_record(
-        t,
-        _get_top_cpu_processes(),
-    )
+    with _collect_seconds.time('total'):
+        collect_system_stats()
+        collect_processes()
+
+def collect_system_stats():
+    '''CPU使用率・メモリ・ディスクを測定して保存する。'''
+    with _collect_seconds.time('system_stats'):
+        t = time.time_ns()  # 測定した時刻
+        stats = dict(
+            cpu_percent=psutil.cpu_percent(), 
+            mem_available=float(psutil.virtual_memory().available), 
+            disk_used=float(psutil.disk_usage(settings.ROOTFS_PATH).used), 
+        )
+        apply_sample(t, **stats)
+        if shared.samples:
+            shared.samples.append(t, tuple(stats[field] for field in recent.FIELDS))
+        rollup.add_system_stats(t, **stats)
+        database.write_system_stats_record(t, **stats)
+
+def collect_processes():
+    '''CPU使用率・常駐メモリ・読み書きが多いプロセスを測定して保存する。'''
+    with _collect_seconds.time('processes'):
+        t = time.time_ns()  # 測定した時刻
+        processes = _get_top_processes()
+        rollup.add_processes(t, processes)
+        database.write_process_record(t, processes)
+
+def collect_cgroups():
+    '''cgroup(コンテナ・サービス)ごとのCPU使用率・メモリ・読み書きを測定して保存する。'''
+    with _collect_seconds.time('cgroups'):
+        t = time.time_ns()  # 測定した時刻
+        cgroups = _cgroup_scanner.scan(settings.CGROUP_COUNT)
+        rollup.add_cgroups(t, cgroups)
+        database.write_cgroup_record(t, cgroups)
+
+def cgroups_available() -> bool:
+    '''cgroup v2のツリーを読めるか(CGROUP_INTERVAL=0の場合はFalse)'''
+    return _cgroup_scanner is not None
+
+def apply_sample(t: int, **stats: float):
+    '''サンプルを直近データのメモリ(recent.store)に追記して配信する。
+
+    フォロワー(測定しないワーカー)は、リーダーが共有メモリに書いたサンプルでこれを呼び出す。
+    '''
+    for every_seconds, record in recent.store.append(t, **stats):
+        _publish_bucket(every_seconds, record)
+    alert_engine.add(t, stats)
+    broadcaster.publish('sample', 'sample', dict(time=t // 1_000_000, **stats))
+
+def _publish_bucket(every_seconds: int, record: dict):
+    data = dict(record, every_seconds=every_seconds)
+    data['time'] = int(data.pop('_time').timestamp() * 1000)
+    broadcaster.publish(f'bucket:{every_seconds}', 'bucket', data)
 
 def get_mem_total():
     '''メモリの総容量を取得する。'''
@@ -38,21 +91,30 @@ def get_disk_total():
     '''ディスクの総容量を取得する。'''
     return psutil.disk_usage(settings.ROOTFS_PATH).total
 
-def _get_top_cpu_processes(interval: float = None) -> list[tuple[float, int, str]]:
-    '''CPU使用率が高いプロセスを取得する。
+def _get_top_processes(interval: float = None) -> list[tuple[int, str, float, float, float, float]]:
+    '''CPU使用率・常駐メモリ・読み書きのそれぞれで上位のプロセスを取得する。
+
+    settings.PROCESS_SCHEMA='name'の場合は、プロセス名(枠を超えた名前はprocscan.OTHER)ごとに合計した値で選ぶ。
 
     Returns:
-        list[tuple[float, int, str]]: プロセスのCPU使用率、PID、プロセス名
+        list[tuple[int, str, float, float, float, float]]: PID、プロセス名、CPU使用率、常駐メモリ、読み込み・書き込み[バイト/秒]
     '''
+    key = None
+    if settings.PROCESS_SCHEMA == 'name':
+        _process_names.begin()
+        key = _process_names
+    if _scanner and interval is None:
+        return _scanner.scan(settings.TOP_PROCESS_COUNT, key)
+
+    # NOTE: /procを読めない環境ではpsutilで測る。読み書きの量は測らない(0とする)
     process_list = []
     for process in psutil.process_iter(['pid', 'name']):
         try:
             cpu_percent = process.cpu_percent(interval=interval)
-            process_list.append((cpu_percent, process.pid, process.name()))
+            rss = float(process.memory_info().rss)
+            process_list.append((process.pid, process.name(), cpu_percent, rss, 0.0, 0.0))
         except (psutil.NoSuchProcess, psutil.AccessDenied):
             continue
-
-    # CPU使用率でソート（降順）し、上位を返す
-    top_processes = sorted(process_list, key=lambda x: x[0], reverse=True)[:settings.TOP_PROCESS_COUNT]
-
-    return top_processes
+    if key is not None:
+        process_list = procscan.group_by_name(process_list, key)
+    return procscan.select_top(process_list, settings.TOP_PROCESS_COUNT)
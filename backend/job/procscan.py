@@ -0,0 +1,198 @@
+import heapq
+import os
+from operator import itemgetter
+import time
+from pathlib import Path
+from typing import Callable
+from ..common import settings
+
+'''
+    /proc/[pid]/statを直接読み、CPU使用率・常駐メモリ・ストレージの読み書きが多いプロセスを1回の走査で取得する。
+
+    psutil.process_iterはプロセスごとにオブジェクトを作り、cpu_percent()とname()で複数回ファイルを読むため、
+    プロセス数が多いホストではこれが測定の大半を占める。ここではstatを1回読むだけで済ませ、
+    前回の測定からのCPU時間の差分を自前で計算する。
+
+    読み書きの量(/proc/[pid]/io)はプロセスごとに別のファイルになるため、前回からCPU時間が増えたプロセスだけを読む。
+    読み書きにはシステムコールのCPU時間がかかるので、CPU時間が増えていないプロセスは読み書きもほぼしていない。
+    読まなかった間の量は、次に読んだときに前回読んだ時刻からの平均として数える。
+'''
+
+_UNREAD = ()                # 読み書きの量をまだ読んでいないプロセス
+
+# MARK: ProcessScanner
+class ProcessScanner:
+    def __init__(self, proc_path: str):
+        self.proc_path = proc_path
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        self._prev: dict[int, tuple[int, int]] = {}    # pid -> (起動時刻, CPU時間[tick])
+        self._prev_io: dict[int, tuple] = {}    # pid -> (読み込み, 書き込み[バイト], 読んだ時刻)、読めない場合はNone
+        self._prev_time: float|None = None
+
+    def scan(self, count: int, key: Callable[[str], str]|None = None) -> list[tuple[int, str, float, float, float, float]]:
+        '''storage.PROCESS_METRICSのそれぞれで上位count個に入るプロセスを取得する。初回はCPU使用率と読み書きが全て0になる。
+
+        Args:
+            key: 指定した場合はkey(プロセス名)ごとに合計してから上位を選ぶ(group_by_nameを参照)
+
+        Returns:
+            list[tuple[int, str, float, float, float, float]]: PID、プロセス名、CPU使用率、常駐メモリ、読み込み・書き込み[バイト/秒]
+        '''
+        now = time.monotonic()
+        scale = 0.0
+        if self._prev_time is not None and now > self._prev_time:
+            scale = 100.0 / self._clock_ticks / (now - self._prev_time)
+        self._prev_time = now
+        prev, prev_io = self._prev, self._prev_io
+        current: dict[int, tuple[int, int]] = {}
+        current_io: dict[int, tuple] = {}
+        self._prev, self._prev_io = current, current_io    # 終了したプロセスの状態はここで捨てられる
+        page_size = self._page_size
+
+        rows = []
+        active = []     # (rowsの位置, 前回の読み書きの量)
+        for pid, comm, starttime, ticks, rss in self._read_stats():
+            current[pid] = (starttime, ticks)
+            last = prev.get(pid)
+            if last is None or last[0] != starttime:
+                # 新しいプロセス(またはPIDの再利用)は次回から計測する
+                cpu = 0.0
+            else:
+                cpu = round((ticks - last[1]) * scale, 1)
+                last_io = current_io[pid] = prev_io.get(pid, _UNREAD)
+                # NOTE: 権限がなく読めなかったプロセス(None)は読み直さない
+                if ticks != last[1] and last_io is not None:
+                    active.append((len(rows), last_io))
+            rows.append((pid, comm, cpu, float(rss * page_size), 0.0, 0.0))
+
+        # CPU時間が増えたプロセスだけ読み書きの量を読む
+        # 読まなかったプロセスは前回の値を持ち越し、次に読んだときに前回からの平均として数える
+        for i, last_io in active:
+            pid = rows[i][0]
+            counters = current_io[pid] = self._read_io(pid, now)
+            if counters is not None and last_io is not _UNREAD and now > last_io[2]:
+                rows[i] = rows[i][:4] + (
+                    (counters[0] - last_io[0]) / (now - last_io[2]),
+                    (counters[1] - last_io[1]) / (now - last_io[2]),
+                )
+
+        if key is not None:
+            rows = group_by_name(rows, key)
+        return select_top(rows, count)
+
+    def _read_stats(self):
+        proc_path = self.proc_path
+        for entry in os.listdir(proc_path):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'{proc_path}/{entry}/stat', 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue    # 読んでいる間に終了したプロセス
+            # NOTE: commには空白や括弧が含まれうるため、最後の')'で区切る
+            left = data.find(b'(')
+            right = data.rfind(b')')
+            if left < 0 or right < 0:
+                continue
+            fields = data[right + 2:].split()
+            try:
+                # fields[0]がstat(3)、utime(14)・stime(15)・starttime(22)・rss(24)[ページ]
+                yield (
+                    int(entry),
+                    data[left + 1:right].decode(errors='replace'),
+                    int(fields[19]),
+                    int(fields[11]) + int(fields[12]),
+                    int(fields[21]),
+                )
+            except (IndexError, ValueError):
+                continue
+
+    def _read_io(self, pid: int, now: float) -> tuple[int, int, float]|None:
+        '''(read_bytes, write_bytes, now)を返す。読めない場合はNoneを返す。'''
+        try:
+            with open(f'{self.proc_path}/{pid}/io', 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        read = write = None
+        for line in data.splitlines():
+            if line.startswith(b'read_bytes:'):
+                read = int(line[11:])
+            elif line.startswith(b'write_bytes:'):
+                write = int(line[12:])
+        if read is None or write is None:
+            return None
+        return read, write, now
+
+# MARK: NameRegistry
+OTHER = 'other'
+
+class NameRegistry:
+    '''プロセス名ごとの系列の数をcapacity個に抑える。(settings.PROCESS_SCHEMA='name')
+
+    2回以上の走査で見かけた名前から順に枠を割り当て、枠が足りない名前と1回しか見かけない短命な名前はOTHERにまとめる。
+    ttl秒見かけなかった名前は枠を空けるため、系列の数はttlあたり高々capacity個しか増えない。
+    '''
+    def __init__(self, capacity: int, ttl: float = 24 * 60 * 60):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._names: dict[str, float] = {}      # 枠を割り当てた名前 -> 最後に見かけた時刻(monotonic)
+        self._seen: set[str] = set()            # 前回までの走査で見かけた、枠のない名前
+        self._seen_now: set[str] = set()
+        self._now = time.monotonic()
+
+    def __call__(self, name: str) -> str:
+        if name in self._names:
+            self._names[name] = self._now
+            return name
+        if name in self._seen and len(self._names) < self.capacity:
+            self._names[name] = self._now
+            return name
+        self._seen_now.add(name)
+        return OTHER
+
+    def begin(self):
+        '''走査の前に呼び出す。'''
+        self._now = time.monotonic()
+        for name in [name for name, last in self._names.items() if self._now - last > self.ttl]:
+            del self._names[name]
+        # NOTE: 見かけた名前は直前の走査の分だけ残すので、短命な名前が溜まり続けることはない
+        self._seen, self._seen_now = self._seen_now, set()
+
+# MARK: subroutines
+def group_by_name(rows: list[tuple], key: Callable[[str], str]) -> list[tuple]:
+    '''プロセスの値をkey(プロセス名)ごとに合計する。PIDはCPU使用率が最も高いプロセスのものにする。'''
+    groups: dict[str, list] = {}
+    for pid, name, cpu, *values in rows:
+        name = key(name)
+        group = groups.get(name)
+        if group is None:
+            groups[name] = [pid, name, cpu, *values, cpu]
+            continue
+        if cpu > group[-1]:
+            group[0] = pid
+            group[-1] = cpu
+        group[2] += cpu
+        for k, value in enumerate(values):
+            group[3 + k] += value
+    return [(group[0], group[1], round(group[2], 1), *group[3:-1]) for group in groups.values()]
+
+def select_top(rows: list[tuple], count: int) -> list[tuple]:
+    '''storage.PROCESS_METRICSのそれぞれで上位count個に入る行の和集合を返す。'''
+    # 全件をソートせず、件数countのヒープで値ごとの上位を選ぶ
+    # NOTE: CPU使用率は従来どおり常にcount個選ぶ。他の値は0のプロセスを上位に含めない
+    selected: dict[tuple[int, str], tuple] = {}
+    for k in range(2, len(rows[0]) if rows else 0):
+        for row in heapq.nlargest(count, rows, key=itemgetter(k)):
+            if k == 2 or row[k] > 0:
+                selected.setdefault(row[:2], row)
+    return list(selected.values())
+
+def create_scanner() -> ProcessScanner|None:
+    '''/procが読めない環境(Linux以外)ではNoneを返す。'''
+    proc_path = str(Path(settings.ROOTFS_PATH) / 'proc')
+    if not hasattr(os, 'sysconf') or not Path(proc_path, 'stat').is_file():
+        return None
+    return ProcessScanner(proc_path)
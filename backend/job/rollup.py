@@ -0,0 +1,179 @@
+from typing import Callable
+from ..db import database, recent
+from ..common import settings
+from ..common.logger import logger
+import time
+
+'''
+    collect_metricsのサンプルからロールアップ(settings.ROLLUPSの間隔ごとの集計値)を計算する。
+
+    バケットが閉じた(次のバケットのサンプルが来た)時点で、バケットの開始時刻を
+    タイムスタンプとしてDBに書き込む。平均は後から重み付きで合成できるようsumとcountで保持する。
+'''
+
+_NS = 1_000_000_000
+
+# MARK: SystemStatsRollup
+class SystemStatsRollup:
+    def __init__(self, rollup: settings.Rollup, write: Callable[[str, int, dict[str, float]], None]|None = None):
+        '''
+        Args:
+            write: 閉じたバケットの書き込み先(every, 開始時刻, fields)。省略した場合はDBに書き込む(エージェントは送信キューに積む)
+        '''
+        self.rollup = rollup
+        self.every = rollup.every_seconds * _NS
+        self.write = write
+        self.start: int|None = None
+        self.count = 0
+        self.sums: list[float] = []
+        self.maxes: list[float] = []
+
+    def add(self, t: int, values: tuple[float, ...]):
+        start = t // self.every * self.every
+        if start != self.start:
+            self.flush()
+            self.start = start
+            self.count = 0
+            self.sums = [0.0] * len(values)
+            self.maxes = list(values)
+        self.count += 1
+        for k, value in enumerate(values):
+            self.sums[k] += value
+            if value > self.maxes[k]:
+                self.maxes[k] = value
+
+    def flush(self):
+        if self.start is None or not self.count:
+            return
+        fields = {}
+        for k, field in enumerate(recent.FIELDS):
+            fields[f'{field}_max'] = self.maxes[k]
+            fields[f'{field}_sum'] = self.sums[k]
+            fields[f'{field}_count'] = float(self.count)
+        (self.write or database.write_system_stats_rollup)(self.rollup.every, self.start, fields)
+        self.count = 0
+
+# MARK: ProcessRollup
+class ProcessRollup:
+    def __init__(self, rollup: settings.Rollup):
+        self.rollup = rollup
+        self.every = rollup.every_seconds * _NS
+        self.start: int|None = None
+        self.table: dict[tuple[int, str]|str, list] = {}  # (pid, name)またはname -> [pid, name, PROCESS_METRICSごとのmax, min, sum..., count]
+
+    def add(self, t: int, processes: list[tuple]):
+        start = t // self.every * self.every
+        if start != self.start:
+            self.flush()
+            self.start = start
+        # NOTE: 名前ごとに保存する場合(PROCESS_SCHEMA='name')のPIDは名前の代表なので、CPU使用率が最大だったサンプルのものを残す
+        by_name = settings.PROCESS_SCHEMA == 'name'
+        for pid, name, *values in processes:
+            key = name if by_name else (pid, name)
+            data = self.table.get(key)
+            if data is None:
+                self.table[key] = [pid, name] + [x for value in values for x in (value, value, value)] + [1.0]
+                continue
+            if values[0] > data[2]:
+                data[0] = pid
+            for k, value in enumerate(values):
+                i = 2 + 3 * k
+                if value > data[i]:
+                    data[i] = value
+                if value < data[i + 1]:
+                    data[i + 1] = value
+                data[i + 2] += value
+            data[-1] += 1.0
+
+    def warm(self, now: int):
+        '''再起動前に書き込んだ現在のバケットの値から集計を続ける。(バケットを書き直すときに、再起動前の分を上書きしないように)'''
+        start = now // self.every * self.every
+        by_name = settings.PROCESS_SCHEMA == 'name'
+        self.start = start
+        self.table = {
+            (row[1] if by_name else (row[0], row[1])): list(row)
+            for row in database.load_process_rollup(self.rollup.every, start)
+        }
+
+    def flush(self):
+        if self.start is None or not self.table:
+            return
+        database.write_process_rollup(self.rollup.every, self.start, [tuple(data) for data in self.table.values()])
+        self.table = {}
+
+# MARK: CgroupRollup
+class CgroupRollup:
+    def __init__(self, rollup: settings.Rollup):
+        self.rollup = rollup
+        self.every = rollup.every_seconds * _NS
+        self.start: int|None = None
+        self.table: dict[str, list] = {}    # name -> [name, CGROUP_METRICSごとのmax, sum..., count]
+
+    def add(self, t: int, cgroups: list[tuple]):
+        start = t // self.every * self.every
+        if start != self.start:
+            self.flush()
+            self.start = start
+        for name, *values in cgroups:
+            data = self.table.get(name)
+            if data is None:
+                self.table[name] = [name] + [x for value in values for x in (value, value)] + [1.0]
+                continue
+            for k, value in enumerate(values):
+                i = 1 + 2 * k
+                if value > data[i]:
+                    data[i] = value
+                data[i + 1] += value
+            data[-1] += 1.0
+
+    def warm(self, now: int):
+        '''再起動前に書き込んだ現在のバケットの値から集計を続ける。(ProcessRollup.warmと同じ)'''
+        start = now // self.every * self.every
+        self.start = start
+        self.table = {row[0]: list(row) for row in database.load_cgroup_rollup(self.rollup.every, start)}
+
+    def flush(self):
+        if self.start is None or not self.table:
+            return
+        database.write_cgroup_rollup(self.rollup.every, self.start, [tuple(data) for data in self.table.values()])
+        self.table = {}
+
+_system_rollups = [SystemStatsRollup(rollup) for rollup in settings.ROLLUPS]
+_process_rollups = [ProcessRollup(rollup) for rollup in settings.ROLLUPS]
+_cgroup_rollups = [CgroupRollup(rollup) for rollup in settings.ROLLUPS]
+
+def add_system_stats(t: int, **values: float):
+    row = tuple(float(values[field]) for field in recent.FIELDS)
+    for rollup in _system_rollups:
+        rollup.add(t, row)
+
+def add_processes(t: int, processes: list[tuple]):
+    for rollup in _process_rollups:
+        rollup.add(t, processes)
+
+def add_cgroups(t: int, cgroups: list[tuple]):
+    for rollup in _cgroup_rollups:
+        rollup.add(t, cgroups)
+
+def warm():
+    '''再起動前のサンプルも現在のバケットに含めるため、メモリ上の生サンプルと保存してあるロールアップで集計を始める。'''
+    now = time.time_ns()
+    try:
+        for rollup in _process_rollups + _cgroup_rollups:
+            rollup.warm(now)
+    except Exception as e:
+        logger.warning(f'failed to load rollups: {e}')
+    samples = recent.store.get_samples()
+    if not samples:
+        return
+    last = samples[-1][0]
+    for rollup in _system_rollups:
+        start = last // rollup.every * rollup.every
+        for t, row in samples:
+            if t >= start:
+                rollup.add(t, row)
+
+def flush():
+    '''終了時に集計途中のバケットを書き込む。'''
+    for rollup in _system_rollups + _process_rollups + _cgroup_rollups:
+        rollup.flush()
@@ -0,0 +1,94 @@
+import json
+import random
+import sys
+import time
+
+'''
+    サンプルごとのアラートの評価(job.alerts.AlertEngine.add)にかかる時間を、ルールの数を変えて計測する。
+
+    比較として、同じルールを毎回窓の全サンプルから計算し直す場合(ストレージへの問い合わせで判定するのに相当)も計る。
+    ルールは窓(60秒〜1時間)・統計量・閾値を変えて作るため、窓の数はルールの数ほどは増えない。
+
+    usage: python -m benchmark.alerts [サンプル数] [サンプルの間隔(秒)]
+'''
+
+def run(samples: int = 5000, interval: float = 1.0, rule_counts: tuple[int, ...] = (0, 10, 100, 1000)) -> list[dict]:
+    from backend.db import recent
+    from backend.job.alerts import AlertEngine
+
+    rng = random.Random(0)
+    series = []
+    t = 1_700_000_000 * 1_000_000_000
+    for _ in range(samples):
+        t += int(interval * 1_000_000_000)
+        series.append((t, dict(cpu_percent=rng.uniform(0, 100), mem_available=rng.uniform(1e9, 8e9), disk_used=rng.uniform(1e11, 2e11))))
+
+    results = []
+    for count in rule_counts:
+        rules = [_rule(k, rng) for k in range(count)]
+        engine = AlertEngine(rules)
+        elapsed = []
+        for t, stats in series:
+            t0 = time.perf_counter()
+            engine.add(t, stats, notify=False)
+            elapsed.append(time.perf_counter() - t0)
+        firing = sum(1 for alert in engine.alerts() if alert['state'] == 'firing')
+        results.append({
+            'benchmark': 'evaluate',
+            'impl': 'incremental',
+            'rules': count,
+            'windows': len(engine._windows),
+            'firing': firing,
+            **_summarize(elapsed),
+        })
+
+        # 比較: ルールごとに窓の全サンプルを走査する
+        if count:
+            history = recent.SampleRing(max(1, int(3600 / interval)) + 1)
+            elapsed = []
+            for t, stats in series[:min(len(series), 50)]:
+                t0 = time.perf_counter()
+                history.append(t, tuple(stats[field] for field in recent.FIELDS))
+                for rule in rules:
+                    k = recent.FIELDS.index(rule.metric)
+                    values = [row[k] for _, row in history.samples(t - int(rule.window_seconds * 1_000_000_000))]
+                    if rule.stat == 'max':
+                        max(values)
+                    elif rule.stat == 'min':
+                        min(values)
+                    else:
+                        sum(values) / len(values)
+                elapsed.append(time.perf_counter() - t0)
+            results.append({
+                'benchmark': 'evaluate',
+                'impl': 'rescan',
+                'rules': count,
+                **_summarize(elapsed),
+            })
+    return results
+
+def _rule(k: int, rng: random.Random):
+    from backend.job.alerts import AlertRule
+    metric = ('cpu_percent', 'mem_available', 'disk_used')[k % 3]
+    threshold = {'cpu_percent': 50.0, 'mem_available': 4e9, 'disk_used': 1.5e11}[metric] * rng.uniform(0.5, 1.5)
+    return AlertRule(
+        name=f'rule-{k}', metric=metric, stat=('max', 'min', 'mean')[k // 3 % 3],
+        window_seconds=(60, 300, 900, 3600)[k // 9 % 4], op=('>', '<')[k % 2], threshold=threshold,
+        for_seconds=(0, 60)[k // 36 % 2],
+    )
+
+def _summarize(elapsed: list[float]) -> dict:
+    ordered = sorted(elapsed)
+    return {
+        'count': len(ordered),
+        'mean_seconds': sum(ordered) / len(ordered),
+        'p50_seconds': ordered[len(ordered) // 2],
+        'p99_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        'max_seconds': ordered[-1],
+    }
+
+if __name__ == '__main__':
+    args = [int(sys.argv[1])] if len(sys.argv) > 1 else []
+    args += [float(sys.argv[2])] if len(sys.argv) > 2 else []
+    for result in run(*args):
+        print(json.dumps(result))
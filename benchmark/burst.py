@@ -0,0 +1,97 @@
+import gzip
+import json
+import random
+import sys
+import time
+from array import array
+
+'''
+    バースト測定のサンプルを保持するGorilla方式の圧縮(db.gorilla.GorillaSeries)を計測する。
+
+    - compress: 10ミリ秒間隔・--duration秒分の疑似的なサンプル(全体とコアごとのCPU使用率、メモリ、ディスク)を追記し、
+      1サンプルあたりの追記時間と大きさを、float64のまま(raw)・それをgzipした場合と比べる。展開(decode)の時間も計る
+    - sample: 実際のホストで1回の測定(cpu_times(percpu=True)・virtual_memory・disk_usage)にかかる時間
+
+    usage: python -m benchmark.burst [期間(秒)] [コア数]
+'''
+
+def run(duration: float = 300, cores: int = 16, interval_ms: int = 10) -> list[dict]:
+    from backend.db import gorilla, recent
+
+    fields = recent.FIELDS + tuple(f'cpu{k}' for k in range(cores))
+    rows = _synthetic_rows(int(duration * 1000 / interval_ms), cores, interval_ms)
+
+    series = gorilla.GorillaSeries(fields)
+    t0 = time.perf_counter()
+    for t, row in rows:
+        series.append(t, row)
+    append_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    columns = gorilla.decode(fields, series.snapshot())
+    decode_seconds = time.perf_counter() - t0
+    assert columns['time'] == [t for t, _ in rows]
+
+    raw = array('q', [t for t, _ in rows]).tobytes() + b''.join(array('d', [row[k] for _, row in rows]).tobytes() for k in range(len(fields)))
+    gzipped = len(gzip.compress(raw, compresslevel=6))
+    samples = len(rows)
+    return [{
+        'benchmark': 'compress',
+        'samples': samples,
+        'columns': len(fields) + 1,
+        'interval_ms': interval_ms,
+        'raw_bytes': len(raw),
+        'gzip_bytes': gzipped,
+        'gorilla_bytes': series.nbytes,
+        'gorilla_bytes_per_sample': series.nbytes / samples,
+        'ratio': len(raw) / series.nbytes,
+        'append_seconds_per_sample': append_seconds / samples,
+        'decode_seconds': decode_seconds,
+    }, _bench_sample()]
+
+def _synthetic_rows(count: int, cores: int, interval_ms: int) -> list[tuple[int, tuple[float, ...]]]:
+    '''CPU使用率は0.1刻み(コアごとは1ジフィの粒度)、メモリはゆっくり変わり、ディスクはほぼ一定にする。'''
+    rng = random.Random(0)
+    t = 1_700_000_000_000
+    mem = 8e9
+    disk = 5e11
+    ticks_per_sample = max(1, interval_ms // 10)
+    rows = []
+    for _ in range(count):
+        t += interval_ms + rng.choice((0, 0, 0, 0, 1, -1))    # スケジューラの揺らぎ
+        core_values = [round(100.0 * rng.randint(0, ticks_per_sample) / ticks_per_sample, 1) if rng.random() < 0.3 else 0.0 for _ in range(cores)]
+        mem += rng.choice((0, 0, 0, 4096, -4096))
+        if rng.random() < 0.01:
+            disk += 4096
+        rows.append((t, (round(sum(core_values) / cores, 1), mem, disk, *core_values)))
+    return rows
+
+def _bench_sample(repeat: int = 1000) -> dict:
+    import psutil
+    from backend.common import settings
+    from backend.job import burst
+
+    elapsed = []
+    prev = burst._cpu_busy_total(psutil.cpu_times(percpu=True))
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        current = burst._cpu_busy_total(psutil.cpu_times(percpu=True))
+        [burst._percent(b - lb, x - lx) for (b, x), (lb, lx) in zip(current, prev)]
+        psutil.virtual_memory()
+        psutil.disk_usage(settings.ROOTFS_PATH)
+        prev = current
+        elapsed.append(time.perf_counter() - t0)
+    ordered = sorted(elapsed)
+    return {
+        'benchmark': 'sample',
+        'cores': psutil.cpu_count(),
+        'count': repeat,
+        'mean_seconds': sum(ordered) / len(ordered),
+        'p99_seconds': ordered[int(len(ordered) * 0.99)],
+    }
+
+if __name__ == '__main__':
+    args = [float(sys.argv[1])] if len(sys.argv) > 1 else []
+    args += [int(sys.argv[2])] if len(sys.argv) > 2 else []
+    for result in run(*args):
+        print(json.dumps(result))
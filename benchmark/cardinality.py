@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .fake_influxdb import FakeInfluxDB
+from .suite import _summarize
+from .synthetic_proc import create_rootfs, remove_process, write_process
+
+'''
+    プロセスのスキーマ(settings.PROCESS_SCHEMA)ごとに、PIDが入れ替わり続けるホストで系列の数と問い合わせ時間を計測する。
+
+    synthetic_procの疑似/procで毎回--churn個のプロセスを終了させて新しいPIDで起動し直し、
+    procscanで選んだ上位のプロセスをInfluxDB(fake_influxdb)とSQLiteに書き込む。
+    新しいプロセスの名前は、繰り返し現れる名前(make, cc1, ...)と、1回きりの名前(job-<PID>)を混ぜる。
+
+    - process_series: InfluxDBに作られた系列の数(測定名とタグの組み合わせ)
+    - process_query: SQLiteで各窓の上位プロセスを問い合わせる時間
+
+    usage: python -m benchmark.cardinality [--processes N] [--churn N] [--ticks N] [--repeat N] [--output ファイル]
+'''
+
+_NAMES = ('make', 'cc1', 'cc1plus', 'ld', 'as', 'sh', 'python', 'node', 'java', 'git')    # 繰り返し現れる名前
+_UNIQUE_RATIO = 0.3         # 新しいプロセスのうち1回きりの名前にする割合
+_QUERY_WINDOWS = (60, 480, 3600)    # 問い合わせる窓の幅[秒]
+
+def main(argv: list[str]|None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.cardinality')
+    parser.add_argument('--processes', type=int, default=500, help='number of processes in the synthetic /proc')
+    parser.add_argument('--churn', type=int, default=50, help='processes replaced with new PIDs per tick')
+    parser.add_argument('--ticks', type=int, default=300, help='number of collect ticks (METRICS_INTERVAL apart)')
+    parser.add_argument('--repeat', type=int, default=20, help='number of measurements per query')
+    parser.add_argument('--output', type=Path, default=None, help='file to write JSON lines to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = args.output.open('w') if args.output else sys.stdout
+    def emit(result: dict):
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeInfluxDB() as server:
+        # NOTE: settingsは読み込み時に環境変数を見るため、backendを読み込む前に設定する
+        os.environ['INFLUXDB_URL'] = server.url
+        os.environ['SPOOL_PATH'] = str(Path(tmp) / 'spool')
+        from backend.common import settings
+
+        emit({
+            'benchmark': 'run',
+            'python': sys.version.split()[0],
+            'processes': args.processes,
+            'churn': args.churn,
+            'ticks': args.ticks,
+            'top_process_count': settings.TOP_PROCESS_COUNT,
+            'process_name_max': settings.PROCESS_NAME_MAX,
+        })
+        for schema in ('pid', 'name'):
+            for result in run(Path(tmp) / schema, server, schema, args.processes, args.churn, args.ticks, args.repeat):
+                emit(result)
+
+def run(root: Path, server: FakeInfluxDB, schema: str, process_count: int, churn: int, ticks: int, repeat: int) -> list[dict]:
+    from backend.common import settings
+    from backend.db.influxdb import InfluxDBStorage
+    from backend.db.sqlite import SQLiteStorage
+    from backend.job import procscan
+
+    settings.PROCESS_SCHEMA = schema
+    create_rootfs(root, process_count)
+    proc = root / 'proc'
+    scanner = procscan.ProcessScanner(str(proc))
+    key = procscan.NameRegistry(settings.PROCESS_NAME_MAX) if schema == 'name' else None
+    influxdb = InfluxDBStorage()
+    sqlite = SQLiteStorage(str(root / 'psmon.sqlite3'))
+    influxdb.init()
+    sqlite.init()
+    series_before = server.stats()['series']
+
+    rng = random.Random(0)
+    running = {pid: [f'worker-{pid % 97}', 0] for pid in range(1, process_count + 1)}   # pid -> [名前, CPU時間]
+    next_pid = process_count + 1
+    interval = settings.METRICS_INTERVAL * 1_000_000_000
+    now = time.time_ns()
+    t = now - ticks * interval
+    scan_seconds = []
+    names = set()
+    try:
+        for _ in range(ticks):
+            # 一部のプロセスを終了させ、新しいPIDで起動する
+            for pid in rng.sample(sorted(running), churn):
+                remove_process(proc, pid)
+                del running[pid]
+            for _ in range(churn):
+                name = f'job-{next_pid}' if rng.random() < _UNIQUE_RATIO else rng.choice(_NAMES)
+                running[next_pid] = [name, 0]
+                next_pid += 1
+            for pid in rng.sample(sorted(running), min(len(running), 2 * churn)) + list(range(next_pid - churn, next_pid)):
+                process = running[pid]
+                process[1] += rng.randrange(100)
+                write_process(proc, pid, process[0], process[1], 0, starttime=pid, io=process[1] * 4096)
+
+            t0 = time.perf_counter()
+            if key is not None:
+                key.begin()
+            processes = scanner.scan(settings.TOP_PROCESS_COUNT, key)
+            scan_seconds.append(time.perf_counter() - t0)
+            names.update(process[1] for process in processes)
+            influxdb.write_processes(t, processes)
+            sqlite.write_processes(t, processes)
+            t += interval
+        _wait_for_writes(influxdb)
+        _wait_for_writes(sqlite)
+
+        results = [{
+            'benchmark': 'process_series',
+            'schema': schema,
+            'series': server.stats()['series'] - series_before,
+            'distinct_names': len(names),
+            'scan': _summarize(scan_seconds),
+        }]
+        for window in _QUERY_WINDOWS:
+            elapsed = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                records = asyncio.run(sqlite.query_processes('cpu', t, window, t))
+                elapsed.append(time.perf_counter() - t0)
+            results.append({
+                'benchmark': 'process_query',
+                'schema': schema,
+                'window_seconds': window,
+                'records': len(records),
+                **_summarize(elapsed),
+            })
+        return results
+    finally:
+        influxdb.exit()
+        sqlite.exit()
+
+def _wait_for_writes(storage):
+    while storage.write_stats().queue_depth > 0:
+        time.sleep(0.01)
+
+if __name__ == '__main__':
+    main()
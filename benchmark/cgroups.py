@@ -0,0 +1,54 @@
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .synthetic_proc import create_rootfs, advance, create_cgroups, advance_cgroups
+
+'''
+    コンテナ・サービスごとの使用量の取得にかかる時間を、cgroupscan(cgroupごとにcpu.stat・memory.current・io.statを読む)と
+    procscan(全プロセスの/procを読んで上位を選ぶ)で比較する。
+
+    プロセス数が増えてもcgroupscanの時間はcgroupの数にしか比例しないことを確かめる。
+
+    usage: python -m benchmark.cgroups [プロセス数] [cgroup数] [繰り返し回数]
+'''
+
+def run(process_count: int = 5000, cgroup_count: int = 100, repeat: int = 5) -> list[dict]:
+    from backend.job import procscan, cgroupscan
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = create_rootfs(Path(tmp), process_count)
+        cgroup_path = str(create_cgroups(root, cgroup_count))
+        process_scanner = procscan.ProcessScanner(str(root / 'proc'))
+        cgroup_scanner = cgroupscan.CgroupScanner(cgroup_path)
+
+        results = []
+        cases = (
+            ('procscan', process_count, lambda: process_scanner.scan(20), lambda: advance(root, process_count)),
+            ('cgroupscan', cgroup_count, lambda: cgroup_scanner.scan(20), lambda: advance_cgroups(root, cgroup_count)),
+        )
+        for name, files, fn, step in cases:
+            fn()    # 前回値を作る
+            step()
+            elapsed = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                rows = fn()
+                elapsed.append(time.perf_counter() - t0)
+            results.append({
+                'benchmark': 'scan',
+                'impl': name,
+                'processes': process_count,
+                'cgroups': cgroup_count,
+                'entries': files,
+                'rows': len(rows),
+                'min_seconds': min(elapsed),
+                'mean_seconds': sum(elapsed) / len(elapsed),
+            })
+        return results
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:4]]
+    for result in run(*args):
+        print(json.dumps(result))
@@ -0,0 +1,262 @@
+import json
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+    ベンチマーク用に、InfluxDB v2の書き込み(/api/v2/write)と問い合わせ(/api/v2/query)だけを真似るHTTPサーバ。
+
+    書き込みは行数・バイト数・系列(測定名とタグの組み合わせ)の数を数えて捨てる。問い合わせはFluxを実行せず、クエリ中のrange・aggregateWindowから
+    行数を決めて、psmonのクエリが返すのと同じ列を持つCSVを生成して返す。
+    (dialectでannotationsが指定されていれば、influxdb-clientがFluxTableとして読めるannotated CSVにする)
+
+    usage:
+        with FakeInfluxDB(query_latency=0.01) as server:
+            os.environ['INFLUXDB_URL'] = server.url
+'''
+
+_FIELDS = ('cpu_percent', 'mem_available', 'disk_used')
+_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+# MARK: FakeInfluxDB
+class FakeInfluxDB:
+    def __init__(self, query_latency: float = 0.0, sample_interval: int = 6, process_count: int = 10):
+        '''
+        Args:
+            query_latency (float): 問い合わせごとに待つ秒数(DBの処理時間の代わり)
+            sample_interval (int): 生データを返すときのサンプル間隔(秒)
+            process_count (int): プロセスのCPU使用率の問い合わせで返す行数
+        '''
+        self.query_latency = query_latency
+        self.sample_interval = sample_interval
+        self.process_count = process_count
+        self.fail_writes = False    # Trueの間は書き込みに503を返す(DBの停止の代わり)
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.written_lines = 0
+        self.written_bytes = 0
+        self.queries = 0
+        self._series: set[bytes] = set()
+        self._server: ThreadingHTTPServer|None = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # NOTE: ヘッダと本文を別々に送るため、Nagleアルゴリズムで応答が遅れないようにする
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.startswith('/api/v2/write'):
+                    if server.fail_writes:
+                        self.send_response(503)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    server._on_write(body)
+                    self.send_response(204)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                elif self.path.startswith('/api/v2/query'):
+                    data = server._on_query(json.loads(body)).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/csv; charset=utf-8')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-influxdb', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                writes=self.writes, written_lines=self.written_lines, written_bytes=self.written_bytes,
+                series=len(self._series), queries=self.queries,
+            )
+
+    def _on_write(self, body: bytes):
+        lines = body.count(b'\n') + (1 if body and not body.endswith(b'\n') else 0)
+        series = {_series_key(line) for line in body.split(b'\n') if line}
+        with self._lock:
+            self._series |= series
+            self.writes += 1
+            self.written_lines += lines
+            self.written_bytes += len(body)
+
+    def _on_query(self, request: dict) -> str:
+        with self._lock:
+            self.queries += 1
+        if self.query_latency:
+            time.sleep(self.query_latency)
+        query = request.get('query', '')
+        annotated = bool((request.get('dialect') or {}).get('annotations', ['datatype']))
+        now = int(time.time())
+        if 'cgroup_stats' in query:
+            return _render_csv(annotated, *self._cgroup_table())
+        if 'value_count' in query:
+            m = re.search(r'window\(every:\s*(\w+)\)', query)
+            if m is None:
+                return _render_csv(annotated, *self._process_table())
+            # 窓(_start)ごとの上位プロセス
+            start, stop = _parse_range(query, now)
+            every = _parse_duration(m.group(1))
+            return _render_csv(annotated, *self._process_table(range(start - start % every, stop, every)))
+        if 'host_stats' in query:
+            return _render_csv(annotated, *self._host_stats_table(query, now))
+        start, stop = _parse_range(query, now)
+        every = _parse_every(query)
+        if every is None:
+            # 生データ(warm_recentのpivot)
+            times = range(start - start % self.sample_interval + self.sample_interval, stop, self.sample_interval)
+            return _render_csv(annotated, *_system_stats_table(times, list(_FIELDS)))
+        # NOTE: aggregateWindowは窓の終了時刻を_timeにするため、最後の窓はtruncate(now)で終わる
+        end = min(stop, now - now % every)
+        times = range(start - start % every + every, end + 1, every)
+        columns = [f'{field}_max' for field in _FIELDS] + [f'{field}_mean' for field in _FIELDS]
+        return _render_csv(annotated, *_system_stats_table(times, columns))
+
+    def _hosts(self) -> list[str]:
+        '''書き込まれたhost_statsの系列のhostタグ'''
+        with self._lock:
+            series = [key for key in self._series if key.startswith(b'host_stats,')]
+        hosts = set()
+        for key in series:
+            m = re.search(rb',host=((?:[^,\\]|\\.)+)', key)
+            if m:
+                hosts.add(m.group(1).decode())
+        return sorted(hosts)
+
+    def _host_stats_table(self, query: str, now: int):
+        m = re.search(r'r\.host == "([^"]+)"', query)
+        hosts = [m.group(1)] if m else self._hosts()
+        if 'last()' in query:
+            # ホストの一覧
+            header = [('_time', 'dateTime:RFC3339'), ('host', 'string'), ('mem_total', 'double'), ('disk_total', 'double')]
+            stamp = datetime.fromtimestamp(now, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            return header, [[stamp, host, '17179869184.0', '1099511627776.0'] for host in hosts]
+        start, stop = _parse_range(query, now)
+        every = _parse_every(query)
+        end = min(stop, now - now % every)
+        columns = [f'{field}_{stat}' for field in _FIELDS for stat in ('max', 'sum', 'count')]
+        header = [('_time', 'dateTime:RFC3339'), ('host', 'string')] + [(name, 'double') for name in columns]
+        rows = []
+        for t in range(start - start % every + every, end + 1, every):
+            stamp = datetime.fromtimestamp(t, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            count = every / self.sample_interval
+            for k, host in enumerate(hosts):
+                row = [stamp, host]
+                for i, _ in enumerate(_FIELDS):
+                    value = float((t // 60 + i * 7 + k * 3) % 100)
+                    row += [repr(value * 1.5), repr(value * count), repr(count)]
+                rows.append(row)
+        return header, rows
+
+    def _cgroup_table(self):
+        columns = [f'{metric}_{stat}' for metric in ('cpu', 'memory', 'read', 'write') for stat in ('max', 'sum')] + ['count']
+        header = [('cgroup', 'string')] + [(name, 'double') for name in columns]
+        rows = []
+        for k in range(self.process_count):
+            value = 100.0 / (k + 1)
+            row = [f'system.slice/service-{k}.service']
+            for scale in (1.0, 1e7, 1e5, 1e5):
+                row += [repr(value * scale * 1.5), repr(value * scale * 10)]
+            rows.append(row + ['10.0'])
+        return header, rows
+
+    def _process_table(self, windows=None):
+        header = [('pid', 'string'), ('name', 'string')] + [(name, 'double') for name in ('value_max', 'value_min', 'value_sum', 'value_count')]
+        if windows is not None:
+            header = [('_start', 'dateTime:RFC3339')] + header
+        rows = []
+        for t in (windows if windows is not None else [None]):
+            stamp = [] if t is None else [datetime.fromtimestamp(t, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')]
+            for k in range(self.process_count):
+                cpu = 100.0 / (k + 1)
+                rows.append(stamp + [str(1000 + k), f'worker-{k}', repr(cpu * 1.5), repr(cpu / 2), repr(cpu * 10), '10.0'])
+        return header, rows
+
+# MARK: subroutines
+
+def _series_key(line: bytes) -> bytes:
+    '''line protocolの行から系列のキー(測定名とタグ、最初のエスケープされていない空白まで)を取り出す。'''
+    i = line.find(b' ')
+    while i > 0 and line[i - 1] == 0x5c:    # '\\ 'はタグの値の中の空白
+        i = line.find(b' ', i + 1)
+    return line[:i] if i >= 0 else line
+
+def _system_stats_table(times, columns: list[str]):
+    header = [('_time', 'dateTime:RFC3339')] + [(name, 'double') for name in columns]
+    rows = []
+    for t in times:
+        stamp = datetime.fromtimestamp(t, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        rows.append([stamp] + [repr(float((t // 60 + k * 7) % 100)) for k in range(len(columns))])
+    return header, rows
+
+def _render_csv(annotated: bool, header: list[tuple[str, str]], rows: list[list[str]]) -> str:
+    lines = []
+    if annotated:
+        lines.append('#datatype,string,long,' + ','.join(datatype for _, datatype in header))
+        lines.append('#group,false,false,' + ','.join('false' for _ in header))
+        lines.append('#default,_result,,' + ','.join('' for _ in header))
+    lines.append(',result,table,' + ','.join(name for name, _ in header))
+    for row in rows:
+        lines.append(',_result,0,' + ','.join(row))
+    return '\r\n'.join(lines) + '\r\n\r\n'
+
+def _parse_duration(text: str) -> int:
+    return sum(int(n) * _UNITS[unit] for n, unit in re.findall(r'(\d+)([smhdw])', text))
+
+def _parse_time(text: str, now: int) -> int:
+    text = text.strip()
+    if text.startswith('-'):
+        return now - _parse_duration(text)
+    m = re.fullmatch(r'time\(v:\s*(\d+)\)', text)
+    if m:
+        return int(m.group(1)) // 1_000_000_000
+    return int(datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp())
+
+def _parse_range(query: str, now: int) -> tuple[int, int]:
+    m = re.search(r'range\(start:\s*(.+?)(?:,\s*stop:\s*(.+?))?\)\n', query)
+    if not m:
+        return now - 60 * 60, now
+    start = _parse_time(m.group(1), now)
+    stop = _parse_time(m.group(2), now) if m.group(2) else now
+    return start, stop
+
+def _parse_every(query: str) -> int|None:
+    m = re.search(r'aggregateWindow\(every:\s*(\w+)', query)
+    return _parse_duration(m.group(1)) if m else None
@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from .fake_influxdb import FakeInfluxDB
+
+'''
+    複数ホストのモード(エージェントと集約サーバ)を計測する。
+
+    - ingest: --agents台の疑似エージェント(backend.agent.Agentに合成したサンプルを積む)が--hours時間分のサンプルを
+      AGENT_SEND_INTERVALごとのバッチで/api/v1/ingestに送り、--concurrency並列での受け付けのスループットと、
+      ストレージへの書き込みが追いつくまでの時間を計る
+    - query: 全ホストをまとめた問い合わせ(host=*)と1ホストの問い合わせの、各DURATIONSのレイテンシ(キャッシュなし)
+    - agent: 実際のエージェント(python -m backend.agent)を別プロセスで動かし、CPU使用率と常駐メモリを計る
+      (送り先は本文を捨てるだけのHTTPサーバ)
+
+    usage: python -m benchmark.fleet [--storage sqlite|influxdb] [--agents N] [--hours N] [--concurrency N]
+                                     [--repeat N] [--agent-seconds 秒] [--output ファイル]
+'''
+
+def main(argv: list[str]|None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.fleet')
+    parser.add_argument('--storage', choices=['influxdb', 'sqlite'], default='sqlite', help='storage backend of the aggregator')
+    parser.add_argument('--agents', type=int, default=50, help='number of simulated agents')
+    parser.add_argument('--hours', type=float, default=3, help='hours of samples each agent sends')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent ingest requests')
+    parser.add_argument('--repeat', type=int, default=10, help='number of measurements per query case')
+    parser.add_argument('--agent-seconds', type=float, default=10, help='seconds to run a real agent process (0 to skip)')
+    parser.add_argument('--output', type=Path, default=None, help='file to write JSON lines to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = args.output.open('w') if args.output else sys.stdout
+    def emit(result: dict):
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeInfluxDB() as server:
+        # NOTE: settingsは読み込み時に環境変数を見るため、backendを読み込む前に設定する
+        os.environ['MODE'] = 'aggregator'
+        os.environ['INFLUXDB_URL'] = server.url
+        os.environ['STORAGE_BACKEND'] = args.storage
+        os.environ['SQLITE_PATH'] = str(Path(tmp) / 'psmon.sqlite3')
+        os.environ['LEADER_LOCK_PATH'] = str(Path(tmp) / 'psmon.lock')
+        os.environ['SHARED_RECENT_PATH'] = str(Path(tmp) / 'psmon.recent')
+        os.environ['SPOOL_PATH'] = str(Path(tmp) / 'spool')
+        os.environ['INGEST_TOKEN'] = 'benchmark'
+        os.environ['WRITE_FLUSH_INTERVAL'] = '0.2'     # 最後のバッチの書き込みを待つ時間を計測に含めないため
+        from fastapi.testclient import TestClient
+        from backend import create_app
+        from backend.common import settings
+
+        emit({
+            'benchmark': 'run',
+            'python': sys.version.split()[0],
+            'storage': args.storage,
+            'agents': args.agents,
+            'hours': args.hours,
+            'concurrency': args.concurrency,
+            'metrics_interval': settings.METRICS_INTERVAL,
+            'agent_send_interval': settings.AGENT_SEND_INTERVAL,
+        })
+        app = create_app(base_path=Path(__file__).parent.parent.resolve())
+        with TestClient(app) as client:
+            emit(bench_ingest(client, args.agents, args.hours, args.concurrency))
+            for result in bench_queries(client, args.agents, args.repeat):
+                emit(result)
+        if args.agent_seconds > 0:
+            emit(bench_agent(args.agent_seconds))
+
+    if args.output:
+        out.close()
+
+# MARK: ingest
+def bench_ingest(client, agents: int, hours: float, concurrency: int) -> dict:
+    '''各エージェントのバッチを作ってから、全エージェントのバッチを時刻順にconcurrency並列で送る。'''
+    from backend.agent import Agent
+    from backend.common import settings
+    from backend.db import database
+
+    interval = settings.METRICS_INTERVAL * 1_000_000_000
+    per_batch = max(1, int(settings.AGENT_SEND_INTERVAL // settings.METRICS_INTERVAL))
+    now = time.time_ns() // interval * interval
+    start = now - int(hours * 60 * 60) * 1_000_000_000
+    batches: list[list[tuple[str, bytes, int]]] = []   # 送る順(時刻順) -> エージェントごとの(ホスト, 本文, サンプル数)
+    for k in range(agents):
+        agent = Agent('http://aggregator', f'host-{k:04d}')
+        t = start
+        index = 0
+        while t < now:
+            for _ in range(per_batch):
+                # NOTE: ホストごとに値をずらし、全ホストのmaxとmeanが区別できるようにする
+                agent.add(t, (float((t // interval + k) % 100), 1e9 + k * 1e6, 5e11 + k * 1e9))
+                t += interval
+            last, count, body = agent.batch(16e9, 1e12)
+            agent.ack(last, count)
+            if index == len(batches):
+                batches.append([])
+            batches[index].append((agent.host, body, count))
+            index += 1
+
+    headers = {'content-type': 'application/json', 'content-encoding': 'gzip', 'authorization': 'Bearer benchmark'}
+    latencies = []
+    def post(item):
+        _, body, _ = item
+        t0 = time.perf_counter()
+        response = client.post('/api/v1/ingest', content=body, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code != 200:
+            raise Exception(f'ingest: {response.status_code} {response.text[:200]}')
+
+    requests = sum(len(items) for items in batches)
+    samples = sum(count for items in batches for _, _, count in items)
+    wire_bytes = sum(len(body) for items in batches for _, body, _ in items)
+    flushed = _flushed_lines()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for items in batches:
+            list(executor.map(post, items))
+    accepted = time.perf_counter() - t0
+    # ストレージへの書き込みが追いつくのを待つ(ロールアップも1行)
+    while _flushed_lines() - flushed < samples or database.get_write_stats().queue_depth:
+        time.sleep(0.05)
+    written = time.perf_counter() - t0
+    return {
+        'benchmark': 'ingest',
+        'agents': agents,
+        'requests': requests,
+        'samples': samples,
+        'wire_bytes': wire_bytes,
+        'bytes_per_sample': wire_bytes / samples if samples else None,
+        'accept_seconds': accepted,
+        'requests_per_second': requests / accepted if accepted else None,
+        'samples_per_second': samples / accepted if accepted else None,
+        'written_seconds': written,
+        'written_samples_per_second': samples / written if written else None,
+        **_summarize(latencies),
+    }
+
+def _flushed_lines() -> int:
+    from backend.db import database
+    return database.get_write_stats().flushed_lines
+
+# MARK: query
+def bench_queries(client, agents: int, repeat: int) -> list[dict]:
+    from backend.common import settings
+    from backend.db import cache
+    from backend.api.v1 import monitor
+
+    results = []
+    for host in ('*', 'host-0000'):
+        for index, duration in enumerate(settings.DURATIONS):
+            params = {'duration_index': index, 'host': host, 'format': 'json'}
+            elapsed = []
+            for _ in range(repeat):
+                cache.query_cache.clear()
+                monitor.response_cache.clear()
+                t0 = time.perf_counter()
+                response = client.get('/api/v1/monitor', params=params)
+                elapsed.append(time.perf_counter() - t0)
+                if response.status_code != 200:
+                    raise Exception(f'{params}: {response.status_code} {response.text[:200]}')
+            records = response.json()['records']
+            results.append({
+                'benchmark': 'query',
+                'host': host,
+                'duration': duration.name,
+                'points': len(records['time']),
+                'hosts_per_point': max(records['hosts'], default=0),
+                'response_bytes': len(response.content),
+                **_summarize(elapsed),
+            })
+    return results
+
+# MARK: agent
+def bench_agent(seconds: float) -> dict:
+    '''エージェントを1秒間隔で測定・2秒間隔で送るように動かし、CPU時間と常駐メモリを計る。'''
+    posts = []
+
+    class Sink(BaseHTTPRequestHandler):
+        def do_POST(self):
+            posts.append(len(self.rfile.read(int(self.headers.get('content-length', 0)))))
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    sink = ThreadingHTTPServer(('127.0.0.1', 0), Sink)
+    thread = threading.Thread(target=sink.serve_forever, daemon=True)
+    thread.start()
+    env = dict(
+        os.environ, MODE='agent', AGGREGATOR_URL=f'http://127.0.0.1:{sink.server_port}',
+        METRICS_INTERVAL='1', AGENT_SEND_INTERVAL='2', HOST_NAME='benchmark-agent',
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'backend.agent'], env=env, cwd=Path(__file__).parent.parent.resolve(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # NOTE: 起動(インポート)の分を除くため、最初の送信を受けてから計り始める
+        while not posts:
+            if process.poll() is not None:
+                raise Exception(f'agent exited: {process.returncode}')
+            time.sleep(0.05)
+        cpu0, t0 = _cpu_seconds(process.pid), time.perf_counter()
+        time.sleep(seconds)
+        cpu1, t1 = _cpu_seconds(process.pid), time.perf_counter()
+        rss = _status_kb(process.pid, 'VmRSS')
+        hwm = _status_kb(process.pid, 'VmHWM')
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=10)
+        sink.shutdown()
+    return {
+        'benchmark': 'agent',
+        'seconds': t1 - t0,
+        'cpu_percent': 100 * (cpu1 - cpu0) / (t1 - t0),
+        'rss_bytes': rss * 1024,
+        'peak_rss_bytes': hwm * 1024,
+        'posts': len(posts),
+        'mean_post_bytes': sum(posts) / len(posts),
+    }
+
+def _cpu_seconds(pid: int) -> float:
+    '''/proc/[pid]/statのutime + stime[秒]'''
+    fields = Path(f'/proc/{pid}/stat').read_text().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def _status_kb(pid: int, name: str) -> int:
+    for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+        if line.startswith(name + ':'):
+            return int(line.split()[1])
+    return 0
+
+# MARK: subroutines
+def _summarize(elapsed: list[float]) -> dict:
+    ordered = sorted(elapsed)
+    return {
+        'count': len(ordered),
+        'min_seconds': ordered[0],
+        'mean_seconds': sum(ordered) / len(ordered),
+        'p50_seconds': ordered[len(ordered) // 2],
+        'p95_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max_seconds': ordered[-1],
+    }
+
+if __name__ == '__main__':
+    main()
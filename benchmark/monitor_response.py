@@ -0,0 +1,80 @@
+import json
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from dateutil import tz
+
+'''
+    /api/v1/monitorのレスポンス生成にかかる時間とサイズを比較する。
+
+    - pydantic: 以前の実装(MonitorRecordのリスト → 転置 → MonitorResponseCompact)
+    - json: 列ごとのデータをそのままJSONにする実装
+    - binary: 列ごとのfloat64配列にする実装
+
+    usage: python -m benchmark.monitor_response [繰り返し回数]
+'''
+
+def _make_columns(count: int) -> dict[str, list]:
+    from backend.db import recent
+    start = 1_700_000_000_000
+    columns = {'time': [start + 60_000 * k for k in range(count)]}
+    for k, name in enumerate(recent.COLUMNS[1:]):
+        columns[name] = [(k + 1) * 1e9 / 7 + x / 3 for x in range(count)]
+    return columns
+
+def run(repeat: int = 20) -> list[dict]:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import BaseModel
+    from backend.api.v1 import monitor
+    from backend.db import database
+    from backend.common import settings
+
+    class LegacyResponseCompact(BaseModel):
+        timestamp: datetime
+        mem_total: float
+        disk_total: float
+        records: dict[str, list[datetime|float|None]]
+
+    results = []
+    for duration in settings.DURATIONS:
+        count = duration.period_seconds // duration.every_seconds
+        columns = _make_columns(count)
+        timestamp = datetime.now(tz=tz.UTC)
+        header = dict(timestamp=timestamp.isoformat(), mem_total=1.0, disk_total=1.0)
+
+        def pydantic_path():
+            records = database._convert_columns_to_list(columns)
+            res = monitor.MonitorResponse(timestamp=timestamp, mem_total=1.0, disk_total=1.0, records=records)
+            compact = defaultdict(list)
+            for record in res.records:
+                for key in monitor.MonitorRecord.model_fields.keys():
+                    compact[key].append(getattr(record, key))
+            res = LegacyResponseCompact(timestamp=timestamp, mem_total=1.0, disk_total=1.0, records=compact)
+            return json.dumps(jsonable_encoder(res)).encode()
+
+        for name, fn in (
+            ('pydantic', pydantic_path),
+            ('json', lambda: monitor.encode_columns_json(header, columns)),
+            ('binary', lambda: monitor.encode_columns_binary(header, columns)),
+        ):
+            elapsed = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                body = fn()
+                elapsed.append(time.perf_counter() - t0)
+            results.append({
+                'benchmark': 'monitor_response',
+                'impl': name,
+                'duration': duration.name,
+                'points': count,
+                'bytes': len(body),
+                'min_seconds': min(elapsed),
+                'mean_seconds': sum(elapsed) / len(elapsed),
+            })
+    return results
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:2]]
+    for result in run(*args):
+        print(json.dumps(result))
@@ -0,0 +1,54 @@
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .synthetic_proc import create_rootfs, advance
+
+'''
+    上位プロセスの取得にかかる時間を、psutil.process_iterとprocscanで比較する。
+
+    usage: python -m benchmark.procscan [プロセス数] [繰り返し回数]
+'''
+
+def run(process_count: int = 5000, repeat: int = 5) -> list[dict]:
+    import psutil
+    from backend.job import procscan
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = create_rootfs(Path(tmp), process_count)
+        proc_path = str(root / 'proc')
+        psutil.PROCFS_PATH = proc_path
+        scanner = procscan.ProcessScanner(proc_path)
+
+        def scan_psutil():
+            process_list = []
+            for process in psutil.process_iter(['pid', 'name']):
+                try:
+                    process_list.append((process.cpu_percent(), process.pid, process.name()))
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            return sorted(process_list, key=lambda x: x[0], reverse=True)[:10]
+
+        results = []
+        for name, fn in (('psutil', scan_psutil), ('procscan', lambda: scanner.scan(10))):
+            fn()    # 前回値を作る
+            advance(root, process_count)
+            elapsed = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                fn()
+                elapsed.append(time.perf_counter() - t0)
+            results.append({
+                'benchmark': 'top_cpu_processes',
+                'impl': name,
+                'processes': process_count,
+                'min_seconds': min(elapsed),
+                'mean_seconds': sum(elapsed) / len(elapsed),
+            })
+        return results
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:3]]
+    for result in run(*args):
+        print(json.dumps(result))
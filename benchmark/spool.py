@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .fake_influxdb import FakeInfluxDB
+
+'''
+    InfluxDBが止まって再起動するまでの間に書き込んだ行が、スプール(db.spool)によって失われずに届くかを計測する。
+
+    1. fake_influxdbが書き込みに503を返す間に--ticks回分の行を書き込む(停止中)
+    2. psmonを再起動する(ストレージを閉じて開き直す)
+    3. fake_influxdbを復旧させ、測定を続けながらスプールが空になるまでの時間を計る
+
+    spool=trueとspool=false(SPOOL_PATHが空、従来どおりメモリに戻すだけ)の両方で実行し、
+    InfluxDBに届いた行数(delivered_lines)を比べる。
+
+    usage: python -m benchmark.spool [--ticks N] [--replay-rate 行/秒] [--output ファイル]
+'''
+
+_LIVE_INTERVAL = 0.05   # 復旧後に測定を続ける間隔[秒]
+
+def main(argv: list[str]|None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.spool')
+    parser.add_argument('--ticks', type=int, default=5000, help='number of collect ticks written while InfluxDB is down')
+    parser.add_argument('--replay-rate', type=float, default=50000, help='SPOOL_REPLAY_RATE (lines per second)')
+    parser.add_argument('--output', type=Path, default=None, help='file to write JSON lines to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = args.output.open('w') if args.output else sys.stdout
+    with tempfile.TemporaryDirectory() as tmp, FakeInfluxDB() as server:
+        # NOTE: settingsは読み込み時に環境変数を見るため、backendを読み込む前に設定する
+        os.environ['INFLUXDB_URL'] = server.url
+        from backend.common import settings
+        settings.WRITE_FLUSH_INTERVAL = 0.2
+        settings.SPOOL_REPLAY_RATE = args.replay_rate
+        for spool in (True, False):
+            settings.SPOOL_PATH = str(Path(tmp) / 'spool') if spool else ''
+            out.write(json.dumps(run(server, args.ticks, spool)) + '\n')
+            out.flush()
+
+def run(server: FakeInfluxDB, ticks: int, spool: bool) -> dict:
+    from backend.common import settings
+    from backend.db.influxdb import InfluxDBStorage
+
+    processes = [(1000 + k, f'worker-{k}', 100.0 / (k + 1), 1e8 / (k + 1), 1e6 / (k + 1), 2e6 / (k + 1)) for k in range(settings.TOP_PROCESS_COUNT)]
+    lines_per_tick = 1 + len(processes)
+    written_before = server.stats()['written_lines']
+    t = time.time_ns() - ticks * 1_000_000_000
+
+    def write_tick(storage: InfluxDBStorage):
+        nonlocal t
+        storage.write_system_stats(t, dict(cpu_percent=1.0, mem_available=2.0, disk_used=3.0))
+        storage.write_processes(t, processes)
+        t += 1_000_000_000
+
+    # 停止中
+    server.fail_writes = True
+    storage = InfluxDBStorage()
+    storage.init()
+    t0 = time.perf_counter()
+    for _ in range(ticks):
+        write_tick(storage)
+    enqueue_seconds = time.perf_counter() - t0
+    storage.exit()  # 再起動: 書き込めなかった行はスプールに溜まるか、捨てられる
+
+    # 復旧後
+    storage = InfluxDBStorage()
+    storage.init()
+    live_ticks = 0
+    try:
+        write_tick(storage)
+        live_ticks += 1
+        # NOTE: 最初のputの後に書き込みスレッドがスプールを開くまで待つ
+        time.sleep(0.1)
+        spool_lines = storage.write_stats().spool_lines
+        spool_bytes = storage.write_stats().spool_bytes
+        server.fail_writes = False
+        t0 = time.perf_counter()
+        while storage.write_stats().spool_lines > 0:
+            write_tick(storage)
+            live_ticks += 1
+            time.sleep(_LIVE_INTERVAL)
+        drain_seconds = time.perf_counter() - t0
+        stats = storage.write_stats()
+    finally:
+        storage.exit()
+    expected = (ticks + live_ticks) * lines_per_tick
+    delivered = server.stats()['written_lines'] - written_before
+    return {
+        'benchmark': 'spool',
+        'spool': spool,
+        'outage_lines': ticks * lines_per_tick,
+        'enqueue_seconds': enqueue_seconds,
+        'spool_lines': spool_lines,
+        'spool_bytes': spool_bytes,
+        'bytes_per_line': spool_bytes / spool_lines if spool_lines else None,
+        'drain_seconds': drain_seconds,
+        'replay_lines_per_second': spool_lines / drain_seconds if spool and drain_seconds else None,
+        'replayed_lines': stats.replayed_lines,
+        'live_ticks': live_ticks,
+        'expected_lines': expected,
+        'delivered_lines': delivered,
+        'lost_lines': max(0, expected - delivered),
+    }
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .suite import _summarize
+
+'''
+    フロントエンドの静的ファイルを返す時間と転送量を、毎回ディスクから読むFileResponseと
+    起動時にメモリに読み込んだfrontend.StaticAssetで比較する。
+
+    public/の代わりに、Viteの出力に似た疑似的なファイル(index.htmlとハッシュ付きのJS・CSS)を作る。
+    (圧縮した版の時間には、テストクライアントが展開する時間も含まれる)
+
+    usage: python -m benchmark.static_assets [繰り返し回数]
+'''
+
+_FILES = {
+    'index.html': 1_000,
+    'assets/index-Bq3xY9aZ.js': 300_000,
+    'assets/index-C7dKq2Lm.css': 50_000,
+}
+
+def run(repeat: int = 200) -> list[dict]:
+    from fastapi import FastAPI
+    from fastapi.responses import FileResponse
+    from fastapi.testclient import TestClient
+    from backend import frontend
+
+    with tempfile.TemporaryDirectory() as tmp:
+        public_path = Path(tmp) / 'public'
+        rng = random.Random(0)
+        words = [f'w{k}' for k in range(500)]
+        for name, size in _FILES.items():
+            path = public_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            text = ' '.join(rng.choice(words) for _ in range(size // 4))
+            path.write_text(text[:size])
+
+        app = FastAPI()
+        # 変更前と同じく、リクエストごとにファイルシステムを確認してFileResponseで返す
+        @app.get('/disk/{path:path}')
+        def get_disk(path: str):
+            local_path = (public_path / path).resolve()
+            if local_path.is_relative_to(public_path) and local_path.is_file():
+                return FileResponse(local_path)
+            return FileResponse(public_path / 'index.html')
+        app.include_router(frontend.create_router(Path(tmp)))
+
+        cases = [
+            ('disk', '/disk/', {}),
+            ('memory', '/', {'accept-encoding': 'identity'}),
+            ('memory', '/', {'accept-encoding': 'gzip, deflate, br'}),
+            ('memory', '/', 'etag'),
+        ]
+        results = []
+        with TestClient(app) as client:
+            for name in (*_FILES, 'some/route'):
+                for impl, prefix, headers in cases:
+                    if headers == 'etag':
+                        etag = client.get(prefix + name, headers={'accept-encoding': 'gzip, br'}).headers['etag']
+                        headers = {'accept-encoding': 'gzip, br', 'if-none-match': etag}
+                    elapsed = []
+                    for _ in range(repeat):
+                        t0 = time.perf_counter()
+                        response = client.get(prefix + name, headers=headers)
+                        elapsed.append(time.perf_counter() - t0)
+                    results.append({
+                        'benchmark': 'static_asset',
+                        'impl': impl,
+                        'path': name,
+                        'accept_encoding': headers.get('accept-encoding'),
+                        'conditional': 'if-none-match' in headers,
+                        'status': response.status_code,
+                        'response_bytes': int(response.headers.get('content-length', 0)),
+                        **_summarize(elapsed),
+                    })
+        return results
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:2]]
+    for result in run(*args):
+        print(json.dumps(result))
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from .fake_influxdb import FakeInfluxDB
+from .synthetic_proc import create_rootfs, advance
+
+'''
+    外部サービスなしでpsmonの性能を計測する。
+
+    InfluxDBの代わりにfake_influxdb、ホストの/procの代わりにsynthetic_procの疑似ツリーを使い、
+    以下を計測して1行1件のJSONで出力する。(実行ごとの結果を比較できるよう、設定もrunイベントに含める)
+
+    - collect_metrics: collect_metricsの1回あたりの時間
+    - write: write_*_recordで書き込んだ行がInfluxDBに届くまでのスループット
+    - endpoint: /api/v1/monitor*の各エンドポイント・各DURATIONSのレイテンシとスループット
+      (source=memoryは直近データのメモリから、source=storageはメモリを使わずストレージに問い合わせた場合。
+      cache=missはクエリ結果とレスポンスのキャッシュを毎回消した場合、cache=not_modifiedはIf-None-Matchで304が返る場合。
+      response_bytesは展開後、wire_bytesは圧縮された転送量)
+
+    --storage sqliteの場合は、計測の前に--seed-hours分のデータ(生データとロールアップ)を書き込んでおく。
+
+    usage: python -m benchmark.suite [--storage influxdb|sqlite] [--processes N] [--repeat N] [--concurrency N]
+                                     [--query-latency 秒] [--output ファイル]
+'''
+
+def main(argv: list[str]|None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.suite')
+    parser.add_argument('--storage', choices=['influxdb', 'sqlite'], default='influxdb', help='storage backend to measure')
+    parser.add_argument('--seed-hours', type=int, default=8 * 24, help='hours of data written before measuring (sqlite only)')
+    parser.add_argument('--processes', type=int, default=1000, help='number of processes in the synthetic /proc')
+    parser.add_argument('--repeat', type=int, default=20, help='number of measurements per case')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of concurrent clients for throughput')
+    parser.add_argument('--query-latency', type=float, default=0.0, help='seconds the fake InfluxDB waits per query')
+    parser.add_argument('--write-ticks', type=int, default=2000, help='number of collect ticks written in the write benchmark')
+    parser.add_argument('--output', type=Path, default=None, help='file to write JSON lines to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = args.output.open('w') if args.output else sys.stdout
+    def emit(result: dict):
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeInfluxDB(query_latency=args.query_latency) as server:
+        root = create_rootfs(Path(tmp), args.processes)
+        # NOTE: settingsは読み込み時に環境変数を見るため、backendを読み込む前に設定する
+        os.environ['ROOTFS_PATH'] = str(root)
+        os.environ['INFLUXDB_URL'] = server.url
+        os.environ['STORAGE_BACKEND'] = args.storage
+        os.environ['SQLITE_PATH'] = str(Path(tmp) / 'psmon.sqlite3')
+        os.environ['LEADER_LOCK_PATH'] = str(Path(tmp) / 'psmon.lock')
+        os.environ['SHARED_RECENT_PATH'] = str(Path(tmp) / 'psmon.recent')
+        os.environ['SPOOL_PATH'] = str(Path(tmp) / 'spool')
+        from backend.common import settings
+
+        emit({
+            'benchmark': 'run',
+            'time': datetime.now(tz=timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'storage': args.storage,
+            'processes': args.processes,
+            'repeat': args.repeat,
+            'concurrency': args.concurrency,
+            'query_latency': args.query_latency,
+            'top_process_count': settings.TOP_PROCESS_COUNT,
+            'write_batch_size': settings.WRITE_BATCH_SIZE,
+        })
+        for result in bench_collect_metrics(root, args.processes, args.repeat):
+            emit(result)
+        for result in bench_write(server, args.write_ticks):
+            emit(result)
+        if args.storage == 'sqlite':
+            for result in seed_storage(args.seed_hours):
+                emit(result)
+        for result in bench_endpoints(server, args.repeat, args.concurrency):
+            emit(result)
+
+    if args.output:
+        out.close()
+
+# MARK: collect_metrics
+def bench_collect_metrics(root: Path, process_count: int, repeat: int) -> list[dict]:
+    from backend.db import database
+    from backend.job.metrics import collect_metrics
+
+    database.init()
+    try:
+        collect_metrics(True)
+        elapsed = []
+        for k in range(repeat):
+            # プロセスのCPU時間を進めるのは計測の外で行う
+            advance(root, process_count, seed=k)
+            t0 = time.perf_counter()
+            collect_metrics()
+            elapsed.append(time.perf_counter() - t0)
+    finally:
+        database.exit()
+    return [{'benchmark': 'collect_metrics', 'processes': process_count, **_summarize(elapsed)}]
+
+# MARK: write
+def bench_write(server: FakeInfluxDB, ticks: int) -> list[dict]:
+    from backend.common import settings
+    from backend.db import database
+
+    processes = [(1000 + k, f'worker-{k}', 100.0 / (k + 1), 1e8 / (k + 1), 1e6 / (k + 1), 2e6 / (k + 1)) for k in range(settings.TOP_PROCESS_COUNT)]
+    expected = server.stats()['written_lines'] + ticks * (1 + len(processes))
+    t = time.time_ns() - ticks * 1_000_000_000
+    database.init()
+    writer = database.storage.writer
+    try:
+        t0 = time.perf_counter()
+        for k in range(ticks):
+            time_ns = t + k * 1_000_000_000
+            database.write_system_stats_record(time_ns, cpu_percent=1.0, mem_available=2.0, disk_used=3.0)
+            database.write_process_record(time_ns, processes)
+        enqueued = time.perf_counter() - t0
+        # 最後のバッチは終了時のフラッシュで書き込まれる
+        database.exit()
+        elapsed = time.perf_counter() - t0
+    finally:
+        database.exit()
+    lines = ticks * (1 + len(processes))
+    if settings.STORAGE_BACKEND == 'influxdb':
+        delivered = server.stats()['written_lines'] >= expected
+    else:
+        delivered = writer.stats().flushed_lines >= lines
+    return [{
+        'benchmark': 'write',
+        'ticks': ticks,
+        'lines': lines,
+        'delivered': delivered,
+        'enqueue_seconds': enqueued,
+        'total_seconds': elapsed,
+        'lines_per_second': lines / elapsed if elapsed else None,
+    }]
+
+# MARK: seed
+def seed_storage(hours: int) -> list[dict]:
+    '''METRICS_INTERVAL間隔のhours時間分のサンプルを、collect_metricsと同じ経路(ロールアップ含む)で書き込む。'''
+    from backend.common import settings
+    from backend.db import database
+    from backend.job import rollup
+
+    interval = settings.METRICS_INTERVAL * 1_000_000_000
+    now = time.time_ns()
+    t = now - hours * 60 * 60 * 1_000_000_000
+    ticks = 0
+    database.init()
+    try:
+        t0 = time.perf_counter()
+        while t < now:
+            stats = dict(cpu_percent=float(ticks % 100), mem_available=float(ticks % 1000) * 1e6, disk_used=1e9)
+            processes = [(1000 + k, f'worker-{k}', 100.0 / (k + 1), 1e8 / (k + 1), 1e6 / (k + 1), 2e6 / (k + 1)) for k in range(settings.TOP_PROCESS_COUNT)]
+            rollup.add_system_stats(t, **stats)
+            database.write_system_stats_record(t, **stats)
+            rollup.add_processes(t, processes)
+            database.write_process_record(t, processes)
+            t += interval
+            ticks += 1
+            if ticks % 1000 == 0:
+                # NOTE: 書き込みキューがあふれないよう、フラッシュが追いつくのを待つ
+                while database.get_write_stats().queue_depth > settings.WRITE_QUEUE_MAX // 2:
+                    time.sleep(0.01)
+        rollup.flush()
+    finally:
+        database.exit()
+    return [{'benchmark': 'seed', 'hours': hours, 'ticks': ticks, 'seconds': time.perf_counter() - t0}]
+
+# MARK: endpoints
+def bench_endpoints(server: FakeInfluxDB, repeat: int, concurrency: int) -> list[dict]:
+    from fastapi.testclient import TestClient
+    from backend import create_app
+    from backend.common import settings
+    from backend.db import cache, recent
+    from backend.api.v1 import monitor
+
+    app = create_app(base_path=Path(__file__).parent.parent.resolve())
+    results = []
+    with TestClient(app) as client:
+        for source in ('memory', 'storage'):
+            if source == 'storage':
+                # NOTE: 空のストアに差し替えて、メモリからは返せないようにする
+                recent.store = recent.RecentStats()
+            for index, duration in enumerate(settings.DURATIONS):
+                time_param = (datetime.now(tz=timezone.utc) - timedelta(seconds=duration.every_seconds * 3)).isoformat()
+                cases = [
+                    ('/api/v1/monitor/json', {'duration_index': index}),
+                    ('/api/v1/monitor', {'duration_index': index, 'format': 'json'}),
+                    ('/api/v1/monitor', {'duration_index': index, 'format': 'binary'}),
+                    ('/api/v1/monitor', {'duration_index': index, 'format': 'json', 'max_points': 500}),
+                    ('/api/v1/monitor/process-cpu', {'duration_index': index, 'time': time_param}),
+                    ('/api/v1/monitor/process-rss', {'duration_index': index, 'time': time_param}),
+                    ('/api/v1/monitor/process-cpu/timeline', {'duration_index': index}),
+                ]
+                for path, params in cases:
+                    if source == 'memory' and '/process-' in path:
+                        continue    # プロセスの値は常にDBから取得する
+                    for mode in ('miss', 'hit', 'not_modified'):
+                        results.append(_bench_endpoint(
+                            client, (cache.query_cache, monitor.response_cache), server, path, params, repeat, concurrency, mode,
+                            dict(source=source, duration=duration.name),
+                        ))
+    return results
+
+def _bench_endpoint(client, caches, server, path, params, repeat, concurrency, mode, labels) -> dict:
+    headers = {'accept-encoding': 'gzip, br'}
+    def request():
+        if mode == 'miss':
+            for c in caches:
+                c.clear()
+        t0 = time.perf_counter()
+        response = client.get(path, params=params, headers=headers)
+        elapsed = time.perf_counter() - t0
+        if response.status_code not in ((200, 304) if mode == 'not_modified' else (200,)):
+            raise Exception(f'{path} {params}: {response.status_code} {response.text[:200]}')
+        if mode == 'not_modified' and response.status_code == 200:
+            headers['if-none-match'] = response.headers['etag']    # バケットが進んだ場合は取り直す
+        return elapsed, response
+
+    request()   # キャッシュ・接続・ETagを作る
+    queries = server.stats()['queries']
+    latencies = []
+    for _ in range(repeat):
+        elapsed, response = request()
+        latencies.append(elapsed)
+    # スループットはconcurrency個のクライアントから同時に要求した場合
+    count = repeat * concurrency
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda _: request(), range(count)))
+    wall = time.perf_counter() - t0
+    return {
+        'benchmark': 'endpoint',
+        'path': path,
+        'format': params.get('format'),
+        'max_points': params.get('max_points'),
+        **labels,
+        'cache': mode,
+        'response_bytes': len(response.content),
+        'wire_bytes': int(response.headers.get('content-length', 0)),
+        'content_encoding': response.headers.get('content-encoding'),
+        'db_queries': server.stats()['queries'] - queries,  # 計測中(レイテンシ+スループット)の問い合わせ数
+        **_summarize(latencies),
+        'requests_per_second': count / wall if wall else None,
+    }
+
+# MARK: subroutines
+def _summarize(elapsed: list[float]) -> dict:
+    ordered = sorted(elapsed)
+    return {
+        'count': len(ordered),
+        'min_seconds': ordered[0],
+        'mean_seconds': sum(ordered) / len(ordered),
+        'p50_seconds': ordered[len(ordered) // 2],
+        'p95_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max_seconds': ordered[-1],
+    }
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import random
+from pathlib import Path
+
+'''
+    ベンチマーク用に、指定した数のプロセスを持つ疑似的な/procツリーを作る。
+
+    psutil.PROCFS_PATHやprocscanはsettings.ROOTFS_PATH配下のprocを読むため、
+    ROOTFS_PATHをここで作ったディレクトリに向ければ実ホストに依存せずに計測できる。
+'''
+
+_STAT_TEMPLATE = (
+    '{pid} ({name}) S 1 {pid} {pid} 0 -1 4194560 1000 0 0 0 {utime} {stime} 0 0 20 0 1 0 '
+    '{starttime} 10000000 {rss} 18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0 0 0 0 0 0 0 0 0\n'
+)
+
+def create_rootfs(root: Path, process_count: int, seed: int = 0) -> Path:
+    '''root配下にproc/を作り、rootを返す。'''
+    proc = root / 'proc'
+    proc.mkdir(parents=True, exist_ok=True)
+    (proc / 'stat').write_text('cpu  100 0 100 1000 0 0 0 0 0 0\nbtime 1700000000\n')
+    (proc / 'uptime').write_text('1000.00 1000.00\n')
+    (proc / 'meminfo').write_text(
+        'MemTotal: 16384000 kB\nMemFree: 8192000 kB\nMemAvailable: 8192000 kB\nBuffers: 0 kB\nCached: 0 kB\n'
+        'Shmem: 0 kB\nActive: 0 kB\nInactive: 0 kB\nSReclaimable: 0 kB\nSlab: 0 kB\n'
+    )
+    rng = random.Random(seed)
+    for pid in range(1, process_count + 1):
+        write_process(proc, pid, f'worker-{pid % 97}', rng.randrange(1000), rng.randrange(1000))
+    return root
+
+def write_process(proc: Path, pid: int, name: str, utime: int, stime: int, starttime: int = 100, io: int = 0):
+    path = proc / str(pid)
+    path.mkdir(exist_ok=True)
+    (path / 'stat').write_text(_STAT_TEMPLATE.format(
+        pid=pid, name=name, utime=utime, stime=stime, starttime=starttime, rss=1024 + pid % 4096,
+    ))
+    (path / 'status').write_text(f'Name:\t{name}\nUid:\t0\t0\t0\t0\n')
+    (path / 'cmdline').write_bytes(name.encode() + b'\0')
+    (path / 'io').write_text(
+        f'rchar: 0\nwchar: 0\nsyscr: 0\nsyscw: 0\nread_bytes: {pid * 4096 + io}\nwrite_bytes: {pid * 8192 + 2 * io}\ncancelled_write_bytes: 0\n'
+    )
+
+def advance(root: Path, process_count: int, ticks: int = 10, seed: int = 1):
+    '''全プロセスのCPU時間と読み書きの量を進める。(次の測定でCPU使用率・読み書きが0にならないように)'''
+    rng = random.Random(seed)
+    proc = root / 'proc'
+    for pid in range(1, process_count + 1):
+        write_process(proc, pid, f'worker-{pid % 97}', 1000 + rng.randrange(ticks), 1000 + rng.randrange(ticks), io=rng.randrange(1 << 20))
+
+def remove_process(proc: Path, pid: int):
+    '''終了したプロセスとしてディレクトリを消す。'''
+    path = proc / str(pid)
+    for child in path.iterdir():
+        child.unlink()
+    path.rmdir()
+
+def create_cgroups(root: Path, cgroup_count: int, seed: int = 0) -> Path:
+    '''root配下にsys/fs/cgroup/(cgroup v2)を作り、system.slice配下にcgroup_count個のサービスを置く。'''
+    base = root / 'sys' / 'fs' / 'cgroup'
+    (base / 'system.slice').mkdir(parents=True, exist_ok=True)
+    (base / 'cgroup.controllers').write_text('cpu io memory pids\n')
+    rng = random.Random(seed)
+    for k in range(cgroup_count):
+        write_cgroup(base / 'system.slice' / f'service-{k}.service', rng.randrange(1 << 30), rng.randrange(1 << 30))
+    return base
+
+def write_cgroup(path: Path, usage: int, io: int):
+    path.mkdir(exist_ok=True)
+    (path / 'cpu.stat').write_text(f'usage_usec {usage}\nuser_usec {usage // 2}\nsystem_usec {usage - usage // 2}\n')
+    (path / 'memory.current').write_text(f'{(1 << 20) * (1 + usage % 8)}\n')
+    (path / 'io.stat').write_text(
+        f'8:0 rbytes={io} wbytes={2 * io} rios=1 wios=1 dbytes=0 dios=0\n'
+        f'8:16 rbytes={io // 2} wbytes={io} rios=1 wios=1 dbytes=0 dios=0\n'
+    )
+
+def advance_cgroups(root: Path, cgroup_count: int, seed: int = 1):
+    '''全cgroupのCPU時間と読み書きの量を進める。'''
+    rng = random.Random(seed)
+    base = root / 'sys' / 'fs' / 'cgroup' / 'system.slice'
+    for k in range(cgroup_count):
+        write_cgroup(base / f'service-{k}.service', (1 << 30) + rng.randrange(1 << 20), (1 << 30) + rng.randrange(1 << 20))
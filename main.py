@@ -3,9 +3,17 @@ from backend import create_app
 from backend.common import settings
 
 base_path = Path(__file__).parent.resolve()
-app = create_app(base_path=base_path)
+# NOTE: エージェントはAPIを公開せず、測定したサンプルを集約サーバに送るだけ
+app = create_app(base_path=base_path) if settings.MODE != 'agent' else None
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=settings.PORT)
-
+    if settings.MODE == 'agent':
+        from backend import agent
+        agent.run()
+    elif settings.WORKERS > 1:
+        import uvicorn
+        # ワーカーごとにappを作るため、インポート文字列で渡す(測定はリーダーの1プロセスだけが行う)
+        uvicorn.run("main:app", host="0.0.0.0", port=settings.PORT, workers=settings.WORKERS)
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=settings.PORT)
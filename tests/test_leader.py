@@ -0,0 +1,52 @@
+from pathlib import Path
+from unittest import mock
+import tempfile
+import threading
+import unittest
+from backend.job import leader
+
+class TestElection(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self._tmp.name) / 'psmon.lock')
+        patcher = mock.patch.object(leader, '_RETRY_SECONDS', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_follower_takes_over_when_leader_stops(self):
+        elected = threading.Event()
+        first = leader.Election(self.path, lambda: None)
+        second = leader.Election(self.path, elected.set)
+        try:
+            self.assertTrue(first.start())
+            self.assertFalse(second.start())
+            self.assertTrue(first.is_leader)
+            self.assertFalse(second.is_leader)
+            self.assertFalse(elected.wait(0.2))     # リーダーがいる間は引き継がない
+
+            first.stop()
+            self.assertTrue(elected.wait(5))
+            self.assertTrue(second.is_leader)
+            self.assertFalse(first.is_leader)
+        finally:
+            first.stop()
+            second.stop()
+
+    def test_stop_election_keeps_follower(self):
+        first = leader.Election(self.path, lambda: None)
+        second = leader.Election(self.path, lambda: None)
+        try:
+            self.assertTrue(first.start())
+            self.assertFalse(second.start())
+            second.stop_election()
+            first.stop()
+            self.assertFalse(second.is_leader)
+        finally:
+            first.stop()
+            second.stop()
+
+if __name__ == '__main__':
+    unittest.main()
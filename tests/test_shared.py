@@ -0,0 +1,84 @@
+from pathlib import Path
+import multiprocessing
+import struct
+import tempfile
+import unittest
+from backend.db import recent
+from backend.db.shared import Follower, SharedSamples, _HEADER, _SLOT
+
+_COUNT = 200000
+
+def _write(path: str, capacity: int, count: int):
+    shared = SharedSamples(path, capacity)
+    for seq in range(count):
+        shared.append(seq + 1, (float(seq + 1),) * len(recent.FIELDS))
+    shared.close()
+
+class TestSharedSamples(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self._tmp.name) / 'psmon.recent')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_read_rejects_slot_being_written_or_overwritten(self):
+        shared = SharedSamples(self.path, 2)
+        try:
+            for seq in range(3):
+                shared.append(seq + 1, (float(seq + 1),) * len(recent.FIELDS))
+            self.assertIsNone(shared.read(0))   # 通し番号2で上書きされた
+            self.assertEqual(shared.read(1), (2, (2.0,) * len(recent.FIELDS)))
+            # 書き込み中(seqが-1)のスロット
+            struct.pack_into('<q', shared._mm, _HEADER.size + _SLOT.size, -1)
+            self.assertIsNone(shared.read(1))
+            self.assertEqual(shared.samples(), (3, [(3, (3.0,) * len(recent.FIELDS))]))
+        finally:
+            shared.close()
+
+    def _start_writer(self, capacity: int) -> multiprocessing.Process:
+        # NOTE: 書き込みは別のプロセスで行い、ワーカー間と同じように並行して読む
+        writer = multiprocessing.get_context('spawn').Process(target=_write, args=(self.path, capacity, _COUNT))
+        writer.start()
+        return writer
+
+    def test_reader_never_sees_torn_slot(self):
+        capacity = 4    # 小さくして、読んでいる最中の上書きを起こしやすくする
+        shared = SharedSamples(self.path, capacity)
+        writer = self._start_writer(capacity)
+        try:
+            read = 0
+            while writer.is_alive() or read == 0:
+                end = shared.next_seq()
+                for seq in range(max(0, end - capacity), end):
+                    sample = shared.read(seq)
+                    if sample is None:
+                        continue
+                    t, row = sample
+                    self.assertEqual(t, seq + 1)
+                    self.assertEqual(row, (float(t),) * len(recent.FIELDS))
+                    read += 1
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+            self.assertEqual(shared.next_seq(), _COUNT)
+        finally:
+            writer.join()
+            shared.close()
+
+    def test_follower_receives_samples_in_order(self):
+        shared = SharedSamples(self.path, _COUNT)
+        received = []
+        follower = Follower(shared, lambda t, row: received.append((t, row)), shared.next_seq())
+        follower.start()
+        writer = self._start_writer(_COUNT)
+        try:
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+        finally:
+            follower.stop()
+            shared.close()
+        self.assertEqual([t for t, _ in received], list(range(1, _COUNT + 1)))
+        self.assertTrue(all(row == (float(t),) * len(recent.FIELDS) for t, row in received))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+from pathlib import Path
+import asyncio
+import tempfile
+import time as _time
+import unittest
+from backend.db.sqlite import SQLiteStorage
+from backend.db.storage import PROCESS_METRICS, _NS
+
+class TestPartitions(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self._tmp.name) / 'psmon.sqlite3')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_follower_sees_partition_created_by_leader(self):
+        # フォロワーがファイルを開いた後に、リーダーが新しいパーティションを作る
+        leader = SQLiteStorage(self.path)
+        follower = SQLiteStorage(self.path)
+        leader.init()
+        follower.init()
+        try:
+            every = 60 * _NS
+            time = _time.time_ns() // every * every
+            leader.write_processes(time - every // 2, [(1234, 'python', *[1.0] * len(PROCESS_METRICS))])
+            leader.writer.stop()    # 溜まっている行を書き込む
+            leader.writer = None
+            metric = PROCESS_METRICS[0]
+            expected = asyncio.run(leader.query_processes(metric, time, 60, time))
+            self.assertEqual([(p['pid'], p['name']) for p in expected], [(1234, 'python')])
+            self.assertEqual(asyncio.run(follower.query_processes(metric, time, 60, time)), expected)
+        finally:
+            leader.exit()
+            follower.exit()
+
+if __name__ == '__main__':
+    unittest.main()